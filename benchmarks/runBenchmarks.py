@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of libvector on synthetic vector files (see syntheticFiles.py).
+
+Times and memory-profiles building the vector index, the constructor (which reuses the cached 
+index), getGridded3d, getGridded2d, getGridded3dCustomLevels and the wrappers vector2gridded2d 
+and vector2gridded3d at several sizes. Run time is the best of a number of repeats, peak memory is the peak of memory allocated by Python and numpy during a 
+separate run (tracemalloc). Results can be saved and compared with an earlier run to track regressions:
+
+   python runBenchmarks.py --output before.json
+   (change code)
+   python runBenchmarks.py --compare before.json
+
+@author: L.vankampenhout@uu.nl
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+
+from syntheticFiles import generateCase, GRIDS
+
+from libvector import VectorMecVariable, VectorIndex, vector2gridded2d, vector2gridded3d
+
+CUSTOM_LEVS = [0., 200., 500., 1000., 1500., 2000., 2500., 3000., 3500.]
+VARNAME = 'QICE'
+
+
+def benchmarks(fnames, output_dir):
+   """
+   Returns the benchmarks of a synthetic case, as list of (name, function)
+   """
+   def construct(**kwargs):
+      return VectorMecVariable(VARNAME, fnames['vector'], **kwargs)
+
+   vmv = construct()
+   vmv.setGlcFracCouplerFile(fnames['cpl_hist'])
+   vmv.setGlcTopoCouplerFile(fnames['cpl_restart'])
+
+   vmv_nan = construct(backend='nan')
+   vmv_nan.mec_frac = vmv.mec_frac
+   vmv_nan.mec_topo = vmv.mec_topo
+
+   fname_out = os.path.join(output_dir, 'out.nc')
+   return [('VectorIndex', lambda: VectorIndex(fnames['vector'], 'column')),
+           ('constructor', lambda: construct()),
+           ('constructor mec_only', lambda: construct(mec_only=True)),
+           ('constructor lazy', lambda: construct(lazy=True)),
+           ('getGridded3d', lambda: vmv.getGridded3d()),
+           ('getGridded3d nan', lambda: vmv_nan.getGridded3d()),
+           ('getGridded2d', lambda: vmv.getGridded2d()),
+           ('getGridded2d nan', lambda: vmv_nan.getGridded2d()),
+           ('getGridded3dCustomLevels', lambda: vmv.getGridded3dCustomLevels(CUSTOM_LEVS)),
+           ('getGridded3dCustomLevels nan', lambda: vmv_nan.getGridded3dCustomLevels(CUSTOM_LEVS)),
+           ('vector2gridded2d', lambda: vector2gridded2d(vmv, fname_out)),
+           ('vector2gridded3d', lambda: vector2gridded3d(vmv, fname_out)),
+           ('vector2gridded3d custom levels', lambda: vector2gridded3d(vmv, fname_out, CUSTOM_LEVS)),
+           ]
+
+
+def measure(function, repeat):
+   """
+   Returns best run time (s) out of a number of repeats and peak allocated memory (bytes)
+   """
+   # the library reports progress on stdout, which is not part of the measurement
+   with contextlib.redirect_stdout(io.StringIO()):
+      times = []
+      for i in range(repeat):
+         t0 = time.perf_counter()
+         function()
+         times.append(time.perf_counter() - t0)
+
+      tracemalloc.start()
+      function()
+      current, peak = tracemalloc.get_traced_memory()
+      tracemalloc.stop()
+   return min(times), peak
+
+
+def runBenchmarks(grids, ntimes, repeat=3, data_dir=None, select=None):
+   """
+   Run all benchmarks for all combinations of grids and number of time steps
+
+   :param grids:     grid names (see syntheticFiles.GRIDS)
+   :param ntimes:    numbers of time steps
+   :param repeat:    number of timed runs per benchmark
+   :param data_dir:  directory of synthetic files (optional, default: temporary directory)
+   :param select:    only run benchmarks whose name contains this string (optional)
+   :returns:         list of dicts with keys size, name, time (s) and peak (bytes)
+   """
+   results = []
+   with tempfile.TemporaryDirectory() as tmp_dir:
+      for grid in grids:
+         for ntime in ntimes:
+            with contextlib.redirect_stdout(io.StringIO()):
+               fnames = generateCase(data_dir or tmp_dir, grid, ntime)
+               cases = benchmarks(fnames, tmp_dir)
+            size = '%s nt=%d' % (grid, ntime)
+            for name, function in cases:
+               if (select and select not in name):
+                  continue
+               seconds, peak = measure(function, repeat)
+               results.append(dict(size=size, name=name, time=seconds, peak=peak))
+               print('%-14s %-32s %9.3f s %9.1f MB' % (size, name, seconds, peak / 2.**20))
+               sys.stdout.flush()
+   return results
+
+
+def compareResults(results, baseline):
+   """
+   Print ratio of run time and peak memory with respect to a baseline
+   """
+   base = dict(((r['size'], r['name']), r) for r in baseline)
+   print('\n%-14s %-32s %9s %9s' % ('size', 'benchmark', 'time', 'memory'))
+   for r in results:
+      b = base.get((r['size'], r['name']))
+      if (b is None):
+         continue
+      print('%-14s %-32s %8.2fx %8.2fx' % (r['size'], r['name'], r['time'] / b['time'], r['peak'] / max(b['peak'], 1)))
+
+
+if __name__ == '__main__':
+   parser = argparse.ArgumentParser(description='Benchmark libvector on synthetic vector files')
+   parser.add_argument('--grids', nargs='+', default=['f19', 'f09'], choices=sorted(GRIDS.keys()))
+   parser.add_argument('--ntimes', nargs='+', type=int, default=[1, 12])
+   parser.add_argument('--repeat', type=int, default=3, help='number of timed runs per benchmark')
+   parser.add_argument('--data-dir', help='keep synthetic files in this directory')
+   parser.add_argument('--select', help='only run benchmarks whose name contains this string')
+   parser.add_argument('--output', help='save results to this JSON file')
+   parser.add_argument('--compare', help='compare results to an earlier JSON file')
+   args = parser.parse_args()
+
+   results = runBenchmarks(args.grids, args.ntimes, args.repeat, args.data_dir, args.select)
+   if (args.output):
+      with open(args.output, 'w') as f:
+         json.dump(results, f, indent=1)
+   if (args.compare):
+      with open(args.compare, 'r') as f:
+         compareResults(results, json.load(f))
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Generator of synthetic CLM vector files, for benchmarking libvector without access to CESM archives.
+
+A synthetic case consists of:
+
+   vector file             (XXX.clm2.h2.YYY.nc)    with cols1d_* and pfts1d_* metadata and a few variables
+   coupler restart file    (XXX.cpl.r.YYY.nc)      with MEC topography (l2gacc_lx_Sl_topoNN)
+   coupler history file    (XXX.cpl.hi.YYY.nc)     with glacier fraction (x2l_Sg_ice_covered0NN)
+   surfdat file            (surfdata_XXX.nc)       with glacier fraction (PCT_GLC_MEC_ICESHEET)
+
+Land covers about a third of the grid. Every land cell has a vegetated, lake and wetland column, 
+half of them also a crop column and a tenth five urban columns. Greenland, Antarctica and some 
+mountain cells carry a glacier landunit with a tundra column (coltype 400) and one to three MEC 
+columns (401-410) around the mean elevation of the cell. Columns are ordered by grid cell, as in CLM. 
+On the f09 grid (192x288) this gives about 100k columns, 16k of which are MEC columns.
+
+@author: L.vankampenhout@uu.nl
+"""
+import os
+import sys
+import numpy as np
+from netCDF4 import Dataset
+
+# include libvector package (directory) in local directory tree
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from libvector.common import GLC_NEC, COLUNIT_GLCMEC
+
+TOPO_BOUNDS = np.array([0., 200., 400., 700., 1000., 1300., 1600., 2000., 2500., 3000., 6000.]) # CLM default elevation classes
+
+# landunit types
+ISTSOIL = 1
+ISTCROP = 2
+ISTICE_MEC = COLUNIT_GLCMEC
+ISTDLAK = 5
+ISTWET = 6
+ISTURB_MD = 9
+
+GRIDS = {'f19' : (96, 144), 'f09' : (192, 288)}
+NPFT_SOIL = 4 # pfts per vegetated column, all other columns have a single pft
+
+
+def mecColtype(ec):
+   """ column type of MEC elevation class ec (0 is tundra) """
+   return ISTICE_MEC*100 + ec
+
+
+def syntheticSurface(nlat, nlon, seed=0):
+   """
+   Land mask, glacier mask and elevation of a synthetic planet
+
+   :returns:   tuple (lats, lons, land, glacier, elev), the last three numpy arrays (nlat, nlon)
+   """
+   rng = np.random.default_rng(seed)
+   lats = np.linspace(-90., 90., nlat)
+   lons = np.linspace(0., 360., nlon, endpoint=False)
+   lat2d, lon2d = np.meshgrid(lats, lons, indexing='ij')
+
+   # smooth continents plus noise
+   field = np.sin(np.deg2rad(2*lon2d)) * np.cos(np.deg2rad(3*lat2d)) + 0.5*rng.standard_normal((nlat, nlon))
+   land = field > 0.55
+
+   antarctica = lat2d < -65.
+   greenland = (lat2d > 60.) & (lat2d < 83.) & (lon2d > 300.) & (lon2d < 340.)
+   mountains = land & (rng.random((nlat, nlon)) < 0.01)
+   land |= antarctica | greenland
+   glacier = antarctica | greenland | mountains
+
+   # mean elevation of glacier cells, increasing towards the ice sheet interior
+   elev = np.zeros((nlat, nlon))
+   elev[antarctica] = 500. + 3000. * np.clip((-65. - lat2d[antarctica]) / 20., 0., 1.)
+   elev[greenland] = 300. + 2500. * np.clip(1. - np.abs(lon2d[greenland] - 318.) / 20., 0., 1.)
+   elev[mountains] = 1500.
+   elev += 200. * rng.standard_normal((nlat, nlon))
+   elev = np.where(glacier, np.clip(elev, 10., 4000.), 0.)
+   return lats, lons, land, glacier, elev
+
+
+def syntheticColumns(land, glacier, elev, seed=0):
+   """
+   Columns of all grid cells, ordered by grid cell
+
+   :returns:   dict of numpy arrays (ncol): cell, lunit, coltype, wtgcell and topo
+   """
+   rng = np.random.default_rng(seed + 1)
+   nlat, nlon = land.shape
+   cells_land = np.flatnonzero(land)
+   cells_crop = cells_land[rng.random(len(cells_land)) < 0.5]
+   cells_urban = cells_land[rng.random(len(cells_land)) < 0.1]
+   cells_glc = np.flatnonzero(glacier)
+
+   # each group: (cells, landunit type, column type, weight in grid cell)
+   groups = [(cells_land, ISTSOIL, 1, 0.5),
+             (cells_crop, ISTCROP, 2, 0.2),
+             (cells_land, ISTDLAK, 5, 0.05),
+             (cells_land, ISTWET, 6, 0.05)]
+   for k in range(5):
+      groups.append((cells_urban, ISTURB_MD, 71 + k, 0.01))
+
+   # glacier landunit: tundra column and MEC columns spanning +/- 1 class around the mean elevation
+   ec = np.searchsorted(TOPO_BOUNDS, elev.ravel()[cells_glc]) # 1 .. GLC_NEC
+   spread = rng.integers(0, 2, size=len(cells_glc))
+   groups.append((cells_glc, ISTICE_MEC, mecColtype(0), 0.02))
+   mec_cell, mec_ec = [], []
+   for k in range(1, GLC_NEC+1):
+      sel = np.abs(ec - k) <= spread
+      mec_cell.append(cells_glc[sel])
+      mec_ec.append(np.full(sel.sum(), k))
+   mec_cell = np.concatenate(mec_cell)
+   mec_ec = np.concatenate(mec_ec)
+
+   cell = np.concatenate([g[0] for g in groups] + [mec_cell])
+   lunit = np.concatenate([np.full(len(g[0]), g[1]) for g in groups] + [np.full(len(mec_cell), ISTICE_MEC)])
+   coltype = np.concatenate([np.full(len(g[0]), g[2]) for g in groups] + [mecColtype(mec_ec)])
+   wtgcell = np.concatenate([np.full(len(g[0]), g[3]) for g in groups] + [rng.uniform(0.05, 0.5, len(mec_cell))])
+
+   # topography of MEC columns inside their elevation class
+   topo = np.zeros(len(cell))
+   ismec = coltype > mecColtype(0)
+   k = coltype[ismec] - mecColtype(0)
+   topo[ismec] = TOPO_BOUNDS[k-1] + rng.uniform(0.2, 0.8, ismec.sum()) * (TOPO_BOUNDS[k] - TOPO_BOUNDS[k-1])
+
+   order = np.argsort(cell, kind='stable')
+   return dict(cell=cell[order], lunit=lunit[order], coltype=coltype[order], wtgcell=wtgcell[order], topo=topo[order])
+
+
+def writeVectorFile(fname, lats, lons, columns, ntime=12, seed=0):
+   """
+   Write a synthetic vector file with variables QICE, TSA, TOPO_COL, SNO_T (column) and FSR (pft)
+   """
+   rng = np.random.default_rng(seed + 2)
+   nlat, nlon = len(lats), len(lons)
+   ncol = len(columns['cell'])
+   ixy = columns['cell'] % nlon + 1
+   jxy = columns['cell'] // nlon + 1
+
+   # pfts: several on vegetated columns, one on all others
+   npft_col = np.where(columns['coltype'] == 1, NPFT_SOIL, 1)
+   pft_col = np.repeat(np.arange(ncol), npft_col)
+   npft = len(pft_col)
+
+   ismec = columns['coltype'] > mecColtype(0)
+   with Dataset(fname, 'w', format='NETCDF4') as fid:
+      fid.title = 'synthetic CLM vector file (libvector benchmarks)'
+      fid.createDimension('time', None)
+      fid.createDimension('hist_interval', 2)
+      fid.createDimension('lat', nlat)
+      fid.createDimension('lon', nlon)
+      fid.createDimension('column', ncol)
+      fid.createDimension('pft', npft)
+      fid.createDimension('levsno', 12)
+
+      time = fid.createVariable('time', 'f8', ('time',))
+      time.units = 'days since 2000-01-01 00:00:00'
+      time.calendar = 'noleap'
+      time.bounds = 'time_bounds'
+      time[:] = np.arange(1, ntime+1, dtype=np.float64)
+      fid.createVariable('time_bounds', 'f8', ('time', 'hist_interval'))[:] = np.stack([time[:] - 1., time[:]], axis=1)
+      fid.createVariable('lat', 'f4', ('lat',))[:] = lats
+      fid.createVariable('lon', 'f4', ('lon',))[:] = lons
+
+      def write(name, dim, dtype, values):
+         fid.createVariable(name, dtype, (dim,))[:] = values
+
+      write('cols1d_lon', 'column', 'f8', lons[ixy-1])
+      write('cols1d_lat', 'column', 'f8', lats[jxy-1])
+      write('cols1d_ixy', 'column', 'i4', ixy)
+      write('cols1d_jxy', 'column', 'i4', jxy)
+      write('cols1d_gi', 'column', 'i4', columns['cell'] + 1)
+      write('cols1d_wtgcell', 'column', 'f8', columns['wtgcell'])
+      write('cols1d_itype_lunit', 'column', 'i4', columns['lunit'])
+      write('cols1d_itype_col', 'column', 'i4', columns['coltype'])
+      write('cols1d_active', 'column', 'i4', np.ones(ncol))
+
+      write('pfts1d_lon', 'pft', 'f8', lons[ixy-1][pft_col])
+      write('pfts1d_lat', 'pft', 'f8', lats[jxy-1][pft_col])
+      write('pfts1d_ixy', 'pft', 'i4', ixy[pft_col])
+      write('pfts1d_jxy', 'pft', 'i4', jxy[pft_col])
+      write('pfts1d_gi', 'pft', 'i4', columns['cell'][pft_col] + 1)
+      write('pfts1d_ci', 'pft', 'i4', pft_col + 1)
+      write('pfts1d_wtcol', 'pft', 'f8', 1. / npft_col[pft_col])
+      write('pfts1d_wtgcell', 'pft', 'f8', columns['wtgcell'][pft_col] / npft_col[pft_col])
+      write('pfts1d_itype_veg', 'pft', 'i4', np.where(columns['coltype'][pft_col] == 1, pft_col % NPFT_SOIL + 1, 0))
+      write('pfts1d_itype_lunit', 'pft', 'i4', columns['lunit'][pft_col])
+      write('pfts1d_itype_col', 'pft', 'i4', columns['coltype'][pft_col])
+      write('pfts1d_active', 'pft', 'i4', np.ones(npft))
+
+      def variable(name, dims, long_name, units, values):
+         var = fid.createVariable(name, 'f4', dims, fill_value=1e36)
+         var.long_name = long_name
+         var.units = units
+         var[:] = values
+
+      # one time step at a time limits the memory needed by the generator
+      variable('TOPO_COL', ('time', 'column'), 'column-level topographic height', 'm', np.zeros((0, ncol)))
+      variable('QICE', ('time', 'column'), 'ice growth/melt', 'mm/s', np.zeros((0, ncol)))
+      variable('TSA', ('time', 'column'), '2m air temperature', 'K', np.zeros((0, ncol)))
+      variable('FSR', ('time', 'pft'), 'reflected solar radiation', 'W/m^2', np.zeros((0, npft)))
+      variable('SNO_T', ('time', 'levsno', 'column'), 'snow temperatures', 'K', np.zeros((0, 12, ncol)))
+      for t in range(ntime):
+         fid.variables['TOPO_COL'][t] = columns['topo']
+         qice = np.where(ismec, 1e-5 * (1. - columns['topo'] / 2000.), 1e36) + 1e-7 * rng.standard_normal(ncol)
+         fid.variables['QICE'][t] = qice
+         fid.variables['TSA'][t] = 270. - 0.0065 * columns['topo'] + rng.standard_normal(ncol)
+         fid.variables['FSR'][t] = 50. + 10. * rng.random(npft)
+         fid.variables['SNO_T'][t] = 260. + rng.random((12, ncol))
+
+
+def mecFields(nlat, nlon, columns):
+   """
+   MEC topography and glacier fraction (fraction of the glacier landunit) on the grid
+
+   :returns:   tuple (topo, frac), numpy arrays (GLC_NEC+1, nlat, nlon)
+   """
+   topo = np.zeros((GLC_NEC+1, nlat*nlon))
+   frac = np.zeros((GLC_NEC+1, nlat*nlon))
+   isglc = columns['lunit'] == ISTICE_MEC
+   ec = columns['coltype'][isglc] - mecColtype(0)
+   cell = columns['cell'][isglc]
+   topo[ec, cell] = columns['topo'][isglc]
+   frac[ec, cell] = columns['wtgcell'][isglc]
+   frac[0] = 0.0 # tundra is no glacier
+   total = frac.sum(axis=0)
+   frac = np.where(total > 0, frac / np.where(total > 0, total, 1.), 0.)
+   return topo.reshape(-1, nlat, nlon), frac.reshape(-1, nlat, nlon)
+
+
+def writeCouplerRestart(fname, topo):
+   """
+   Write MEC topography as found in a coupler restart file
+   """
+   with Dataset(fname, 'w', format='NETCDF4') as fid:
+      fid.createDimension('lx_nx', topo[0].size)
+      for i in range(GLC_NEC+1):
+         fid.createVariable('l2gacc_lx_Sl_topo%02d' % i, 'f8', ('lx_nx',))[:] = topo[i].ravel()
+
+
+def writeCouplerHistory(fname, frac):
+   """
+   Write glacier fraction as found in a coupler history file
+   """
+   with Dataset(fname, 'w', format='NETCDF4') as fid:
+      fid.createDimension('time', None)
+      fid.createDimension('y', frac.shape[1])
+      fid.createDimension('x', frac.shape[2])
+      for i in range(GLC_NEC+1):
+         fid.createVariable('x2l_Sg_ice_covered%02d' % i, 'f8', ('time', 'y', 'x'))[:] = frac[i][None,:,:]
+
+
+def writeSurfdat(fname, frac):
+   """
+   Write glacier fraction as found in a surfdat file (percent of glacier landunit)
+   """
+   with Dataset(fname, 'w', format='NETCDF4') as fid:
+      fid.createDimension('nglcec', GLC_NEC)
+      fid.createDimension('lsmlat', frac.shape[1])
+      fid.createDimension('lsmlon', frac.shape[2])
+      fid.createVariable('PCT_GLC_MEC_ICESHEET', 'f8', ('nglcec', 'lsmlat', 'lsmlon'))[:] = 100. * frac[1:]
+
+
+def generateCase(output_dir, grid='f09', ntime=12, seed=0):
+   """
+   Write a complete synthetic case (vector file, coupler restart and history file, surfdat file)
+
+   :param output_dir:   directory of output files
+   :param grid:         grid name (see GRIDS) or tuple (nlat, nlon)
+   :param ntime:        number of time steps in the vector file
+   :param seed:         seed of the random number generator
+   :returns:            dict with filenames: vector, cpl_restart, cpl_hist, surfdat
+   """
+   nlat, nlon = GRIDS[grid] if isinstance(grid, str) else grid
+   name = '%s_%dx%d_nt%d' % (grid if isinstance(grid, str) else 'grid', nlat, nlon, ntime)
+   fnames = dict(vector = os.path.join(output_dir, 'synthetic.%s.clm2.h2.nc' % name),
+                 cpl_restart = os.path.join(output_dir, 'synthetic.%s.cpl.r.nc' % name),
+                 cpl_hist = os.path.join(output_dir, 'synthetic.%s.cpl.hi.nc' % name),
+                 surfdat = os.path.join(output_dir, 'surfdata_synthetic.%s.nc' % name))
+
+   if (not os.path.isdir(output_dir)):
+      os.makedirs(output_dir)
+
+   lats, lons, land, glacier, elev = syntheticSurface(nlat, nlon, seed)
+   columns = syntheticColumns(land, glacier, elev, seed)
+   topo, frac = mecFields(nlat, nlon, columns)
+
+   writeVectorFile(fnames['vector'], lats, lons, columns, ntime, seed)
+   writeCouplerRestart(fnames['cpl_restart'], topo)
+   writeCouplerHistory(fnames['cpl_hist'], frac)
+   writeSurfdat(fnames['surfdat'], frac)
+   print('INFO: generateCase: %d columns, %d MEC columns, written to %s' % 
+         (len(columns['cell']), np.sum(columns['coltype'] > mecColtype(0)), fnames['vector']))
+   return fnames
+
+
+if __name__ == '__main__':
+   import argparse
+   parser = argparse.ArgumentParser(description='Generate a synthetic CLM vector case')
+   parser.add_argument('output_dir')
+   parser.add_argument('--grid', default='f09', choices=sorted(GRIDS.keys()))
+   parser.add_argument('--ntime', type=int, default=12)
+   parser.add_argument('--seed', type=int, default=0)
+   args = parser.parse_args()
+   generateCase(args.output_dir, args.grid, args.ntime, args.seed)
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   Read several variables from a single vector file in one pass, 
+   and use TOPO_COL from the same file for the custom levels.
+
+   The result is a NetCDF file per variable.
+"""
+import sys
+
+# include libvector package (directory) in local directory tree
+sys.path.insert(0, "..")
+
+from libvector import readVectorMecVariables, vector2gridded3d 
+
+fname_vector='/glade2/scratch2/lvank/archive/f.e20.FHIST.f09_001/lnd/hist/f.e20.FHIST.f09_001.clm2.h2.1983-05.nc'
+
+variables = readVectorMecVariables(["QICE", "QSNOMELT", "TSA", "TOPO_COL"], fname_vector)
+topo = variables.pop("TOPO_COL")
+
+# define custom levels
+levs = [100.0, 300.0, 550.0, 850.0, 1150.0, 1450.0, 1800.0, 2250.0, 2750.0, 3500.0] # MEC default midpoints 
+
+for varname, vmv in variables.items():
+   vmv.setGlcTopoVariable(topo)
+   vector2gridded3d(vmv, "%s_gridded3d_custom.nc" % varname.lower(), levs)
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   Converting a long (e.g. daily) vector file into a 3d gridded variable 
+   a number of time steps at a time, such that memory usage is bounded by 
+   the chunk size instead of the length of the file.
+
+   The result is a NetCDF file.
+"""
+import sys
+
+# include libvector package (directory) in local directory tree
+sys.path.insert(0, "..")
+
+from libvector import VectorMecVariable, vector2gridded3d 
+
+fname_vector='/glade2/scratch2/lvank/archive/f.e20.FHIST.f09_001/lnd/hist/f.e20.FHIST.f09_001.clm2.h1.1983-01-01-00000.nc'
+
+# only read metadata, data is read chunk by chunk
+vmv = VectorMecVariable("QSNOMELT", fname_vector, lazy=True)
+
+# grid and write 30 daily time steps at a time
+vector2gridded3d(vmv, "qsnomelt_gridded3d.nc", chunksize=30)
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   Converting several variables from all monthly vector files of a case in parallel,
+   using custom output levels. Topography is read once and shared with the workers.
+
+   The result is a NetCDF file per variable, containing the full time series.
+"""
+import sys
+
+# include libvector package (directory) in local directory tree
+sys.path.insert(0, "..")
+
+from libvector import VectorMecVariable, convertFiles 
+
+fnames_vector = '/glade2/scratch2/lvank/archive/f.e20.FHIST.f09_001/lnd/hist/f.e20.FHIST.f09_001.clm2.h2.19*.nc'
+fname_cpl_restart = "/glade2/scratch2/lvank/archive/f.e20.FHIST.f09_001/rest/1994-01-01-00000/f.e20.FHIST.f09_001.cpl.r.1994-01-01-00000.nc"
+
+# read topography once, using any variable of the case
+vmv = VectorMecVariable("QICE", '/glade2/scratch2/lvank/archive/f.e20.FHIST.f09_001/lnd/hist/f.e20.FHIST.f09_001.clm2.h2.1983-05.nc', lazy=True)
+vmv.setGlcTopoCouplerFile(fname_cpl_restart)
+
+# define custom levels
+levs = [100.0, 300.0, 550.0, 850.0, 1150.0, 1450.0, 1800.0, 2250.0, 2750.0, 3500.0] # MEC default midpoints 
+
+convertFiles(fnames_vector, ["QICE", "QSNOMELT", "TSA"], "gridded", custom_levs=levs, 
+             mec_topo=vmv.mec_topo, nprocs=8, concatenate=True)
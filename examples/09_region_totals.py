@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   Greenland and Antarctica integrated ice melt, computed directly from the 
+   vector data without gridding.
+
+   The result is printed.
+"""
+import sys
+import numpy as np
+
+# include libvector package (directory) in local directory tree
+sys.path.insert(0, "..")
+
+from libvector import VectorMecVariable, getIceSheetRegion
+
+fname_vector='/glade2/scratch2/lvank/archive/f.e20.FHIST.f09_001/lnd/hist/f.e20.FHIST.f09_001.clm2.h2.1983-05.nc'
+
+vmv = VectorMecVariable("QICE", fname_vector, mec_only=True)
+
+# Set glacier fraction per MEC column using coupler history file (fraction of grid cell)
+vmv.setGlcFracCouplerFile("/glade2/scratch2/lvank/archive/f.e20.FHIST.f09_001/cpl/hist/f.e20.FHIST.f09_001.cpl.hi.1980-01-01-00000.nc")
+
+# region 1: Antarctic ice sheet, region 2: Greenland ice sheet, from the ice sheet cells in the 
+# surface dataset (a lat/lon box around Greenland also holds the Canadian Arctic ice caps)
+fname_surfdat = "/glade/p/cesmdata/cseg/inputdata/lnd/clm2/surfdata_map/surfdata_0.9x1.25_78pfts_CMIP6_simyr1850_c170824.nc"
+regions = np.zeros((vmv.nlat, vmv.nlon), dtype=int)
+for i, name in enumerate(["AIS", "GrIS"]):
+   jslice, islice, mask = getIceSheetRegion(name, fname_surfdat).resolve(vmv.lats, vmv.lons)
+   regions[mask] = i + 1
+
+# QICE is in mm/s = kg/m2/s, so totals are in kg/s
+totals, means = vmv.getRegionTotals(regions)
+print("AIS: %.3e Gt/yr, GrIS: %.3e Gt/yr" % tuple(totals[0] * 86400. * 365 / 1e12))
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   Monthly climatology of ice melt over many monthly vector files, 
+   accumulated in vector space while streaming through the files.
+
+   The result is gridded once and written to a netCDF file.
+"""
+import sys
+
+# include libvector package (directory) in local directory tree
+sys.path.insert(0, "..")
+
+from libvector import aggregateFiles, vector2gridded3d
+
+fnames_vector = '/glade2/scratch2/lvank/archive/f.e20.FHIST.f09_001/lnd/hist/f.e20.FHIST.f09_001.clm2.h2.19*.nc'
+
+# other periods are 'mean', 'sum', 'annual' and 'seasonal'
+vmv = aggregateFiles(fnames_vector, "QICE", period='monthly', mec_only=True)
+
+vector2gridded3d(vmv, "QICE_climatology.nc")
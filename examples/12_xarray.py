@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   Lazily gridded surface temperature at custom levels as an xarray DataArray.
+   Only the selected month is read, gridded and interpolated.
+
+   Requires the packages xarray and dask. The result is printed.
+"""
+import sys
+
+# include libvector package (directory) in local directory tree
+sys.path.insert(0, "..")
+
+from libvector import VectorMecVariable, vector2xarray
+
+fname_vector='/glade2/scratch2/lvank/archive/f.e20.FHIST.f09_001/lnd/hist/f.e20.FHIST.f09_001.clm2.h2.1980-1989.nc'
+fname_cpl_restart = "/glade2/scratch2/lvank/archive/f.e20.FHIST.f09_001/rest/1994-01-01-00000/f.e20.FHIST.f09_001.cpl.r.1994-01-01-00000.nc"
+
+vmv = VectorMecVariable("TSA", fname_vector, lazy=True)
+vmv.setGlcTopoCouplerFile(fname_cpl_restart)
+
+levs = [0., 500., 1000., 1500., 2000., 2500., 3000.]
+da = vector2xarray(vmv, custom_levs=levs, chunksize=1)
+
+# Greenland, July 1985
+greenland = da.sel(time='1985-07', lat=slice(58, 85), lon=slice(280, 350))
+print(greenland.mean(dim=('lat', 'lon')).compute())
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   Reflected solar radiation (FSR) is a pft variable. It is aggregated to columns
+   with the pft weights (pfts1d_wtcol), then written on MEC levels like any column variable.
+
+   Gridcell means over all landunits are printed.
+"""
+import sys
+import numpy as np
+
+# include libvector package (directory) in local directory tree
+sys.path.insert(0, "..")
+
+from libvector import VectorMecVariable, vector2gridded3d
+
+fname_vector='/glade2/scratch2/lvank/archive/f.e20.FHIST.f09_001/lnd/hist/f.e20.FHIST.f09_001.clm2.h2.1983-05.nc'
+
+vmv = VectorMecVariable("FSR", fname_vector)
+
+# weighted mean of the pfts of every column, missing values are excluded
+vmv_col = vmv.pft2col()
+vector2gridded3d(vmv_col, "FSR_col.nc")
+
+# weighted mean of all pfts of every gridcell (pfts1d_wtgcell)
+fsr_gcell = vmv.aggregate('gridcell')
+print("mean FSR over all gridcells: %.2f %s" % (np.ma.mean(fsr_gcell), vmv.units))
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   Writing surface temperature at custom levels to a memory-mapped raw array 
+   and to a Zarr store, for fast access to time series of single grid points.
+   Chunks of 12 monthly time steps are gridded and written on 4 threads.
+
+   The Zarr store requires the package zarr. A time series is printed.
+"""
+import sys
+
+# include libvector package (directory) in local directory tree
+sys.path.insert(0, "..")
+
+from libvector import VectorMecVariable, vector2array, openRawArray
+
+fname_vector='/glade2/scratch2/lvank/archive/f.e20.FHIST.f09_001/lnd/hist/f.e20.FHIST.f09_001.clm2.h2.1980-1989.nc'
+fname_cpl_restart = "/glade2/scratch2/lvank/archive/f.e20.FHIST.f09_001/rest/1994-01-01-00000/f.e20.FHIST.f09_001.cpl.r.1994-01-01-00000.nc"
+
+vmv = VectorMecVariable("TSA", fname_vector, lazy=True)
+vmv.setGlcTopoCouplerFile(fname_cpl_restart)
+
+levs = [0., 500., 1000., 1500., 2000., 2500., 3000.]
+vector2array(vmv, "tsa_levs.raw", custom_levs=levs, store='raw', chunksize=12, nworkers=4)
+vector2array(vmv, "tsa_levs.zarr", custom_levs=levs, store='zarr', chunking='timeseries', chunksize=120, nworkers=4)
+
+# time series at 1000 m of a single Greenland grid point, only this part of the file is read
+data, metadata = openRawArray("tsa_levs.raw")
+print(metadata['dimensions'], metadata['attributes']['units'])
+print(data[:, 2, 176, 254])
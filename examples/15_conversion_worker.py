@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+   Converting several variables through a persistent worker, which keeps the grid 
+   information, topography and interpolation weights in memory between jobs.
+   Start the worker first, in another shell:
+
+      python -m libvector worker serve
+
+   The output files are NetCDF.
+"""
+import sys
+
+# include libvector package (directory) in local directory tree
+sys.path.insert(0, "..")
+
+from libvector import submitJob
+
+fname_vector='/glade2/scratch2/lvank/archive/f.e20.FHIST.f09_001/lnd/hist/f.e20.FHIST.f09_001.clm2.h2.1980-1989.nc'
+fname_cpl_restart = "/glade2/scratch2/lvank/archive/f.e20.FHIST.f09_001/rest/1994-01-01-00000/f.e20.FHIST.f09_001.cpl.r.1994-01-01-00000.nc"
+
+levs = [0., 500., 1000., 1500., 2000., 2500., 3000.]
+for varname in ["TSA", "QICE", "QSNOMELT"]:
+   response = submitJob(dict(file=fname_vector, variable=varname, output=varname.lower() + "_levs.nc", 
+                             custom_levs=levs, topo_coupler_restart=fname_cpl_restart))
+   print(response['output'], '%.2f s' % response['elapsed'])
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: L.vankampenhout@uu.nl
+"""
+import numpy as np
+
+
+class GatheredField(object):
+   """
+   Gridded field with levels that is stored on a subset of grid cells only, 
+   typically the cells that contain ice. This follows the CF convention 
+   "compression by gathering": the cells are identified by their flat index 
+   ilat*nlon + ilon into the (lat, lon) grid.
+
+   Missing values are masked (backend 'masked') or NaN (backend 'nan'), 
+   depending on the type of data.
+   """
+
+   def __init__(self, data, cells, lats, lons):
+      """
+      :param data:      field values
+      :param cells:     flat grid cell indices (ilat*nlon + ilon)
+      :param lats:      latitudes of the full grid
+      :param lons:      longitudes of the full grid
+      :type data:       numpy array (ntime,ncell,nlev) or (ntime,nlayer,ncell,nlev)
+      :type cells:      numpy array (ncell)
+      """
+      self.data = data
+      self.cells = cells
+      self.lats = lats
+      self.lons = lons
+
+      self.ntime = data.shape[0]
+      self.ncell, self.nlev = data.shape[-2:]
+      self.nlat = len(lats)
+      self.nlon = len(lons)
+
+
+   def getLatLonIndices(self):
+      """
+      Returns grid indices of the cells
+
+      :returns:   tuple (ilat, ilon) of numpy arrays (ncell)
+      """
+      return np.divmod(self.cells, self.nlon)
+
+
+   def expand(self):
+      """
+      Returns the field on the full grid, with the same layout as 
+      VectorMecVariable.getGridded3d() and getGridded3dCustomLevels()
+
+      :returns:   numpy array (ntime,nlat,nlon,nlev), with layers (ntime,nlayer,nlat,nlon,nlev)
+      """
+      shape = self.data.shape[:-2] + (self.nlat,self.nlon,self.nlev)
+      if (np.ma.isMaskedArray(self.data)):
+         var_out = np.ma.zeros(shape, dtype=self.data.dtype)
+         var_out[:] = np.ma.masked
+      else:
+         var_out = np.full(shape, np.nan, dtype=self.data.dtype)
+
+      ilat, ilon = self.getLatLonIndices()
+      var_out[..., ilat, ilon, :] = self.data
+      return var_out
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Precomputed vertical interpolation from MEC classes to custom levels.
+
+For a given case the MEC topography and the custom levels are fixed, so the interpolation
+weights (see interpLevels) only need to be derived once. An InterpOperator holds them as a
+sparse matrix from the MEC classes of the grid cells with ice to the custom levels of these
+cells, with two entries per row: the bracketing classes. It is applied to any variable and
+any number of time steps at once, gathering the values directly from the MEC columns of
+the vector, without building gridded or gathered MEC levels first.
+
+Operators can be saved to and read from NetCDF weight files, in the row / col / S layout of
+ESMF regridding weight files. They are cached in memory by the content of the topography and
+the levels, and on disk if a cache directory is set (see glcCache.setCacheDir). Weight files
+are read only once, until they change.
+
+@author: L.vankampenhout@uu.nl
+"""
+import os
+import hashlib
+import tempfile
+from collections import OrderedDict
+import numpy as np
+from netCDF4 import Dataset
+
+from .common import GLC_NEC, logger
+from .interpLevels import computeInterpWeights, applyFlatWeights, emptyShared
+from .glcCache import getCacheDir
+
+LRU_MAXSIZE = 8 # maximum number of operators kept in memory
+
+_operators = OrderedDict()
+
+
+class InterpOperator(object):
+   """
+   Interpolation weights from MEC classes to custom levels, for the grid cells that
+   contain at least one MEC column with a valid topographic height
+
+      cells          flat grid cell indices (ilat*nlon + ilon)
+      lo, hi         MEC class (0..GLC_NEC-1) of the bracketing columns of every (cell, level)
+      wlo, whi       their weights
+      single         cells with a single MEC column, which are constantly extrapolated
+   """
+
+   def __init__(self, cells, weights, custom_levs, grid_shape):
+      """
+      :param cells:        flat grid cell indices
+      :param weights:      tuple (lo, hi, wlo, whi) as returned by computeInterpWeights()
+      :param custom_levs:  custom levels
+      :param grid_shape:   shape (nlat, nlon) of the grid
+      :type cells:         numpy array (ncell)
+      :type custom_levs:   python list
+      :type grid_shape:    tuple
+      """
+      self.cells = np.asarray(cells)
+      self.lo, self.hi, self.wlo, self.whi = weights
+      self.custom_levs = [float(lev) for lev in custom_levs]
+      self.grid_shape = tuple(grid_shape)
+      self.ncell, self.nlev = self.lo.shape
+      self.single = (self.lo[:,0] == self.hi[:,0])
+
+
+   def matches(self, custom_levs, grid_shape):
+      """
+      Returns whether the operator interpolates to custom_levs on a grid of shape grid_shape
+      """
+      return (self.custom_levs == [float(lev) for lev in custom_levs] and self.grid_shape == tuple(grid_shape))
+
+
+   def crop(self, window):
+      """
+      Returns the operator on a window of the grid (see VectorIndex.cropField)
+
+      :param window:    tuple (jslice, islice)
+      :returns:         InterpOperator
+      """
+      jslice, islice = window
+      nlat, nlon = self.grid_shape
+      ilat, ilon = np.divmod(self.cells, nlon)
+      j0, j1, _ = jslice.indices(nlat)
+      i0, i1, _ = islice.indices(nlon)
+      keep = (ilat >= j0) & (ilat < j1) & (ilon >= i0) & (ilon < i1)
+      cells = (ilat[keep] - j0) * (i1 - i0) + (ilon[keep] - i0)
+      weights = (self.lo[keep], self.hi[keep], self.wlo[keep], self.whi[keep])
+      return InterpOperator(cells, weights, self.custom_levs, (j1 - j0, i1 - i0))
+
+
+   def select(self, mask):
+      """
+      Returns the operator on the grid cells in a mask only, e.g. of a region 
+
+      :param mask:      boolean numpy array (nlat, nlon)
+      :returns:         InterpOperator
+      """
+      keep = mask.ravel()[self.cells]
+      weights = (self.lo[keep], self.hi[keep], self.wlo[keep], self.whi[keep])
+      return InterpOperator(self.cells[keep], weights, self.custom_levs, self.grid_shape)
+
+
+   def getSources(self, vmv):
+      """
+      Returns the positions in the data of a VectorMecVariable of the values that are used,
+      and the weights with lo and hi as positions into these values. A (cell, class) without
+      MEC column refers to the position after the last value, which holds a missing value.
+
+      :param vmv:    VectorMecVariable instance
+      :returns:      tuple (cols, weights)
+      """
+      if (vmv.var_type == "lon"):
+         # not unstructured, every class has the value of the grid cell
+         lo = np.repeat(np.arange(self.ncell)[:,None], self.nlev, axis=1)
+         return self.cells, (lo, lo, self.wlo, self.whi)
+
+      # position in the data of the MEC column of every (cell, class), -1 if not present
+      lookup = np.full(vmv.nlat*vmv.nlon, -1, dtype=int)
+      lookup[self.cells] = np.arange(self.ncell)
+      pos = lookup[vmv.index.mec_cell]
+      keep = (pos >= 0)
+      source = np.full(self.ncell*GLC_NEC, -1, dtype=int)
+      source[pos[keep] * GLC_NEC + vmv.index.mec_lev[keep]] = vmv.getMecColumns()[keep]
+
+      offset = np.arange(self.ncell)[:,None] * GLC_NEC
+      src_lo = source[offset + self.lo]
+      src_hi = source[offset + self.hi]
+      cols = np.unique(np.concatenate((src_lo[src_lo >= 0], src_hi[src_hi >= 0])))
+      lo = np.where(src_lo >= 0, np.searchsorted(cols, src_lo), len(cols))
+      hi = np.where(src_hi >= 0, np.searchsorted(cols, src_hi), len(cols))
+      return cols, (lo, hi, self.wlo, self.whi)
+
+
+   def apply(self, vmv):
+      """
+      Interpolate the data of a VectorMecVariable to the custom levels, all time steps at once.
+      Missing values (NaN) propagate with backend 'nan'; with backend 'masked', constant
+      extrapolation keeps the mask of the single MEC column.
+
+      :param vmv:    VectorMecVariable instance, grid shape must match
+      :returns:      masked or NaN numpy array (ntime,ncell,nlev)
+      """
+      if ((vmv.nlat, vmv.nlon) != self.grid_shape):
+         raise ValueError('grid dimensions do not match!')
+
+      cols, weights = self.getSources(vmv)
+      values = vmv.data.reshape((vmv.ntime, -1))[:, cols]
+      ncol = len(cols)
+
+      # the last column holds missing MEC columns, emptyShared avoids a copy for a process pool
+      if (vmv.backend == 'nan'):
+         fill = emptyShared((vmv.ntime, ncol + 1), values.dtype)
+         fill[:, :ncol] = values
+         fill[:, ncol] = np.nan
+         return applyFlatWeights(fill, weights).astype(np.float32)
+
+      # missing MEC columns are zero and masked, as in getGathered()
+      fill = emptyShared((vmv.ntime, ncol + 1), np.result_type(np.ma.getdata(values).dtype, np.float64))
+      fill[:, :ncol] = np.ma.getdata(values)
+      fill[:, ncol] = 0.
+      mask = np.ma.getmaskarray(values) | (fill[:, :ncol] > 1e34)
+      mask = np.concatenate((mask, np.ones((vmv.ntime, 1), dtype=bool)), axis=1)
+      mask = mask[:, weights[0]] & self.single[None,:,None]
+      return np.ma.masked_array(applyFlatWeights(fill, weights), mask=mask)
+
+
+   def save(self, filename):
+      """
+      Save the operator as a NetCDF weight file: destination (cell, level) row,
+      source (cell, class) col and weight S of all entries, indices starting at 1
+
+      :param filename:  filename of weight file
+      :type filename:   string
+      """
+      offset = np.arange(self.ncell)[:,None] * GLC_NEC
+      nrow = self.ncell * self.nlev
+      col = np.empty(2*nrow, dtype=np.int32)
+      col[0::2] = (offset + self.lo).ravel() + 1
+      col[1::2] = (offset + self.hi).ravel() + 1
+      S = np.empty(2*nrow)
+      S[0::2] = self.wlo.ravel()
+      S[1::2] = self.whi.ravel()
+
+      # write to a temporary file first, so other processes never see a partial file
+      dirname = os.path.dirname(os.path.abspath(filename))
+      fd, fname_tmp = tempfile.mkstemp(suffix='.nc', dir=dirname)
+      os.close(fd)
+      with Dataset(fname_tmp, 'w', format='NETCDF4') as ncfile:
+         ncfile.title = 'Interpolation weights from MEC classes to custom levels'
+         ncfile.nlat, ncfile.nlon = self.grid_shape
+         ncfile.nclass = GLC_NEC
+         ncfile.createDimension('n_s', 2*nrow)
+         ncfile.createDimension('n_a', self.ncell * GLC_NEC)
+         ncfile.createDimension('n_b', nrow)
+         ncfile.createDimension('cell', self.ncell)
+         ncfile.createDimension('lev', self.nlev)
+
+         var = ncfile.createVariable('row', 'i4', ('n_s',))
+         var.long_name = 'destination index: cell * nlev + lev + 1'
+         var[:] = np.repeat(np.arange(nrow, dtype=np.int32), 2) + 1
+         var = ncfile.createVariable('col', 'i4', ('n_s',))
+         var.long_name = 'source index: cell * nclass + class + 1'
+         var[:] = col
+         var = ncfile.createVariable('S', 'f8', ('n_s',))
+         var.long_name = 'weight'
+         var[:] = S
+         var = ncfile.createVariable('cell', 'i4', ('cell',))
+         var.long_name = 'flat grid cell index ilat*nlon + ilon'
+         var[:] = self.cells
+         var = ncfile.createVariable('lev', 'f8', ('lev',))
+         var.units = 'm'
+         var[:] = self.custom_levs
+      os.replace(fname_tmp, filename)
+
+
+def readInterpOperator(filename):
+   """
+   Read an operator from a weight file written by InterpOperator.save()
+
+   :param filename:  filename of weight file
+   :returns:         InterpOperator
+   """
+   with Dataset(filename, 'r') as ncfile:
+      grid_shape = (int(ncfile.nlat), int(ncfile.nlon))
+      nclass = int(ncfile.nclass)
+      cells = ncfile.variables['cell'][:].astype(int)
+      custom_levs = list(ncfile.variables['lev'][:])
+      col = ncfile.variables['col'][:].astype(int) - 1
+      S = ncfile.variables['S'][:]
+
+   ncell, nlev = len(cells), len(custom_levs)
+   if (nclass != GLC_NEC or len(col) != 2*ncell*nlev):
+      raise ValueError('%s is not an interpolation weight file of this version' % filename)
+   offset = np.arange(ncell)[:,None] * nclass
+   lo = col[0::2].reshape(ncell, nlev) - offset
+   hi = col[1::2].reshape(ncell, nlev) - offset
+   wlo = np.ma.getdata(S[0::2]).reshape(ncell, nlev)
+   whi = np.ma.getdata(S[1::2]).reshape(ncell, nlev)
+   return InterpOperator(cells, (lo, hi, wlo, whi), custom_levs, grid_shape)
+
+
+def readCachedInterpOperator(filename):
+   """
+   Returns the operator of a weight file, reading it only once (until the file changes)
+
+   :param filename:  filename of weight file
+   :returns:         InterpOperator
+   """
+   stat = os.stat(filename)
+   key = ('file', os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+   if (key in _operators):
+      _operators.move_to_end(key)
+      return _operators[key]
+
+   operator = readInterpOperator(filename)
+   _operators[key] = operator
+   if (len(_operators) > LRU_MAXSIZE):
+      _operators.popitem(last=False)
+   return operator
+
+
+def buildInterpOperator(mec_topo, custom_levs):
+   """
+   Derive the operator from the MEC topography
+
+   :param mec_topo:     MEC topographic height, class 0 is tundra
+   :param custom_levs:  custom levels
+   :type mec_topo:      numpy array (GLC_NEC+1, nlat, nlon)
+   :type custom_levs:   python list
+   :returns:            InterpOperator
+   """
+   nlat, nlon = mec_topo.shape[1:]
+   mec_mask = np.any(mec_topo, axis=0)
+   logger.info('using %d grid points out of a total %d', mec_mask.sum(), nlat * nlon)
+
+   # mask out all tundra columns
+   mec_topo2 = np.ma.array(mec_topo, copy=True)
+   mec_topo2[0,:,:] = np.ma.masked
+
+   # mask out missing MEC columns (they have 0 height)
+   mec_topo2 = np.ma.masked_less(mec_topo2, 1e-3)
+
+   nvalid = np.ma.any(mec_topo2, axis=0).sum()
+   logger.info('removing %d invalid grid points: they only contained tundra class (%d remaining)', mec_mask.sum() - nvalid, nvalid)
+   mec_mask = np.any(mec_topo2, axis=0)
+
+   # gather grid points that contain at least 1 MEC column
+   ilat, ilon = np.where(mec_mask)
+   cells = ilat * nlon + ilon
+
+   # elevations of all MEC classes that exist, NaN otherwise
+   # indices are shifted by one due to presence of tundra class in mec_topo
+   xp = np.ma.filled(mec_topo2[1:, ilat, ilon], np.nan).T # ncell, GLC_NEC
+
+   return InterpOperator(cells, computeInterpWeights(xp, custom_levs), custom_levs, (nlat, nlon))
+
+
+def _operatorKey(mec_topo, custom_levs):
+   """
+   Key of an operator: hash of the topography (values and mask) and the levels
+   """
+   h = hashlib.sha1()
+   h.update(np.ascontiguousarray(np.ma.getdata(mec_topo)).tobytes())
+   h.update(np.ma.getmaskarray(mec_topo).tobytes())
+   h.update(repr((mec_topo.shape, str(mec_topo.dtype), [float(lev) for lev in custom_levs])).encode())
+   return h.hexdigest()
+
+
+def getCachedInterpOperator(mec_topo, custom_levs):
+   """
+   Returns the operator of a topography and custom levels, building it only once
+   (in memory and, if a cache directory is set, on disk)
+
+   :param mec_topo:     MEC topographic height (GLC_NEC+1, nlat, nlon)
+   :param custom_levs:  custom levels
+   :returns:            InterpOperator
+   """
+   key = _operatorKey(mec_topo, custom_levs)
+   if (key in _operators):
+      _operators.move_to_end(key)
+      return _operators[key]
+
+   operator = None
+   cache_dir = getCacheDir()
+   if (cache_dir != None):
+      fname = os.path.join(cache_dir, 'interp_%s.nc' % key)
+      if (os.path.exists(fname)):
+         operator = readInterpOperator(fname)
+         logger.info('read interpolation weights from disk cache')
+
+   if (operator == None):
+      operator = buildInterpOperator(mec_topo, custom_levs)
+      if (cache_dir != None):
+         if (not os.path.isdir(cache_dir)):
+            os.makedirs(cache_dir)
+         operator.save(fname)
+
+   _operators[key] = operator
+   if (len(_operators) > LRU_MAXSIZE):
+      _operators.popitem(last=False)
+   return operator
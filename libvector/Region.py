@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Regions of the lat/lon grid, e.g. a single ice sheet, to which reading, gridding
+and writing can be restricted (see VectorMecVariable, argument region)
+
+The named regions are approximate lat/lon boxes: the Greenland box also holds the ice caps
+of the Canadian Arctic and Iceland. An ice sheet proper is the part of its box with ice sheet
+in the surface dataset (PCT_GLC_MEC_ICESHEET), see getIceSheetRegion().
+
+@author: L.vankampenhout@uu.nl
+"""
+import hashlib
+import numpy as np
+from netCDF4 import Dataset
+
+# named regions, as approximate lat/lon boxes of cell centers
+REGIONS = {
+   'greenland_box'   : dict(lat=(58., 85.), lon=(280., 350.)), # includes Canadian Arctic and Iceland
+   'antarctica_box'  : dict(lat=(-90., -60.)),                 # south of 60S
+}
+
+# ice sheets: box that contains the ice sheet, see getIceSheetRegion()
+ICE_SHEETS = {
+   'GrIS' : 'greenland_box',
+   'AIS'  : 'antarctica_box',
+}
+
+
+class Region(object):
+   """
+   Part of the lat/lon grid, given by
+
+      lat, lon    box of cell centers in degrees, (south, north) and (west, east);
+                  longitudes in 0..360, the box may not cross longitude 0
+      ilat, ilon  index window (start, stop) into the grid, stop is exclusive
+      mask        boolean mask (nlat, nlon) of the cells in the region
+
+   Omitted directions span the whole grid. With both a box (or window) and a mask,
+   the region holds the masked cells within the box. Gridded output covers the smallest window
+   that holds the region; with a mask, only the columns in the masked cells are used.
+   """
+
+   def __init__(self, lat=None, lon=None, ilat=None, ilon=None, mask=None, name=None):
+      """
+      :param lat:    latitude range (south, north) (optional)
+      :param lon:    longitude range (west, east) (optional)
+      :param ilat:   latitude index window (start, stop) (optional)
+      :param ilon:   longitude index window (start, stop) (optional)
+      :param mask:   cells in the region (optional)
+      :param name:   name used in log messages (optional)
+      :type mask:    numpy array (nlat, nlon) of booleans
+      """
+      if ((lat != None and ilat != None) or (lon != None and ilon != None)):
+         raise ValueError('a region is either a lat/lon box or an index window')
+      if (lon != None and (lon[0] % 360.) > (lon[1] % 360.)):
+         raise ValueError('longitude range %s crosses longitude 0, which is not supported' % str(lon))
+
+      self.lat = None if (lat == None) else tuple(float(x) for x in lat)
+      self.lon = None if (lon == None) else tuple(float(x) for x in lon)
+      self.ilat = None if (ilat == None) else tuple(int(x) for x in ilat)
+      self.ilon = None if (ilon == None) else tuple(int(x) for x in ilon)
+      self.mask = None if (mask is None) else np.asarray(mask, dtype=bool)
+      self.name = name
+
+
+   def __repr__(self):
+      if (self.name != None):
+         return 'Region(%s)' % self.name
+      return 'Region(lat=%s, lon=%s, ilat=%s, ilon=%s%s)' % (self.lat, self.lon, self.ilat, self.ilon,
+                                                            '' if (self.mask is None) else ', mask')
+
+
+   def getKey(self):
+      """
+      Returns a hashable key that identifies the region (used to cache vector indices)
+      """
+      mask = None if (self.mask is None) else (self.mask.shape, hashlib.sha1(self.mask.tobytes()).hexdigest())
+      return (self.lat, self.lon, self.ilat, self.ilon, mask)
+
+
+   def resolve(self, lats, lons):
+      """
+      Returns the window of the region in a grid and the cells in the region
+
+      :param lats:   latitudes of the grid
+      :param lons:   longitudes of the grid
+      :returns:      tuple (jslice, islice, mask), mask (nlat, nlon) of the whole grid
+      """
+      nlat, nlon = len(lats), len(lons)
+      if (self.mask is not None and self.mask.shape != (nlat, nlon)):
+         raise ValueError('grid dimensions do not match!')
+      jsel = np.ones(nlat, dtype=bool)
+      isel = np.ones(nlon, dtype=bool)
+      if (self.lat != None):
+         jsel = (lats >= self.lat[0]) & (lats <= self.lat[1])
+      elif (self.ilat != None):
+         jsel[:] = False
+         jsel[slice(*self.ilat)] = True
+      if (self.lon != None):
+         lon = np.mod(lons, 360.)
+         isel = (lon >= self.lon[0] % 360.) & (lon <= self.lon[1] % 360.)
+      elif (self.ilon != None):
+         isel[:] = False
+         isel[slice(*self.ilon)] = True
+      mask = jsel[:,None] & isel[None,:]
+      if (self.mask is not None):
+         mask = mask & self.mask
+
+      jj, ii = np.nonzero(mask)
+      if (len(jj) == 0):
+         raise ValueError('%s contains no grid cells' % str(self))
+      return slice(int(jj.min()), int(jj.max())+1), slice(int(ii.min()), int(ii.max())+1), mask
+
+
+def getIceSheetRegion(name, fname_surfdat):
+   """
+   Returns the region of an ice sheet: the cells with ice sheet in the surface dataset
+   (PCT_GLC_MEC_ICESHEET > 0) within the box of the ice sheet
+
+   :param name:            'GrIS' or 'AIS', see ICE_SHEETS
+   :param fname_surfdat:   filename of CLM surface dataset, on the grid of the vector file
+   :returns:               Region
+   """
+   if (name not in ICE_SHEETS):
+      raise ValueError('unknown ice sheet: %s, choose from %s' % (name, str(tuple(ICE_SHEETS.keys()))))
+   with Dataset(fname_surfdat, 'r') as fid:
+      pct = fid.variables['PCT_GLC_MEC_ICESHEET'][:]
+   mask = np.ma.filled(np.ma.any(pct > 0, axis=0), False)
+   return Region(mask=mask, name=name, **REGIONS[ICE_SHEETS[name]])
+
+
+def getRegion(region):
+   """
+   Returns a Region from any of the forms accepted by VectorMecVariable
+
+   :param region:    name (see REGIONS), dict of Region arguments, e.g. dict(lat=(60,85), lon=(280,350)),
+                     ice sheet dict(ice_sheet='GrIS', surfdat=fname_surfdat) (see getIceSheetRegion),
+                     boolean mask (nlat, nlon), Region or None
+   :returns:         Region or None
+   """
+   if (region is None or isinstance(region, Region)):
+      return region
+   elif (isinstance(region, str)):
+      if (region in ICE_SHEETS):
+         raise ValueError('ice sheet %s requires a surface dataset: use dict(ice_sheet=%r, surfdat=fname_surfdat), '
+                          'or the approximate box %r' % (region, region, ICE_SHEETS[region]))
+      if (region not in REGIONS):
+         raise ValueError('unknown region: %s, choose from %s' % (region, str(tuple(REGIONS.keys()))))
+      return Region(name=region, **REGIONS[region])
+   elif (isinstance(region, dict)):
+      if ('ice_sheet' in region):
+         return getIceSheetRegion(region['ice_sheet'], region['surfdat'])
+      return Region(**region)
+   else:
+      return Region(mask=region)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: L.vankampenhout@uu.nl
+"""
+import glob
+import numpy as np
+from netCDF4 import Dataset, num2date, date2num
+
+from .VectorMecVariable import VectorMecVariable, logger
+
+PERIODS = ('mean', 'sum', 'annual', 'monthly', 'seasonal', 'cumsum')
+SEASONS = ('DJF', 'MAM', 'JJA', 'SON')
+DEFAULT_CHUNKSIZE = 31 # number of time steps read at a time
+
+
+class TimeAggregator(object):
+   """
+   Online temporal aggregation of a CLM vector variable across many vector files.
+
+   Files are streamed chunk by chunk and accumulated in vector space, so memory use 
+   does not depend on the number of files. Only the final result needs to be gridded.
+   Supported periods:
+
+      mean        mean over all time steps
+      sum         sum over all time steps
+      annual      mean per calendar year
+      monthly     monthly climatology (mean per calendar month)
+      seasonal    seasonal climatology (DJF, MAM, JJA, SON)
+      cumsum      running sum, one time step per time step (files must be added in chronological order)
+
+   Time steps are assigned to a period by the middle of their time bounds when the file 
+   has these, since CLM stamps averaged output with the end of the averaging interval. 
+   Missing values are excluded. With period cumsum, memory use grows with the number 
+   of time steps, since every time step is kept.
+   """
+
+   def __init__(self, varname, period='mean', fname_vecinfo=None, mec_only=False, backend='masked', chunksize=DEFAULT_CHUNKSIZE, layers=None):
+      """
+      :param varname:         CLM variable name
+      :param period:          aggregation period, see class documentation
+      :param fname_vecinfo:   filename of CLM vector grid info file (optional, default: first vector file)
+      :param mec_only:        read only the MEC columns (optional, see VectorMecVariable)
+      :param backend:         'masked' or 'nan' (optional, see VectorMecVariable)
+      :param chunksize:       number of time steps read at a time (optional)
+      :param layers:          layers of a layered variable (optional, see VectorMecVariable)
+      :type varname:          string
+      :type period:           string
+      :type fname_vecinfo:    string
+      :type mec_only:         bool
+      :type backend:          string
+      :type chunksize:        int
+      :type layers:           int, python list, slice or 'all'
+      """
+      if (period not in PERIODS):
+         raise ValueError('unknown period: %s, choose from %s' % (period, str(PERIODS)))
+
+      self.varname = varname
+      self.period = period
+      self.fname_vecinfo = fname_vecinfo
+      self.mec_only = mec_only
+      self.backend = backend
+      self.chunksize = chunksize
+      self.layers = layers
+
+      self.template = None # lazy VectorMecVariable of the first file
+      self.acc = {}        # period key -> [sum of values, number of values, sum of times, number of times]
+      self.running = None  # cumsum: [sum of values, number of values] up to the last time step added
+      self.steps = []      # cumsum: (times, running sums, running numbers of values) per chunk
+      self.nfiles = 0
+
+
+   def getPeriodKeys(self, dates):
+      """
+      Returns the period key of each date
+      """
+      if (self.period in ('mean', 'sum')):
+         return [0 for date in dates]
+      elif (self.period == 'annual'):
+         return [date.year for date in dates]
+      elif (self.period == 'monthly'):
+         return [date.month for date in dates]
+      else:
+         return [(date.month % 12) // 3 for date in dates] # DJF = 0, MAM = 1, ...
+
+
+   def readTimes(self, fid):
+      """
+      Returns time of each time step in units of the first file, and its middle as a date
+      """
+      time = fid.variables['time']
+      calendar = getattr(time, 'calendar', 'standard')
+      tmid = time[:]
+      bounds = getattr(time, 'bounds', 'time_bounds')
+      if (bounds in fid.variables):
+         tmid = fid.variables[bounds][:].mean(axis=-1)
+      dates = num2date(tmid, time.units, calendar)
+      times = date2num(num2date(time[:], time.units, calendar), self.template.time_units, calendar)
+      return np.asarray(times), dates
+
+
+   def add(self, fname_vector):
+      """
+      Accumulate all time steps of a vector file
+
+      :param fname_vector:    filename of CLM vector file (e.g. XXX.h2.YYY.nc)
+      :type fname_vector:     string
+      """
+      fname_vecinfo = self.fname_vecinfo or fname_vector
+      vmv = VectorMecVariable(self.varname, fname_vector, fname_vecinfo=fname_vecinfo, lazy=True, 
+                              mec_only=self.mec_only, backend=self.backend, layers=self.layers)
+      if (self.template == None):
+         self.template = vmv
+         self.fname_vecinfo = fname_vecinfo # all files share the grid of the first
+      elif (vmv.nvec != self.template.nvec):
+         raise ValueError('number of vectors in %s does not match the first file' % fname_vector)
+
+      with Dataset(fname_vector,'r') as fid:
+         times, dates = self.readTimes(fid)
+      keys = np.asarray(self.getPeriodKeys(dates))
+
+      t0 = 0
+      for chunk in vmv.iterChunks(self.chunksize):
+         data = chunk.data if (chunk.ndim >= 2) else chunk.data[None,:]
+         if (self.backend == 'nan'):
+            valid = ~np.isnan(data)
+         else:
+            data = np.ma.masked_greater(data, 1e34)
+            valid = ~np.ma.getmaskarray(data)
+         values = np.where(valid, np.ma.getdata(data), 0.0)
+
+         t1 = t0 + data.shape[0]
+         if (self.period == 'cumsum'):
+            self.accumulateRunning(values, valid, times[t0:t1])
+            t0 = t1
+            continue
+         for key in np.unique(keys[t0:t1]):
+            sel = (keys[t0:t1] == key)
+            if (key not in self.acc):
+               self.acc[key] = [np.zeros(values.shape[1:]), np.zeros(values.shape[1:], dtype=int), 0.0, 0]
+            acc = self.acc[key]
+            acc[0] += values[sel].sum(axis=0)
+            acc[1] += valid[sel].sum(axis=0)
+            acc[2] += times[t0:t1][sel].sum()
+            acc[3] += sel.sum()
+         t0 = t1
+
+      self.nfiles += 1
+      logger.info('accumulated %d time steps of %s', t0, fname_vector)
+
+
+   def accumulateRunning(self, values, valid, times):
+      """
+      Add consecutive time steps to the running sum and keep the running sum of each of them
+      """
+      if (self.running == None):
+         self.running = [np.zeros(values.shape[1:]), np.zeros(values.shape[1:], dtype=int)]
+      total = np.cumsum(values, axis=0) + self.running[0]
+      count = np.cumsum(valid, axis=0) + self.running[1]
+      self.running = [total[-1], count[-1]]
+      self.steps.append((times, total, count))
+
+
+   def getResult(self):
+      """
+      Returns the aggregated variable, with one time step per period (in chronological 
+      or calendar order). The time of each period is the mean time of its time steps. 
+      With period cumsum, there is one time step per time step added, with its own time.
+      The result can be gridded like any VectorMecVariable.
+
+      :returns:   VectorMecVariable
+      """
+      if (self.template == None):
+         raise RuntimeError('no files have been added')
+
+      if (self.period == 'cumsum'):
+         keys = None
+         time = np.concatenate([step[0] for step in self.steps])
+         total = np.concatenate([step[1] for step in self.steps])
+         count = np.concatenate([step[2] for step in self.steps])
+      else:
+         keys = sorted(self.acc.keys())
+         total = np.array([self.acc[key][0] for key in keys])
+         count = np.array([self.acc[key][1] for key in keys])
+         time = np.array([self.acc[key][2] / self.acc[key][3] for key in keys])
+
+      if (self.period in ('sum', 'cumsum')):
+         data = total
+      else:
+         with np.errstate(divide='ignore', invalid='ignore'):
+            data = total / count
+
+      if (self.backend == 'nan'):
+         data = np.where(count > 0, data, np.nan).astype(np.float32)
+      else:
+         data = np.ma.masked_where(count == 0, data)
+
+      result = VectorMecVariable.__new__(VectorMecVariable)
+      result.__dict__.update(self.template.__dict__)
+      result.setData(data, time)
+      if (self.period == 'seasonal'):
+         result.seasons = [SEASONS[key] for key in keys]
+      logger.info('aggregated %d files into %d time steps (%s)', self.nfiles, len(time), self.period)
+      return result
+
+
+def aggregateFiles(fnames_vector, varname, period='mean', fname_vecinfo=None, mec_only=False, backend='masked', layers=None):
+   """
+   Aggregate a variable in time over many vector files in a single read pass, see TimeAggregator.
+
+   :param fnames_vector:   filenames of CLM vector files, or a glob pattern
+   :param varname:         CLM variable name
+   :param period:          'mean', 'sum', 'annual', 'monthly', 'seasonal' or 'cumsum'
+   :param fname_vecinfo:   filename of CLM vector grid info file (optional, default: first vector file)
+   :param mec_only:        read only the MEC columns (optional, see VectorMecVariable)
+   :param backend:         'masked' or 'nan' (optional, see VectorMecVariable)
+   :param layers:          layers of a layered variable (optional, see VectorMecVariable)
+   :type fnames_vector:    python list or string
+   :returns:               VectorMecVariable
+   """
+   if (isinstance(fnames_vector, str)):
+      fnames_vector = sorted(glob.glob(fnames_vector))
+
+   aggregator = TimeAggregator(varname, period, fname_vecinfo=fname_vecinfo, mec_only=mec_only, backend=backend, layers=layers)
+   for fname_vector in fnames_vector:
+      aggregator.add(fname_vector)
+   return aggregator.getResult()
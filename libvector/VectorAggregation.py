@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Weighted aggregation of CLM vector output to a coarser level of the subgrid hierarchy
+(pft -> column -> landunit -> gridcell), using the index and weight metadata of the vector file.
+
+@author: L.vankampenhout@uu.nl
+"""
+import numpy as np
+
+# metadata in the vector file: (child, parent) -> (parent index, weight relative to parent)
+AGGREGATION_FIELDS = {
+   ('pft', 'column')       : ('pfts1d_ci', 'pfts1d_wtcol'),
+   ('pft', 'landunit')     : ('pfts1d_li', 'pfts1d_wtlunit'),
+   ('pft', 'gridcell')     : ('pfts1d_gi', 'pfts1d_wtgcell'),
+   ('column', 'landunit')  : ('cols1d_li', 'cols1d_wtlunit'),
+   ('column', 'gridcell')  : ('cols1d_gi', 'cols1d_wtgcell'),
+}
+
+
+class VectorAggregation(object):
+   """
+   Weighted grouped reduction of vector data onto parents, e.g. of pfts onto their columns.
+
+   The vectors are sorted by parent once, such that aggregating any number of time steps
+   (or layers) is a single np.add.reduceat over the last axis, without Python loops.
+   As in CLM (p2c, c2l, ...), missing values are excluded and the weights of the
+   remaining values are renormalized. Parents without valid values are missing.
+   """
+
+   def __init__(self, parent, weight, nparent):
+      """
+      :param parent:    0-based parent index of every vector, negative for no parent
+      :param weight:    weight of every vector relative to its parent (e.g. pfts1d_wtcol)
+      :param nparent:   number of parents
+      :type parent:     numpy array (nvec) of integers
+      :type weight:     numpy array (nvec)
+      :type nparent:    int
+      """
+      self.parent = np.asarray(parent)
+      self.weight = np.asarray(weight, dtype=np.float64)
+      self.nparent = nparent
+
+      valid, = np.where((self.parent >= 0) & (self.parent < nparent))
+      self.order = valid[np.argsort(self.parent[valid], kind='stable')] # vectors sorted by parent
+      sorted_parent = self.parent[self.order]
+      self.starts = np.flatnonzero(np.r_[True, sorted_parent[1:] != sorted_parent[:-1]]) if len(self.order) else np.zeros(0, dtype=int)
+      self.parents = sorted_parent[self.starts] # parents that have at least one vector
+      self.sorted_weight = self.weight[self.order]
+
+
+   def subset(self, cols):
+      """
+      Returns the aggregation of a subset of the vectors (e.g. the MEC columns only)
+
+      :param cols:   positions of the vectors
+      :returns:      VectorAggregation
+      """
+      return VectorAggregation(self.parent[cols], self.weight[cols], self.nparent)
+
+
+   def apply(self, data, normalize=True):
+      """
+      Aggregate data onto the parents, along the last axis
+
+      :param data:         vector data, masked array (backend 'masked') or float array with NaN (backend 'nan')
+      :param normalize:    divide by the sum of the weights of the valid values (weighted mean, default),
+                           or return the weighted sum
+      :type data:          numpy array (..., nvec)
+      :type normalize:     bool
+      :returns:            numpy array (..., nparent), same representation as the data
+      """
+      if (data.shape[-1] != len(self.parent)):
+         raise ValueError('number of vectors does not match!')
+
+      if (np.ma.isMaskedArray(data)):
+         data = np.ma.masked_greater(data, 1e34)
+         valid = ~np.ma.getmaskarray(data)
+      else:
+         valid = ~np.isnan(data)
+      values = np.where(valid, np.ma.getdata(data), 0.0)[..., self.order]
+      weights = valid[..., self.order] * self.sorted_weight
+
+      shape = data.shape[:-1] + (self.nparent,)
+      total = np.zeros(shape)
+      wsum = np.zeros(shape)
+      if (len(self.order) > 0):
+         total[..., self.parents] = np.add.reduceat(values * weights, self.starts, axis=-1)
+         wsum[..., self.parents] = np.add.reduceat(weights, self.starts, axis=-1)
+
+      missing = (wsum == 0)
+      if (normalize):
+         with np.errstate(divide='ignore', invalid='ignore'):
+            total = total / wsum
+
+      if (np.ma.isMaskedArray(data)):
+         return np.ma.masked_where(missing, total)
+      else:
+         return np.where(missing, np.nan, total).astype(np.float32)
+
+
+def readAggregation(fid, child, parent):
+   """
+   Read the aggregation of vectors of type child onto parents from an opened vector file
+
+   :param fid:       opened netCDF4 Dataset
+   :param child:     vector type: 'pft' or 'column'
+   :param parent:    'column', 'landunit' or 'gridcell'
+   :returns:         VectorAggregation
+   """
+   if ((child, parent) not in AGGREGATION_FIELDS):
+      raise ValueError('cannot aggregate from %s to %s' % (child, parent))
+   fld_index, fld_weight = AGGREGATION_FIELDS[(child, parent)]
+   if (fld_index not in fid.variables or fld_weight not in fid.variables):
+      raise KeyError('aggregation from %s to %s requires %s and %s' % (child, parent, fld_index, fld_weight))
+
+   index = np.ma.filled(fid.variables[fld_index][:], 0).astype(int) - 1 # Fortran indices
+   weight = np.ma.filled(fid.variables[fld_weight][:], 0.0)
+   if (parent in fid.dimensions):
+      nparent = len(fid.dimensions[parent])
+   else:
+      nparent = int(index.max()) + 1
+   return VectorAggregation(index, weight, nparent)
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Grid and column index of CLM vector output.
+
+The index only depends on the vector grid information file, so it is built once
+per file and vector type (column or pft) and shared by all VectorMecVariable
+instances through getVectorIndex().
+
+@author: L.vankampenhout@uu.nl
+"""
+import os
+import copy
+from collections import OrderedDict
+import numpy as np
+from netCDF4 import Dataset
+
+from .common import GLC_NEC, COLUNIT_GLCMEC, logger
+from .runStats import stats
+from .VectorAggregation import readAggregation
+
+REARTH = 6.37122e6 # radius of the earth (m), as in CESM
+
+SLAB_MAX_GAP = 64 # columns in between two slabs that are read rather than starting a new slab
+
+LRU_MAXSIZE = 16 # maximum number of indices (of files, vector types and regions) kept in memory
+
+
+class VectorIndex(object):
+   """
+   Vector indices and grid information (lat, lon) read from a CLM vector file, 
+   together with precomputed scatter indices of the MEC columns.
+
+   MEC columns have type 400+lev+1, where lev = 0..GLC_NEC-1 (level 0 of the column
+   types is tundra and is omitted). For these columns the index holds
+
+      mec_cols    position of the column in the vector
+      mec_lev     MEC level (0..GLC_NEC-1)
+      mec_cell    flat index into a (nlat, nlon) grid
+      mec_flat    flat index into a (nlat, nlon, GLC_NEC) grid
+
+   such that gridding boils down to a single fancy-index assignment:
+   out.reshape(ntime,-1)[:,mec_flat] = data[:,mec_cols]
+
+   In addition, mec_cells holds the sorted flat indices of all grid cells that contain MEC
+   columns and cell holds the flat index into a (nlat, nlon) grid of every column (or pft).
+
+   To read the MEC columns only, they are grouped in contiguous slabs:
+
+      mec_slabs      list of (start, stop) ranges in the vector
+      mec_slab_sel   positions of the MEC columns in the concatenated slabs
+
+   An index cropped to a region (see cropVectorIndex) holds the columns in the region only, 
+   on the window of the grid that holds the region. Positions then refer to these columns, 
+   vec_cols holds their positions in the vector file and vec_slabs, vec_slab_sel group them 
+   in slabs; slabs always refer to the vector file. window_mask marks the cells of the window 
+   that are in the region, it is None if all of them are.
+   """
+
+   def __init__(self, fname_vecinfo, var_type):
+      """
+      Read vector information (col or pft based) and general grid information (lat, lon)
+
+      :param fname_vecinfo:   filename of CLM vector grid info file
+      :param var_type:        vector type: 'column', 'pft' or 'lon'
+      :type fname_vecinfo:    string
+      :type var_type:         string
+      """
+      self.fname_vecinfo = fname_vecinfo
+      self.var_type = var_type
+
+      with stats.timer('index'):
+         with Dataset(fname_vecinfo,'r') as fid:
+            self.lats = fid.variables['lat'][:]
+            self.lons = fid.variables['lon'][:]           
+            if (var_type == 'column'):
+               self.ixy = fid.variables['cols1d_ixy'][:]
+               self.jxy = fid.variables['cols1d_jxy'][:]
+               self.lunit   = fid.variables['cols1d_itype_lunit'][:]   # col landunit type (vegetated,urban,lake,wetland,glacier or glacier_mec)
+               self.coltype   = fid.variables['cols1d_itype_col'][:] 
+            elif (var_type == 'pft'):
+               self.ixy = fid.variables['pfts1d_ixy'][:]
+               self.jxy = fid.variables['pfts1d_jxy'][:]
+               self.lunit   = fid.variables['pfts1d_itype_lunit'][:]   # col landunit type (vegetated,urban,lake,wetland,glacier or glacier_mec)
+               self.coltype   = fid.variables['pfts1d_itype_col'][:] 
+            elif (var_type == 'lon'):
+               self.ixy, self.jxy, self.lunit, self.coltype = None, None, None, None
+            else:
+               raise NotImplementedError('Unknown variable type: '+var_type) 
+      
+         self.nlat = len(self.lats)
+         self.nlon = len(self.lons)
+         self.area = None # see getCellArea()
+         self.aggregations = {} # see getAggregation()
+         self.grid_shape = (self.nlat, self.nlon) # shape of the grid of the vector file
+         self.window = None    # (jslice, islice) of a cropped index
+         self.vec_cols = None  # positions in the vector file of a cropped index, None means all
+         self.uncropped = None # index that a cropped index was derived from
+         self.window_mask = None # cells of the window in the region, None means all
+
+         if (self.coltype is not None):
+            self.buildScatterIndex()
+
+
+   def buildScatterIndex(self):
+      """
+      Precompute flat scatter indices of all MEC columns.
+      Is called automatically during __init__()
+      """
+      # flat grid cell index of every column (or pft)
+      ix = np.ma.filled(self.ixy, 0) - 1
+      iy = np.ma.filled(self.jxy, 0) - 1
+      self.cell = iy * self.nlon + ix
+
+      coltype = np.ma.filled(self.coltype, -1)
+      lev = coltype - (COLUNIT_GLCMEC*100 + 1) # level 0 is tundra, omit this
+      mask = (lev >= 0) & (lev < GLC_NEC)
+
+      self.mec_cols, = np.where(mask)
+      self.mec_lev = lev[self.mec_cols]
+      self.mec_cell = self.cell[self.mec_cols]
+      self.mec_flat = self.mec_cell * GLC_NEC + self.mec_lev
+      self.mec_cells = np.unique(self.mec_cell)
+      self.mec_slabs, self.mec_slab_sel = findSlabs(self.getFilePositions(self.mec_cols))
+      logger.info('%d MEC columns out of a total %d, in %d slabs', len(self.mec_cols), len(coltype), len(self.mec_slabs))
+
+
+   def getFilePositions(self, cols):
+      """
+      Returns positions in the vector file of positions in this index
+      """
+      if (self.vec_cols is None):
+         return cols
+      return self.vec_cols[cols]
+
+
+   def cropField(self, field):
+      """
+      Returns the window of a cropped index of a field on the grid of the vector file, 
+      the last two dimensions are (lat, lon). Unchanged if the index is not cropped.
+      """
+      if (self.window == None):
+         return field
+      jslice, islice = self.window
+      return field[..., jslice, islice]
+
+
+   def getCellArea(self):
+      """
+      Returns area of the grid cells, computed once from the grid (see gridCellArea)
+
+      :returns:   numpy array (nlat, nlon) in m2
+      """
+      if (self.area is None):
+         if (self.uncropped != None):
+            self.area = self.cropField(self.uncropped.getCellArea()) # cell edges of the whole grid
+         else:
+            self.area = gridCellArea(self.lats, self.lons)
+      return self.area
+
+
+   def getAggregation(self, parent):
+      """
+      Returns the weighted aggregation of the vectors onto their parents (see VectorAggregation), 
+      read once from the vector grid info file
+
+      :param parent:    'column' (pft only), 'landunit' or 'gridcell'
+      :type parent:     string
+      :returns:         VectorAggregation
+      """
+      if (parent not in self.aggregations):
+         if (self.uncropped != None):
+            # parents keep their index in the vector file
+            self.aggregations[parent] = self.uncropped.getAggregation(parent).subset(self.vec_cols)
+         else:
+            with Dataset(self.fname_vecinfo,'r') as fid:
+               self.aggregations[parent] = readAggregation(fid, self.var_type, parent)
+      return self.aggregations[parent]
+
+
+def gridCellArea(lats, lons):
+   """
+   Area of the cells of a regular lat/lon grid on a sphere.
+   Cell edges are halfway between the cell centers, the outer edges at the poles.
+
+   :param lats:   latitudes of cell centers (degrees north)
+   :param lons:   longitudes of cell centers (degrees east)
+   :returns:      numpy array (nlat, nlon) in m2
+   """
+   lats = np.asarray(lats, dtype=np.float64)
+   lons = np.asarray(lons, dtype=np.float64)
+
+   lat_edges = np.clip(np.concatenate(([-90.], 0.5*(lats[1:] + lats[:-1]), [90.])), -90., 90.)
+   dlon = np.full(len(lons), 360. / len(lons))
+   if (len(lons) > 1):
+      dlon = np.abs(np.gradient(lons))
+
+   dsinlat = np.abs(np.diff(np.sin(np.deg2rad(lat_edges))))
+   return REARTH**2 * dsinlat[:,None] * np.deg2rad(dlon)[None,:]
+
+
+def findSlabs(cols, max_gap=SLAB_MAX_GAP):
+   """
+   Group sorted positions in the vector into a minimal set of contiguous slabs.
+   Slabs that are separated by at most max_gap positions are merged, 
+   which means these positions are read but not used.
+
+   :param cols:      sorted positions in the vector
+   :param max_gap:   maximum gap between two positions within the same slab
+   :type cols:       numpy array
+   :type max_gap:    int
+   :returns:         tuple (slabs, sel): list of (start, stop) ranges and 
+                     positions of cols in the concatenated slabs
+   """
+   if (len(cols) == 0):
+      return [], np.zeros(0, dtype=int)
+
+   breaks, = np.where(np.diff(cols) > max_gap + 1)
+   starts = np.append(cols[0], cols[breaks+1])
+   stops = np.append(cols[breaks]+1, cols[-1]+1)
+   slabs = list(zip(starts.tolist(), stops.tolist()))
+
+   offsets = np.cumsum(stops - starts) - (stops - starts) # start of each slab in the concatenation
+   islab = np.searchsorted(starts, cols, side='right') - 1
+   sel = offsets[islab] + cols - starts[islab]
+   return slabs, sel
+
+
+def cropVectorIndex(index, region):
+   """
+   Returns an index that holds only the columns (or pfts) in a region, on the smallest 
+   window of the grid that holds the region. MEC scatter indices and slabs are rebuilt 
+   for the window, so that gridding and reading are restricted to the region.
+
+   :param index:     VectorIndex of the whole grid
+   :param region:    Region instance
+   :returns:         VectorIndex
+   """
+   if (index.uncropped != None):
+      raise ValueError('index has already been cropped')
+   jslice, islice, mask = region.resolve(index.lats, index.lons)
+
+   cropped = copy.copy(index)
+   cropped.uncropped = index
+   cropped.window = (jslice, islice)
+   cropped.window_mask = None if mask[jslice, islice].all() else mask[jslice, islice]
+   cropped.lats = index.lats[jslice]
+   cropped.lons = index.lons[islice]
+   cropped.nlat = len(cropped.lats)
+   cropped.nlon = len(cropped.lons)
+   cropped.area = None
+   cropped.aggregations = {}
+
+   if (index.coltype is not None):
+      ix = np.ma.filled(index.ixy, 0) - 1
+      iy = np.ma.filled(index.jxy, 0) - 1
+      inside = (ix >= 0) & (iy >= 0)
+      inside[inside] = mask[iy[inside], ix[inside]]
+
+      cropped.vec_cols, = np.where(inside)
+      cropped.vec_slabs, cropped.vec_slab_sel = findSlabs(cropped.vec_cols)
+      cropped.ixy = index.ixy[cropped.vec_cols] - islice.start
+      cropped.jxy = index.jxy[cropped.vec_cols] - jslice.start
+      cropped.lunit = index.lunit[cropped.vec_cols]
+      cropped.coltype = index.coltype[cropped.vec_cols]
+      cropped.buildScatterIndex()
+      logger.info('%s: %d of %d vectors, grid %d x %d', str(region), len(cropped.vec_cols), len(index.coltype), cropped.nlat, cropped.nlon)
+   return cropped
+
+
+_index_cache = OrderedDict()
+
+def _indexKey(fname_vecinfo, var_type):
+   """
+   Key of a VectorIndex in the cache: the file (path and modification time) and vector type
+   """
+   return (os.path.abspath(fname_vecinfo), var_type, os.path.getmtime(fname_vecinfo))
+
+
+def getVectorIndex(fname_vecinfo, var_type, region=None):
+   """
+   Returns the VectorIndex of a vector grid info file, building it only once.
+   Subsequent calls for the same (unmodified) file and vector type return the cached instance;
+   the LRU_MAXSIZE most recently used indices are kept.
+
+   :param fname_vecinfo:   filename of CLM vector grid info file
+   :param var_type:        vector type: 'column', 'pft' or 'lon'
+   :param region:          crop the index to a region (optional, see cropVectorIndex)
+   :type region:           Region
+   :returns:               VectorIndex instance
+   """
+   key = _indexKey(fname_vecinfo, var_type)
+   if (region != None):
+      key = key + (region.getKey(),)
+
+   if (key in _index_cache):
+      _index_cache.move_to_end(key)
+      return _index_cache[key]
+
+   if (region == None):
+      index = VectorIndex(fname_vecinfo, var_type)
+   else:
+      index = cropVectorIndex(getVectorIndex(fname_vecinfo, var_type), region)
+
+   # indices of earlier versions of the file are stale
+   for stale in [k for k in _index_cache if k[:2] == key[:2] and k[2] != key[2]]:
+      del _index_cache[stale]
+
+   _index_cache[key] = index
+   if (len(_index_cache) > LRU_MAXSIZE):
+      _index_cache.popitem(last=False)
+   return index
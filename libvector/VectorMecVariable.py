@@ -10,16 +10,29 @@ Files with multiple time records may work, but are untested!!!
 
 @author: L.vankampenhout@uu.nl
 """
-import sys
+import copy
+import logging
 import numpy as np
 from netCDF4 import Dataset, default_fillvals
-from scipy.interpolate import InterpolatedUnivariateSpline
+from .common import GLC_NEC, COLUNIT_GLCMEC, rtnnam, logger
+from .VectorIndex import getVectorIndex
+from .Region import getRegion
+from .InterpOperator import getCachedInterpOperator, readCachedInterpOperator
+from .GatheredField import GatheredField
+from .glcCache import getCachedField
+from .runStats import stats
 
-GLC_NEC = 10 # maximum number of elevation classes present in input file
-COLUNIT_GLCMEC = 4 # for landunit types and column types, land ice = 7 (older CLM) land ice = 4 (newer CLM)
+BACKENDS = ('masked', 'nan') # representation of data and gridded output
 
 
-rtnnam = lambda: sys._getframe(1).f_code.co_name # helper function that queries name of current routine
+def countValid(var):
+   """
+   Returns number of non-missing values of a masked array or a NaN array
+   """
+   if (np.ma.isMaskedArray(var)):
+      return var.count()
+   else:
+      return np.count_nonzero(~np.isnan(var))
 
 
 class VectorMecVariable(object):
@@ -51,7 +64,7 @@ class VectorMecVariable(object):
    topography is assigned to topographic height (CLM: variable TOPO_COL).
    """
 
-   def __init__(self, varname, fname_vector, fname_vecinfo = None):
+   def __init__(self, varname, fname_vector, fname_vecinfo = None, dataset = None, lazy = False, mec_only = False, backend = 'masked', layers = None, region = None):
       """
       init and read MEC variable into memory
       
@@ -59,66 +72,121 @@ class VectorMecVariable(object):
       In case this is not possible, e.g. when that file has been post-processed, an 
       auxiliary file can be given from which this data is retrieved.
 
+      With lazy = True only the metadata is read. The data is then read from disk a 
+      number of time steps at a time using iterChunks(), such that memory usage is 
+      bounded by the chunk size rather than by the length of the file.
+
+      With mec_only = True only the glacier MEC columns are read from disk, in as few 
+      contiguous slabs as possible (see VectorIndex). The data then holds these columns only, 
+      in the order of the vector file.
+
+      The backend determines how data and gridded output are represented: 'masked' uses 
+      float64 masked arrays, 'nan' uses float32 arrays with NaN for missing values, which 
+      halves memory and avoids copying masks. With 'nan', missing values propagate 
+      into interpolated levels.
+
+      Layered variables (time, layer, column), e.g. SNO_T or TSOI, are by default reduced 
+      to their top layer. With layers set, only the requested layers are read from disk: 
+      a single layer index gives the same layout as the default, whereas a list of layer 
+      indices, a slice or 'all' keeps a layer dimension. The data then has dimensions 
+      (ntime, nlayer, nvec) and all gridded output gets a layer dimension after time.
+
+      With region set, e.g. 'greenland_box', only the columns in the region are read and the grid 
+      (lats, lons, nlat, nlon) is cropped to the smallest window that holds the region, 
+      so that all gridded output, glacier fraction and topography cover this window only. 
+      See Region for the ways to define a region.
+
       :param varname:         CLM variable name
       :param fname_vector:    filename of CLM vector file (e.g. XXX.h2.YYY.nc)
       :param fname_vecinfo:   filename of CLM vector grid info file (optional)
+      :param dataset:         opened netCDF4 Dataset of fname_vector (optional), 
+                              avoids reopening the file when reading many variables
+      :param lazy:            do not read data into memory (optional)
+      :param mec_only:        read only the MEC columns (optional)
+      :param backend:         'masked' (default) or 'nan' (optional)
+      :param layers:          layers of a layered variable (optional, default top layer only)
+      :param region:          restrict to a region (optional): 'greenland_box', 'antarctica_box', a lat/lon box 
+                              dict(lat=(south,north), lon=(west,east)), an index window 
+                              dict(ilat=(start,stop), ilon=(start,stop)), an ice sheet 
+                              dict(ice_sheet='GrIS', surfdat=fname_surfdat), a boolean mask or a Region
       :type varname:          string
       :type fname_vector:     string
       :type fname_vecinfo:    string
+      :type dataset:          netCDF4.Dataset
+      :type lazy:             bool
+      :type mec_only:         bool
+      :type backend:          string
+      :type layers:           int, python list, slice or 'all'
+      :type region:           string, dict, numpy array or Region
       :returns: nothing
       """
       self.varname = varname
       self.fname_vector = fname_vector
+      self.lazy = lazy
+      self.mec_only = mec_only
+      self.backend = backend
+      if (backend not in BACKENDS):
+         raise ValueError('unknown backend: %s, choose from %s' % (backend, str(BACKENDS)))
+      self.scale = None # factor that is applied to data read lazily
+      self.layers = layers # requested layers, replaced by the selected layer indices in readVariable()
+      self.region = getRegion(region)
 
       if (fname_vecinfo == None):
          self.fname_vecinfo = fname_vector # read grid info from vector file itself
       else:
          self.fname_vecinfo = fname_vecinfo # auxiliary file for grid info
 
-      with Dataset(fname_vector,'r') as fid:
-         self.time = fid.variables['time'][:]
-         self.time_units = fid.variables['time'].units
-         self.var_type = fid.variables[varname].dimensions[-1] # 'col' or 'pft' or 'lon'
-         self.long_name = fid.variables[varname].long_name
-
-         assert self.var_type in ("column", "pft", "lon"), "variable type <%s> not supported" % self.var_type
-
-         try:
-            self.units = fid.variables[varname].units
-         except AttributeError:
-            self.units = "-"
-
-  
-         if (varname[0:4] == "SNO_"):
-            # special case for layered data (like SNO_T, SNO_GS) : use top layer only
-            self.data = fid.variables[varname][:,0,:]
-         #elif (varname[0:4] == "TSOI"):
-         elif (varname.strip() == "TSOI"):
-            #print(np.shape(fid.variables[varname][:])) # (1, 25, 97387)
-            self.data = fid.variables[varname][:,0,:]
-         else:
-            self.data = fid.variables[varname][:]
-      
+      if (dataset == None):
+         with Dataset(fname_vector,'r') as fid:
+            self.readVariable(fid)
+      else:
+         self.readVariable(dataset) # file has already been opened by the caller
 
       # WORKAROUND shift data by one month
       #self.data = self.data[[1,2,3,4,5,6,7,8,9,10,11,0]]
       
-      print('INFO: %s: read variable %s, which is of type %s' %(rtnnam(), varname, self.var_type))
+      logger.info('read variable %s, which is of type %s', varname, self.var_type)
       
-      self.ndim = self.data.ndim
+      self.ndim = len(self.shape)
       if (self.ndim == 1):
          # static variable
          self.ntime = 1
-         self.nvec = len(self.data)
+         self.nvec = self.shape[0]
       elif (self.ndim == 2):
          # assume time indexed variable
-         self.ntime, self.nvec = self.data.shape
+         self.ntime, self.nvec = self.shape
+      elif (self.ndim == 3 and self.nlayer != None):
+         # time indexed variable with layers
+         self.ntime, self.nlayer, self.nvec = self.shape
       elif (self.ndim == 3 and self.var_type == "lon"):
-         self.ntime, self.nlat, self.nlon = self.data.shape
+         self.ntime, self.nlat, self.nlon = self.shape
          self.nvec = self.nlat * self.nlon
       else:
          raise NotImplementedError('Unexpected number of dimensions of input data, ndim = %d > 2' % self.ndim)
 
+      logger.info('nlat = %d, nlon = %d', self.nlat, self.nlon)
+
+
+   def readVariable(self, fid):
+      """
+      Read variable data and metadata from an opened vector file.
+      Is called automatically during __init__()
+
+      :param fid:    opened netCDF4 Dataset of the vector file
+      :type fid:     netCDF4.Dataset
+      """
+      self.time = fid.variables['time'][:]
+      self.time_units = fid.variables['time'].units
+      self.var_type = fid.variables[self.varname].dimensions[-1] # 'col' or 'pft' or 'lon'
+      self.long_name = fid.variables[self.varname].long_name
+
+      assert self.var_type in ("column", "pft", "lon"), "variable type <%s> not supported" % self.var_type
+
+      try:
+         self.units = fid.variables[self.varname].units
+      except AttributeError:
+         self.units = "-"
+
       # Read vector indices and grid information
       try: 
          self.readVectorInfo()
@@ -131,37 +199,294 @@ class VectorMecVariable(object):
          the vector information""" 
          raise RuntimeError(msg)
 
-      print('INFO: %s: nlat = %d, nlon = %d' % (rtnnam(), self.nlat, self.nlon))
+      self.readLayerInfo(fid)
+      self.shape = fid.variables[self.varname].shape
+      if (self.layer_dim != None):
+         if (self.nlayer == None):
+            self.shape = self.shape[:1] + self.shape[2:] # layer dimension is removed
+         else:
+            self.shape = (self.shape[0], self.nlayer, self.shape[2])
+      if (self.cols is not None):
+         self.shape = self.shape[:-1] + (len(self.cols),)
+      elif (self.index.vec_cols is not None):
+         self.shape = self.shape[:-1] + (len(self.index.vec_cols),) # columns in the region
+      elif (self.var_type == "lon" and self.index.window != None):
+         self.shape = self.shape[:-2] + (self.nlat, self.nlon) # window of the region
+
+      if (self.lazy):
+         self.data = None
+      else:
+         self.data = self.readTimeSlice(fid, slice(None))
+
+
+   def readLayerInfo(self, fid):
+      """
+      Determine the layer dimension and the layers that are read (see constructor), sets
+
+         layer_dim   name of the layer dimension in the file, None if not layered
+         layer_sel   index of the layers in the file: integer (layer dimension is removed), 
+                     slice (contiguous layers) or list
+         layers      selected layer indices, None if the layer dimension is removed
+         nlayer      number of selected layers, None if the layer dimension is removed
+
+      Is called automatically during __init__()
+      """
+      var = fid.variables[self.varname]
+      requested = self.layers
+      self.layer_dim, self.layer_sel, self.layers, self.nlayer = None, None, None, None
+
+      if (var.ndim != 3 or self.var_type == "lon"):
+         if (requested is not None):
+            raise ValueError('variable %s has no layer dimension' % self.varname)
+         return
+
+      self.layer_dim = var.dimensions[1]
+      nlayer_file = var.shape[1]
+      if (requested is None):
+         self.layer_sel = 0 # top layer only
+      elif (isinstance(requested, (int, np.integer))):
+         if (requested < 0 or requested >= nlayer_file):
+            raise ValueError('layer %d out of range, %s has %d layers' % (requested, self.varname, nlayer_file))
+         self.layer_sel = int(requested)
+      else:
+         if (isinstance(requested, str) and requested == 'all'):
+            layers = np.arange(nlayer_file)
+         elif (isinstance(requested, slice)):
+            layers = np.arange(nlayer_file)[requested]
+         else:
+            layers = np.asarray(requested, dtype=int)
+         if (layers.size == 0 or layers.min() < 0 or layers.max() >= nlayer_file):
+            raise ValueError('layers %s out of range, %s has %d layers' % (str(requested), self.varname, nlayer_file))
+
+         self.layers = layers
+         self.nlayer = len(layers)
+         if (np.all(np.diff(layers) == 1)):
+            self.layer_sel = slice(int(layers[0]), int(layers[-1]) + 1) # contiguous layers are read at once
+         else:
+            self.layer_sel = layers.tolist()
+
+
+   def isLayered(self):
+      """
+      Returns whether variable has a layer dimension in the file
+      """
+      return (self.layer_dim != None)
+
+
+   def readTimeSlice(self, fid, tslice):
+      """
+      Read a range of time steps of the variable from an opened vector file
+
+      :param fid:       opened netCDF4 Dataset of the vector file
+      :param tslice:    range of time steps
+      :type fid:        netCDF4.Dataset
+      :type tslice:     slice
+      :returns:         numpy array
+      """
+      var = fid.variables[self.varname]
+      if (var.ndim == 1):
+         # static variable, not time indexed
+         read = lambda cslice: var[cslice]
+      elif (self.var_type == "lon" and self.index.window != None):
+         # gridded variable: read the window of the region only
+         read = lambda cslice: var[(tslice,) + self.index.window]
+      elif (self.isLayered()):
+         # layered data (like SNO_T, SNO_GS, TSOI) : selected layers only, by default the top layer
+         #print(np.shape(var[:])) # (1, 25, 97387)
+         read = lambda cslice: var[tslice,self.layer_sel,cslice]
+      else:
+         read = lambda cslice: var[tslice,cslice]
+
+      with stats.timer('read'):
+         if (self.cols is None and self.index.vec_cols is None):
+            data = read(slice(None))
+         else:
+            # read selected columns only (MEC columns and/or columns in the region), slab by slab
+            if (self.cols is None):
+               slabs, sel = self.index.vec_slabs, self.index.vec_slab_sel
+            else:
+               slabs, sel = self.index.mec_slabs, self.index.mec_slab_sel
+            parts = [read(slice(start, stop)) for (start, stop) in slabs]
+            data = np.ma.concatenate(parts, axis=-1)[...,sel]
+      stats.count('bytes_read', data.nbytes)
+
+      if (self.backend == 'nan'):
+         data = np.ma.filled(data.astype(np.float32), np.nan)
+         data[data > 1e34] = np.nan # missing value
+
+      if (self.scale != None):
+         data *= self.scale
+      return data
+
+
+   def iterChunks(self, chunksize):
+      """
+      Iterate over the variable a number of time steps at a time.
+      Each chunk is a shallow copy of this instance that holds the data of chunksize time steps 
+      (or less for the last chunk), so that all methods like getGridded3d() can be applied to it.
+      Grid information, topography and glacier fraction are shared with the chunks.
+      A static variable is a single chunk of one time step, at the first time of the file.
+
+      If the variable was created with lazy = True, the data of each chunk is read from disk 
+      only when it is needed.
+
+      :param chunksize:    number of time steps per chunk
+      :type chunksize:     int
+      :returns:            generator of VectorMecVariable instances
+      """
+      if (self.ndim == 1):
+         # static variable, single chunk at the first time of the file
+         chunk = copy.copy(self)
+         chunk.time = self.time[:1]
+         if (self.lazy):
+            with Dataset(self.fname_vector,'r') as fid:
+               chunk.data = self.readTimeSlice(fid, slice(None))
+            chunk.lazy = False
+         yield chunk
+         return
+      
+      fid = Dataset(self.fname_vector,'r') if self.lazy else None
+      try:
+         for t0 in range(0, self.ntime, chunksize):
+            yield self.getChunk(t0, min(t0 + chunksize, self.ntime), fid)
+      finally:
+         if (fid != None):
+            fid.close()
+
+
+   def getChunk(self, t0, t1, fid=None):
+      """
+      Returns time steps t0 up to t1 as a shallow copy of this instance (see iterChunks).
+      If the variable was created with lazy = True, the data is read from disk.
+
+      :param t0:     first time step
+      :param t1:     last time step + 1
+      :param fid:    opened vector file (optional, by default the file is opened for this chunk only)
+      :type fid:     netCDF4.Dataset
+      :returns:      VectorMecVariable
+      """
+      if (self.ndim == 1):
+         raise ValueError('variable %s is not time indexed' % self.varname)
+
+      chunk = copy.copy(self)
+      chunk.lazy = False
+      chunk.time = self.time[t0:t1]
+      chunk.ntime = t1 - t0
+      if (not self.lazy):
+         chunk.data = self.data[t0:t1]
+      elif (fid != None):
+         chunk.data = self.readTimeSlice(fid, slice(t0,t1))
+      else:
+         with Dataset(self.fname_vector,'r') as fid:
+            chunk.data = self.readTimeSlice(fid, slice(t0,t1))
+      return chunk
+
+
+   def foldLayers(self):
+      """
+      Returns a shallow copy of this instance in which the layer dimension is folded into 
+      the time dimension, data (ntime*nlayer, nvec), such that all methods that handle 
+      time indexed data apply to layered data as well. See unfoldLayers().
+
+      :returns:   VectorMecVariable
+      """
+      if (self.lazy):
+         raise RuntimeError('data has not been read into memory (lazy = True), use iterChunks()')
+
+      folded = copy.copy(self)
+      folded.data = self.data.reshape((self.ntime*self.nlayer,) + self.data.shape[2:])
+      folded.time = np.repeat(self.time, self.nlayer)
+      folded.ntime = self.ntime * self.nlayer
+      folded.shape = folded.data.shape
+      folded.ndim = 2
+      folded.layers = None
+      folded.nlayer = None
+      return folded
+
+
+   def unfoldLayers(self, var):
+      """
+      Restore the layer dimension of a result computed on foldLayers()
+
+      :param var:    numpy array (ntime*nlayer, ...)
+      :returns:      numpy array (ntime, nlayer, ...)
+      """
+      return var.reshape((self.ntime, self.nlayer) + var.shape[1:])
 
 
    def readVectorInfo(self):
       """
       Read vector information (col of pft based) for the variable at hand and store in memory. 
       Do the same for general grid information (lat, lon).
+      The information is held by a VectorIndex which is read only once per vecinfo file 
+      and shared by all instances.
       Is called automatically during __init__()
       """
-      with Dataset(self.fname_vecinfo,'r') as fid:
-         self.lats = fid.variables['lat'][:]
-         self.lons = fid.variables['lon'][:]           
-         if (self.var_type == 'column'):
-            self.ixy = fid.variables['cols1d_ixy'][:]
-            self.jxy = fid.variables['cols1d_jxy'][:]
-            self.lunit   = fid.variables['cols1d_itype_lunit'][:]   # col landunit type (vegetated,urban,lake,wetland,glacier or glacier_mec)
-            self.coltype   = fid.variables['cols1d_itype_col'][:] 
-         elif (self.var_type == 'pft'):
-            self.ixy = fid.variables['pfts1d_ixy'][:]
-            self.jxy = fid.variables['pfts1d_jxy'][:]
-            self.lunit   = fid.variables['pfts1d_itype_lunit'][:]   # col landunit type (vegetated,urban,lake,wetland,glacier or glacier_mec)
-            self.coltype   = fid.variables['pfts1d_itype_col'][:] 
-         elif (self.var_type == 'lon'):
-            self.ixy, self.jxy, self.lunit, self.coltype = None, None, None, None
-         else:
-            raise NotImplementedError('Unknown variable type: '+self.var_type) 
+      self.index = getVectorIndex(self.fname_vecinfo, self.var_type, self.region) # shared by all instances
+
+      self.lats = self.index.lats
+      self.lons = self.index.lons
+      self.ixy = self.index.ixy
+      self.jxy = self.index.jxy
+      self.lunit = self.index.lunit
+      self.coltype = self.index.coltype
+      self.cell = getattr(self.index, 'cell', None)
+
+      # positions in the vector of the columns that are read, None means all columns
+      self.cols = None
+      if (self.mec_only):
+         if (self.var_type == "lon"):
+            raise ValueError('variable %s is not a vector variable, mec_only is not applicable' % self.varname)
+         self.cols = self.index.mec_cols
+         self.ixy = self.ixy[self.cols]
+         self.jxy = self.jxy[self.cols]
+         self.lunit = self.lunit[self.cols]
+         self.coltype = self.coltype[self.cols]
+         self.cell = self.cell[self.cols]
       
-      self.nlat = len(self.lats)
-      self.nlon = len(self.lons)
+      self.nlat = self.index.nlat
+      self.nlon = self.index.nlon
+
+
+   def getFilePositions(self):
+      """
+      Returns positions in the vector file of the columns (or pfts) in data
+      """
+      if (self.cols is None):
+         return self.index.getFilePositions(np.arange(self.nvec))
+      return self.index.getFilePositions(self.cols)
+
+
+   def getMecColumns(self):
+      """
+      Returns positions in data of the MEC columns, in the order of the VectorIndex scatter indices
+      """
+      if (self.cols is None):
+         return self.index.mec_cols
+      else:
+         return np.arange(len(self.cols)) # data holds the MEC columns only
+
+
+   def setData(self, data, time):
+      """
+      Replace the data in memory, e.g. by data that has been aggregated in time.
+      Grid information, topography and glacier fraction are kept.
+
+      :param data:    new data, same representation as given by the backend
+      :param time:    new time axis, in units of time_units
+      :type data:     numpy array (ntime, nvec) or (ntime, nlayer, nvec)
+      :type time:     numpy array (ntime)
+      """
+      if (data.shape[-1] != self.nvec):
+         raise ValueError('number of vectors does not match!')
+      self.data = data
+      self.time = time
+      self.lazy = False
+      self.scale = None
+      self.shape = data.shape
+      self.ndim = data.ndim
+      self.ntime = data.shape[0] if (data.ndim >= 2) else 1
 
-     
 
    def applyFactor(self, fac, units=None):
       """
@@ -172,28 +497,38 @@ class VectorMecVariable(object):
       :type fac:          int or float
       :type units:        string
       """
-      self.data *= fac   
+      if (self.lazy):
+         # postpone until data is read
+         self.scale = fac if (self.scale == None) else self.scale * fac
+      else:
+         self.data *= fac   
       if (units != None):
          self.units = units
-         print("INFO: %s: converted units to: %s" % (rtnnam(), units))
+         logger.info('converted units to: %s', units)
 
 
    def setGlcFracCouplerFile(self, filename):
       """
       set glacier fraction from coupler history file
+      The fields set by this and the other setGlc*() methods are cached (see glcCache)
 
       variables read are named "x2lavg_Sg_ice_covered00" etc.
+      The fields are read on the grid of the vector file and cropped to the region (if any).
 
       :param filename:  filename of coupler history file
       """     
-      self.mec_frac = np.zeros((GLC_NEC+1,self.nlat,self.nlon)) # One extra for tundra class
-      with Dataset(filename,'r') as fid:
-         #print(fid.variables)
-         for i in range(0,GLC_NEC+1):
-            #self.mec_frac[i,:,:] = fid.variables['x2lavg_Sg_ice_covered%02d' % i][:] # CESM 1.99
-            self.mec_frac[i,:,:] = fid.variables['x2l_Sg_ice_covered%02d' % i][:] # CESM 2.0
-            
-      self.mec_frac = np.ma.masked_greater(self.mec_frac,2) # TODO: ugly, rewrite
+      nlat, nlon = self.index.grid_shape
+      def read():
+         mec_frac = np.zeros((GLC_NEC+1,nlat,nlon)) # One extra for tundra class
+         with Dataset(filename,'r') as fid:
+            #print(fid.variables)
+            for i in range(0,GLC_NEC+1):
+               #mec_frac[i,:,:] = fid.variables['x2lavg_Sg_ice_covered%02d' % i][:] # CESM 1.99
+               mec_frac[i,:,:] = fid.variables['x2l_Sg_ice_covered%02d' % i][:] # CESM 2.0
+               
+         return np.ma.masked_greater(mec_frac,2) # TODO: ugly, rewrite
+
+      self.mec_frac = self.index.cropField(getCachedField('frac_cpl', filename, (nlat, nlon), read))
 
 
    def setGlcFracSurfdat(self, filename):
@@ -204,11 +539,16 @@ class VectorMecVariable(object):
 
       :param filename:  filename of surfdat file
       """
-      self.mec_frac = np.zeros((GLC_NEC+1,self.nlat,self.nlon)) # One extra for tundra class
-      with Dataset(filename,'r') as fid:
-         #print(fid.variables)
-         for i in range(1,GLC_NEC+1):
-            self.mec_frac[i,:,:] = fid.variables['PCT_GLC_MEC_ICESHEET'][i-1,:,:]
+      nlat, nlon = self.index.grid_shape
+      def read():
+         mec_frac = np.zeros((GLC_NEC+1,nlat,nlon)) # One extra for tundra class
+         with Dataset(filename,'r') as fid:
+            #print(fid.variables)
+            for i in range(1,GLC_NEC+1):
+               mec_frac[i,:,:] = fid.variables['PCT_GLC_MEC_ICESHEET'][i-1,:,:]
+         return mec_frac
+
+      self.mec_frac = self.index.cropField(getCachedField('frac_surfdat', filename, (nlat, nlon), read))
 
 
    def setGlcTopoCouplerFile(self, fname_cpl_restart):
@@ -219,11 +559,16 @@ class VectorMecVariable(object):
       :param fname_cpl_restart:  filename of coupler restart file
       :type fname_cpl_restart:   string
       """
-      self.mec_topo = np.ma.zeros((GLC_NEC+1,self.nlat,self.nlon)) # One extra for tundra class
+      nlat, nlon = self.index.grid_shape
+      def read():
+         mec_topo = np.ma.zeros((GLC_NEC+1,nlat,nlon)) # One extra for tundra class
 
-      with Dataset(fname_cpl_restart,'r') as fid:
-         for i in range(0,GLC_NEC+1):
-            self.mec_topo[i,:,:] = fid.variables['l2gacc_lx_Sl_topo%02d' % i][:].reshape(self.nlat, self.nlon)# CESM 2.0
+         with Dataset(fname_cpl_restart,'r') as fid:
+            for i in range(0,GLC_NEC+1):
+               mec_topo[i,:,:] = fid.variables['l2gacc_lx_Sl_topo%02d' % i][:].reshape(nlat, nlon)# CESM 2.0
+         return mec_topo
+
+      self.mec_topo = self.index.cropField(getCachedField('topo_cpl', fname_cpl_restart, (nlat, nlon), read))
 
       #print(self.mec_topo[:,176,254]) # GrIS
       #print(self.mec_topo[:,164,250]) # GrIS
@@ -240,10 +585,27 @@ class VectorMecVariable(object):
       :param fname_vector:    filename of CLM vector file (e.g. XXX.h2.YYY.nc)
       :type fname_vector:     string
       """
-      # read TOPO_COL from vector file and convert to gridded
-      vmv = VectorMecVariable("TOPO_COL", fname_vector, fname_vecinfo = self.fname_vecinfo) 
+      # read TOPO_COL from vector file and convert to gridded, on the grid of the vector file
+      def read():
+         vmv = VectorMecVariable("TOPO_COL", fname_vector, fname_vecinfo = self.fname_vecinfo) 
+         return vmv.getGridded3d()[0,:,:,:].transpose(2,0,1) # nlev, nlat, nlon
+
+      self.mec_topo = self.index.cropField(getCachedField('topo_hist', fname_vector, self.index.grid_shape, read))
+
+
+   def setGlcTopoVariable(self, vmv):
+      """
+      Set MEC topographic height from a TOPO_COL VectorMecVariable that has already been read, 
+      e.g. by readVectorMecVariables().
+      Height is assumed constant in time (a single copy is stored)
+
+      :param vmv:    VectorMecVariable instance of TOPO_COL, of the same region or of the whole grid
+      :type vmv:     VectorMecVariable
+      """
       tmp = vmv.getGridded3d()[0,:,:,:] # remove time dimension
       self.mec_topo = tmp.transpose(2,0,1) # nlev, nlat, nlon
+      if (self.mec_topo.shape[1:] != (self.nlat, self.nlon)):
+         self.mec_topo = self.index.cropField(self.mec_topo) # whole grid, crop to the region
 
 
 
@@ -255,45 +617,53 @@ class VectorMecVariable(object):
       across MEC columns. It is recommended that for any variable that is 
       dynamically downscaled, e.g. temperature, the more elaborate getGridded3dCustomLevels()
 
-      :returns:   numpy array (ntime,nlat,nlon,nlev)
+      :returns:   numpy array (ntime,nlat,nlon,nlev), with layers (ntime,nlayer,nlat,nlon,nlev)
       """
-      lon2d,lat2d = np.meshgrid(self.lons,self.lats)
-      var_out = np.ma.zeros((self.ntime,self.nlat,self.nlon,GLC_NEC))
-
-      # Mask out all points without GLC_MEC
-      var_out[:] = np.ma.masked
-
-      if (self.var_type == "lon"): 
-         """
-         special case: this variable is in fact not unstructured
-         """
-         print(self.data.shape)
-         for lev in range(GLC_NEC): 
-            var_out[:,:,:,lev] = self.data[:]
-
-      else: 
-         """
-         unstructured variable, type column or pft
-         """
-         for lev in range(GLC_NEC): 
-            mask = (self.coltype==(400+lev+1)) # level 0 is tundra, omit this
-            idx, = np.where(mask)
-            ix = self.ixy[idx]-1
-            iy = self.jxy[idx]-1
-            
-            #print(tskin[:,idx].shape, var_out[:,iy,ix,lev].shape)
+      if (self.lazy):
+         raise RuntimeError('data has not been read into memory (lazy = True), use iterChunks()')
+      if (self.nlayer != None):
+         return self.unfoldLayers(self.foldLayers().getGridded3d())
+
+      with stats.timer('scatter'):
+         # Mask out all points without GLC_MEC
+         if (self.backend == 'nan'):
+            var_out = np.full((self.ntime,self.nlat,self.nlon,GLC_NEC), np.nan, dtype=np.float32)
+         else:
+            var_out = np.ma.zeros((self.ntime,self.nlat,self.nlon,GLC_NEC))
+            var_out[:] = np.ma.masked
+
+         if (self.var_type == "lon"): 
+            """
+            special case: this variable is in fact not unstructured
+            """
+            logger.debug('data shape: %s', str(self.data.shape))
+            for lev in range(GLC_NEC): 
+               var_out[:,:,:,lev] = self.data[:]
+
+         else: 
+            """
+            unstructured variable, type column or pft
+            scatter all MEC columns at once using the precomputed flat indices
+            """
+            var_out = var_out.reshape(self.ntime, self.nlat*self.nlon*GLC_NEC)
+            mec_cols = self.getMecColumns()
             if (self.ndim == 1):
-               var_out[:,iy,ix,lev] = self.data[idx]
+               var_out[:,self.index.mec_flat] = self.data[mec_cols]
             elif (self.ndim == 2):
-               var_out[:,iy,ix,lev] = self.data[:,idx]
+               var_out[:,self.index.mec_flat] = self.data[:,mec_cols]
             else:
                raise NotImplementedError('Unexpected number of dimensions of input data, ndim = %d > 2' % self.ndim)
+            var_out = var_out.reshape(self.ntime,self.nlat,self.nlon,GLC_NEC)
+            stats.count('columns_scattered', self.ntime * len(mec_cols))
    
-      # Mask out points with missing value
-      var_out = np.ma.masked_greater(var_out, 1e34)
+         # Mask out points with missing value (already NaN for backend 'nan')
+         if (self.backend == 'masked'):
+            var_out = np.ma.masked_greater(var_out, 1e34)
+      stats.peak('array_bytes', var_out.nbytes)
 
       # report number of non-missing points
-      print('INFO: %s: number of non-zero points: %d' %  (rtnnam(), var_out.count() / self.ntime))
+      if (logger.isEnabledFor(logging.INFO)):
+         logger.info('number of non-zero points: %d', countValid(var_out) / self.ntime)
       return var_out
    
 
@@ -302,12 +672,16 @@ class VectorMecVariable(object):
       Returns vector data as gridded (lat/lon) numpy array.
       No levels, so weighted by ice_cover percentage.
 
-      :returns:   numpy array (ntime,nlat,nlon)
-      """
-      var3d = self.getGridded3d() # dimensions (ntime, nlat, nlon, GLC_NEC)
-      #print('DEBUG',var3d.shape)
+      The MEC columns are accumulated directly into the grid, weighted by their glacier 
+      fraction, in a single grouped sum over all time steps (no gridded levels are built). 
+      Missing values count as zero, the sum is normalized by the total glacier fraction.
 
-      var_out = np.ma.zeros((self.ntime,self.nlat,self.nlon))
+      :returns:   numpy array (ntime,nlat,nlon), with layers (ntime,nlayer,nlat,nlon)
+      """
+      if (self.lazy):
+         raise RuntimeError('data has not been read into memory (lazy = True), use iterChunks()')
+      if (self.nlayer != None):
+         return self.unfoldLayers(self.foldLayers().getGridded2d())
 
       try:
          frac = np.ma.filled(self.mec_frac, 0.0)
@@ -319,12 +693,54 @@ class VectorMecVariable(object):
 
       #print('DEBUG',np.max(frac))
 
-      for lev in range(GLC_NEC):
-         #var_out += self.mec_frac[lev+1,:,:] * var3d[:,:,:,lev]
-         var_out += frac[lev+1,:,:] * np.ma.filled(var3d[:,:,:,lev], 0.0)
+      if (self.var_type == "lon"):
+         # special case: not unstructured, same value on all levels
+         var3d = self.getGridded3d() # dimensions (ntime, nlat, nlon, GLC_NEC)
+         if (self.backend == 'nan'):
+            var_out = np.zeros((self.ntime,self.nlat,self.nlon), dtype=np.float32)
+         else:
+            var_out = np.ma.zeros((self.ntime,self.nlat,self.nlon))
+
+         with stats.timer('average'):
+            for lev in range(GLC_NEC):
+               if (self.backend == 'nan'):
+                  var_out += frac[lev+1,:,:] * np.where(np.isnan(var3d[:,:,:,lev]), 0.0, var3d[:,:,:,lev])
+               else:
+                  var_out += frac[lev+1,:,:] * np.ma.filled(var3d[:,:,:,lev], 0.0)
 
+      else:
+         with stats.timer('average'):
+            # MEC columns sorted by level, so that every grid cell is summed level by level
+            order = np.argsort(self.index.mec_lev, kind='stable')
+            cell = self.index.mec_cell[order]
+            weight = frac.reshape(GLC_NEC+1, -1)[self.index.mec_lev[order]+1, cell]
 
-      var_out /= np.sum(frac[1:,:,:], axis=0) # normalize for total fraction ( /= 1.0 when tundra present)
+            mec_cols = self.getMecColumns()[order]
+            if (self.ndim == 1):
+               values = self.data[mec_cols][None,:]
+            else:
+               values = self.data[:,mec_cols]
+            if (self.backend == 'nan'):
+               values = np.where(np.isnan(values), 0.0, values)
+            else:
+               values = np.ma.filled(np.ma.masked_greater(values, 1e34), 0.0)
+
+            # weighted sums over (time, grid cell) in a single pass
+            ncell = self.nlat * self.nlon
+            groups = (cell[None,:] + ncell * np.arange(self.ntime)[:,None]).ravel()
+            var_out = np.bincount(groups, weights=(weight[None,:] * values).ravel(), minlength=self.ntime*ncell)
+            var_out = var_out.reshape(self.ntime, self.nlat, self.nlon)
+            if (self.backend == 'nan'):
+               var_out = var_out.astype(np.float32)
+            else:
+               var_out = np.ma.array(var_out)
+            stats.count('columns_scattered', self.ntime * len(mec_cols))
+         stats.peak('array_bytes', var_out.nbytes)
+
+      with stats.timer('average'):
+         # points without GLC_MEC become masked, or NaN (0/0) for backend 'nan'
+         with np.errstate(divide='ignore', invalid='ignore'):
+            var_out /= np.sum(frac[1:,:,:], axis=0) # normalize for total fraction ( /= 1.0 when tundra present)
 
       # Mask out all points without GLC_MEC
       #var_out = np.ma.masked_less(var_out, 1e-4) # TODO: this is quite crude!!
@@ -343,85 +759,414 @@ class VectorMecVariable(object):
 
       :param custom_levs:        custom levels
       :type custom_levs:         python list
-      :returns:   numpy array (ntime,nlat,nlon,nlev)
+      :returns:   numpy array (ntime,nlat,nlon,nlev), with layers (ntime,nlayer,nlat,nlon,nlev)
       """
-      lon2d,lat2d = np.meshgrid(self.lons,self.lats)
+      if (self.nlayer != None):
+         return self.unfoldLayers(self.foldLayers().getGridded3dCustomLevels(custom_levs))
+
       nlev = len(custom_levs)
 
-      var_out = np.ma.zeros((self.ntime,self.nlat,self.nlon,nlev))
-      var_out[:] = np.ma.masked # mask out all points without GLC_MEC
+      cells, var = self.interpCustomLevels(custom_levs) # ntime, ncell, nlev
+
+      with stats.timer('scatter'):
+         # mask out all points without GLC_MEC
+         if (self.backend == 'nan'):
+            var_out = np.full((self.ntime,self.nlat,self.nlon,nlev), np.nan, dtype=np.float32)
+         else:
+            var_out = np.ma.zeros((self.ntime,self.nlat,self.nlon,nlev))
+            var_out[:] = np.ma.masked
+
+         ilat, ilon = np.divmod(cells, self.nlon)
+         var_out[:, ilat, ilon, :] = var
+      stats.peak('array_bytes', var_out.nbytes)
+
+      # Mask out points with missing value
+      #var_out = np.ma.masked_greater(var_out, 1e34)
+
+      # report number of non-missing points
+      if (logger.isEnabledFor(logging.INFO)):
+         logger.info('number of non-zero points: %d', countValid(var_out) / self.ntime)
+      return var_out
+
+
+   def interpCustomLevels(self, custom_levs):
+      """
+      Interpolate vector data to user specified levels on all grid cells that contain 
+      at least one MEC column with a valid topographic height.
+      Is called by getGridded3dCustomLevels() and getGathered3d()
+
+      The interpolation weights are derived from the topography only once per topography 
+      and set of levels (see InterpOperator), or taken from setInterpOperator().
+
+      :param custom_levs:        custom levels
+      :type custom_levs:         python list
+      :returns:   tuple (cells, var): flat grid cell indices (ncell) and 
+                  masked or NaN numpy array (ntime,ncell,nlev)
+      """
+      if (self.lazy):
+         raise RuntimeError('data has not been read into memory (lazy = True), use iterChunks()')
+
+      with stats.timer('interpolation'):
+         # Interpolate to target levels using first order (= linear) splines, for all grid points
+         # and time steps at once. This way, we can linearly interpolate / extrapolate to any level,
+         # even sea level (z = 0).
+         # Note: whether linear extrapolation makes sense really depends on the variable at hand.
+         # Grid points with a single MEC column can only be constantly extrapolated.
+         operator = self.getInterpOperator(custom_levs)
+         var = operator.apply(self)
+      stats.count('cells_interpolated', var.shape[0] * operator.ncell)
+      stats.peak('array_bytes', var.nbytes)
+
+      return operator.cells, var
+
+
+   def getInterpOperator(self, custom_levs):
+      """
+      Returns the interpolation operator to custom levels: the one set by setInterpOperator() 
+      if it matches, otherwise the one derived from the topography (cached, see InterpOperator)
+
+      :param custom_levs:        custom levels
+      :type custom_levs:         python list
+      :returns:   InterpOperator
+      """
+      operator = getattr(self, 'interp_operator', None)
+      if (operator != None and operator.matches(custom_levs, (self.nlat, self.nlon))):
+         return operator
 
       try:
-         #topo = np.ma.filled(self.mec_topo, 0.0) # nlev, nlat, nlon
-         mec_mask = np.any(self.mec_topo, axis=0)
-         print('INFO: %s: using %d grid points out of a total %d' % (rtnnam(), mec_mask.sum(), self.nlat * self.nlon))
+         mec_topo = self.mec_topo
       except AttributeError:
          msg = """
          Glacier topography has not been set in class VectorMecVariable! You must first set topography
          using class methods setGlcTopoCouplerFile() or setGlcFracHistfile()"""
          raise AttributeError(msg)
+      if (self.index.window_mask is not None):
+         mec_topo = mec_topo * self.index.window_mask # no MEC columns outside the region
+      return getCachedInterpOperator(mec_topo, custom_levs)
 
-      # get 3D view of variable
-      var3d = self.getGridded3d() # dimensions (ntime, nlat, nlon, GLC_NEC)
 
-      mec_topo2 = self.mec_topo
+   def setInterpOperator(self, operator):
+      """
+      Set precomputed interpolation weights to custom levels, e.g. saved by InterpOperator.save(). 
+      The topography is then not needed for these levels. Weights of the whole grid are 
+      cropped to the region of the variable, cells outside the region are dropped.
 
-      # mask out all tundra columns
-      mec_topo2[0,:,:] = np.ma.masked
+      :param operator:  InterpOperator or filename of a weight file
+      :type operator:   InterpOperator or string
+      """
+      if (isinstance(operator, str)):
+         operator = readCachedInterpOperator(operator) # read once per file
+      if (self.index.window != None and operator.grid_shape == self.index.grid_shape):
+         operator = operator.crop(self.index.window)
+      if (operator.grid_shape != (self.nlat, self.nlon)):
+         raise ValueError('grid dimensions do not match!')
+      if (self.index.window_mask is not None):
+         operator = operator.select(self.index.window_mask)
+      self.interp_operator = operator
 
-      # mask out missing MEC columns (they have 0 height)
-      mec_topo2 = np.ma.masked_less(mec_topo2, 1e-3)
-      
-      nvalid = np.ma.any(mec_topo2, axis=0).sum()
-      print('INFO: %s: removing %d invalid grid points: they only contained tundra class (%d remaining)' % (rtnnam(), mec_mask.sum() - nvalid, nvalid))
-      mec_mask = np.any(mec_topo2, axis=0)
-
-      # loop grid points that contain at least 1 MEC column
-      ix, iy = np.where(mec_mask)
-      #print(ix.shape, iy.shape)
-      for ii in range(len(ix)):
-      #for ii in [10, 2000, 6000, 6500]: # testing with 2 AIS points and 2 GrIS points
-         xx = mec_topo2[:,ix[ii], iy[ii]]
-         exist, = np.ma.where(xx)
-         kexist = len(exist)
-         xp = xx[exist] # elevations of all MEC classes that exist
-
-         # loop time steps
-         for itime in range(self.ntime):
-            # function values used in interpolation (= field values corresponding to heights xp)
-            # indices are shifted by one due to presence of tundra class in mec_topo
-            fp = var3d[itime, ix[ii], iy[ii], exist-1] 
-
-            if (kexist > 1):
-               # Interpolate to target levels using first order (= linear) splines from Scipy.
-               # This way, we can linearly interpolate / extrapolate to any level, even sea level (z = 0).
-               # Note: whether linear extrapolation makes sense really depends on the variable at hand.
-               # Alternatively, numpy.interp() may be used, which extrapolates with constant value 
-               # (i.e. repeating the boundary value).
-               spl = InterpolatedUnivariateSpline(np.asarray(xp), np.asarray(fp), k=1)
-               var_out[itime, ix[ii], iy[ii], :] = spl(custom_levs)
 
-            else:
-               # single MEC column at this grid point, can only be constantly extrapolated
-               var_out[itime, ix[ii], iy[ii], :] = fp
+   def getGathered(self, cells):
+      """
+      Returns vector data with levels (MEC) on a given set of grid cells only, 
+      without building the full grid. Cells without data are masked (or NaN).
 
-      # Mask out points with missing value
-      #var_out = np.ma.masked_greater(var_out, 1e34)
+      :param cells:    flat grid cell indices (ilat*nlon + ilon)
+      :type cells:     numpy array
+      :returns:        numpy array (ntime,ncell,nlev)
+      """
+      if (self.lazy):
+         raise RuntimeError('data has not been read into memory (lazy = True), use iterChunks()')
 
-      # report number of non-missing points
-      print('INFO: %s: number of non-zero points: %d' %  (rtnnam(), var_out.count() / self.ntime))
+      with stats.timer('scatter'):
+         ncell = len(cells)
+         if (self.backend == 'nan'):
+            var_out = np.full((self.ntime,ncell*GLC_NEC), np.nan, dtype=np.float32)
+         else:
+            var_out = np.ma.zeros((self.ntime,ncell*GLC_NEC))
+            var_out[:] = np.ma.masked
+
+         if (self.var_type == "lon"): 
+            # special case: this variable is in fact not unstructured
+            data = self.data.reshape(self.ntime, self.nlat*self.nlon)[:,cells]
+            var_out = var_out.reshape(self.ntime,ncell,GLC_NEC)
+            for lev in range(GLC_NEC): 
+               var_out[:,:,lev] = data
+         else:
+            # position of each MEC column among the cells, -1 if not present
+            lookup = np.full(self.nlat*self.nlon, -1, dtype=int)
+            lookup[cells] = np.arange(ncell)
+            pos = lookup[self.index.mec_cell]
+            keep = (pos >= 0)
+            flat = pos[keep] * GLC_NEC + self.index.mec_lev[keep]
+
+            mec_cols = self.getMecColumns()[keep]
+            if (self.ndim == 1):
+               var_out[:,flat] = self.data[mec_cols]
+            else:
+               var_out[:,flat] = self.data[:,mec_cols]
+            var_out = var_out.reshape(self.ntime,ncell,GLC_NEC)
+            stats.count('columns_scattered', self.ntime * len(mec_cols))
+
+         # Mask out points with missing value (already NaN for backend 'nan')
+         if (self.backend == 'masked'):
+            var_out = np.ma.masked_greater(var_out, 1e34)
+      stats.peak('array_bytes', var_out.nbytes)
       return var_out
+
+
+   def getGathered3d(self, custom_levs=None):
+      """
+      Returns vector data with levels on the grid cells that contain ice only 
+      ("compression by gathering"). Memory scales with the ice area rather than the grid size.
+
+      Without custom levels, the cells are those with at least one MEC column and 
+      the levels are the MEC levels (see getGridded3d). With custom levels, the cells are 
+      those with a valid topographic height (see getGridded3dCustomLevels).
+
+      :param custom_levs:        custom levels (optional)
+      :type custom_levs:         python list
+      :returns:   GatheredField
+      """
+      if (self.nlayer != None):
+         gathered = self.foldLayers().getGathered3d(custom_levs)
+         return GatheredField(self.unfoldLayers(gathered.data), gathered.cells, self.lats, self.lons)
+
+      if (custom_levs == None):
+         if (self.var_type == "lon"):
+            cells = np.arange(self.nlat*self.nlon) # not unstructured, nothing to gather
+         else:
+            cells = self.index.mec_cells
+         var = self.getGathered(cells)
+      else:
+         cells, var = self.interpCustomLevels(custom_levs)
+
+      logger.info('gathered %d grid points out of a total %d', len(cells), self.nlat * self.nlon)
+      return GatheredField(var, cells, self.lats, self.lons)
  
 
+   def griddedToVector(self, gfield, mec_levels=False, lev_axis=1):
+      """
+      Map a gridded field back onto the columns (or pfts) of this variable, 
+      i.e. the inverse of gridding. Any number of leading dimensions (e.g. time) 
+      is handled in a single operation.
+
+      With mec_levels = True the field has MEC levels, e.g. as written by vector2gridded3d 
+      without custom levels, and each MEC column takes the value of its own level.
+      Other columns are then masked (or NaN for unmasked float input).
+
+      :param gfield:       gridded field, last two dimensions are (nlat, nlon), 
+                           with mec_levels an additional level dimension of length GLC_NEC
+      :param mec_levels:   field has MEC levels (optional)
+      :param lev_axis:     axis of the level dimension (optional), 1 for (time, lev, lat, lon) 
+                           or -1 for the (time, lat, lon, lev) layout of getGridded3d()
+      :type gfield:        numpy array
+      :type mec_levels:    bool
+      :type lev_axis:      int
+      :returns:            numpy array (..., nvec)
+      """
+      if (self.var_type == "lon"):
+         raise ValueError('variable %s is not a vector variable' % self.varname)
+
+      if (mec_levels):
+         gfield = np.moveaxis(gfield, lev_axis, -1) # ..., nlat, nlon, nlev
+         if (gfield.shape[-3:] != (self.nlat, self.nlon, GLC_NEC)):
+            raise ValueError('grid dimensions do not match!')
+
+         lev = np.ma.filled(self.coltype, -1) - (COLUNIT_GLCMEC*100 + 1) # level 0 is tundra, omit this
+         ismec = (lev >= 0) & (lev < GLC_NEC)
+         flat = gfield.reshape(gfield.shape[:-3] + (self.nlat*self.nlon*GLC_NEC,))
+         vec = flat[..., self.cell * GLC_NEC + np.where(ismec, lev, 0)]
+
+         if (np.ma.isMaskedArray(vec)):
+            vec[..., ~ismec] = np.ma.masked
+         else:
+            vec = vec.astype(np.result_type(vec.dtype, np.float32))
+            vec[..., ~ismec] = np.nan
+         return vec
+
+      else:
+         if (gfield.shape[-2:] != (self.nlat, self.nlon)):
+            raise ValueError('grid dimensions do not match!')
+         flat = gfield.reshape(gfield.shape[:-2] + (self.nlat*self.nlon,))
+         return flat[..., self.cell]
+
+
+   def getRegionTotals(self, regions, area=None):
+      """
+      Returns area weighted totals and means of the MEC columns per region (e.g. ice sheet 
+      or basin), computed directly on the vector data for all time steps at once, 
+      without building the gridded field.
+
+      Each MEC column is weighted by the area of its grid cell times its glacier fraction, 
+      so the glacier fraction must be set first (see setGlcFracCouplerFile()). For the totals 
+      the fraction must be a fraction of the grid cell (as in the coupler file); 
+      the means do not depend on the scaling of the fraction. Missing values are excluded.
+
+      Example: integrated ice melt (kg/s) from QICE (mm/s = kg/m2/s)
+         totals, means = vmv.getRegionTotals(basins)
+
+      :param regions:   region id of every grid cell, 0 means no region; 
+                        a boolean mask defines a single region
+      :param area:      area of the grid cells in m2 (optional, default computed from the grid)
+      :type regions:    numpy array (nlat, nlon) of integers or booleans
+      :type area:       numpy array (nlat, nlon)
+      :returns:         tuple (totals, means) of numpy arrays (ntime, nregion), 
+                        column i holds region id i+1; with layers (ntime, nlayer, nregion)
+      """
+      if (self.var_type == "lon"):
+         raise ValueError('variable %s is not a vector variable' % self.varname)
+      if (self.lazy):
+         raise RuntimeError('data has not been read into memory (lazy = True), use iterChunks()')
+      if (self.nlayer != None):
+         totals, means = self.foldLayers().getRegionTotals(regions, area)
+         return self.unfoldLayers(totals), self.unfoldLayers(means)
+
+      try:
+         frac = np.ma.filled(self.mec_frac, 0.0)
+      except AttributeError:
+         msg = """
+         Glacier fraction has not been set in class VectorMecVariable! You must first set fraction 
+         using class methods setGlcFracCouplerFile() or setGlcFracSurfdat()"""
+         raise AttributeError(msg)
+
+      if (area is None):
+         area = self.index.getCellArea()
+      regions = np.asarray(regions).astype(int)
+      if (regions.shape != (self.nlat, self.nlon) or np.shape(area) != (self.nlat, self.nlon)):
+         raise ValueError('grid dimensions do not match!')
+      nregion = regions.max() + 1 # including region 0 (no region)
+
+      # weights and region of every MEC column
+      mec_cell = self.index.mec_cell
+      weight = frac.reshape(GLC_NEC+1, -1)[self.index.mec_lev+1, mec_cell] * np.ravel(area)[mec_cell]
+      region = np.ravel(regions)[mec_cell]
+
+      # values of the MEC columns, missing values get zero weight
+      mec_cols = self.getMecColumns()
+      if (self.ndim == 1):
+         values = self.data[mec_cols][None,:]
+      else:
+         values = self.data[:,mec_cols]
+      if (self.backend == 'nan'):
+         missing = np.isnan(values)
+      else:
+         values = np.ma.masked_greater(values, 1e34)
+         missing = np.ma.getmaskarray(values)
+      values = np.where(missing, 0.0, np.ma.getdata(values))
+      weights = np.where(missing, 0.0, weight[None,:])
+
+      # grouped sums over (time, region) in a single pass
+      ntime = values.shape[0]
+      groups = (region[None,:] + nregion * np.arange(ntime)[:,None]).ravel()
+      totals = np.bincount(groups, weights=(values * weights).ravel(), minlength=ntime*nregion).reshape(ntime, nregion)
+      wsum = np.bincount(groups, weights=weights.ravel(), minlength=ntime*nregion).reshape(ntime, nregion)
+
+      with np.errstate(divide='ignore', invalid='ignore'):
+         means = totals / wsum # NaN for regions without ice
+      return totals[:,1:], means[:,1:]
+
+
+   def aggregate(self, parent, normalize=True):
+      """
+      Returns the weighted mean of the vector data per parent in the subgrid hierarchy, 
+      e.g. of the pfts of every column, using the index and weight metadata of the 
+      vector file (pfts1d_ci and pfts1d_wtcol, cols1d_gi and cols1d_wtgcell, ...). 
+      All time steps (and layers) are aggregated at once, see VectorAggregation. 
+      Missing values are excluded; parents without valid values are missing.
+
+      :param parent:       'column' (pft variables only), 'landunit' or 'gridcell'
+      :param normalize:    weighted mean (default) or weighted sum of the valid values
+      :type parent:        string
+      :type normalize:     bool
+      :returns:            numpy array (..., nparent), parent i has 1-based index i+1 in the vector file
+      """
+      if (self.var_type == "lon"):
+         raise ValueError('variable %s is not a vector variable' % self.varname)
+      if (self.lazy):
+         raise RuntimeError('data has not been read into memory (lazy = True), use iterChunks()')
+
+      try:
+         aggregation = self.index.getAggregation(parent)
+      except KeyError as e:
+         raise RuntimeError('%s, use optional argument fname_vecinfo in the constructor to point to a file that contains it' % e.args[0])
+      if (self.cols is not None):
+         aggregation = aggregation.subset(self.cols)
+
+      with stats.timer('average'):
+         return aggregation.apply(self.data, normalize)
+
+
+   def pft2col(self):
+      """
+      Returns a pft variable aggregated to columns (weights pfts1d_wtcol), as a column 
+      variable that can be gridded and reduced like any other column variable. 
+      Grid information, topography and glacier fraction are kept.
+
+      :returns:   VectorMecVariable
+      """
+      if (self.var_type != "pft"):
+         raise ValueError('variable %s is not a pft variable' % self.varname)
+      data = self.aggregate('column')
+
+      col = copy.copy(self)
+      col.var_type = "column"
+      col.readVectorInfo() # column index, with mec_only the MEC columns, with region the columns in the region
+      if (col.cols is not None or col.index.vec_cols is not None):
+         cols = np.arange(len(col.index.coltype)) if (col.cols is None) else col.cols
+         data = data[..., col.index.getFilePositions(cols)]
+      col.nvec = data.shape[-1]
+      col.setData(data, self.time)
+      return col
+
+
+   def subsetRegion(self, region):
+      """
+      Returns a shallow copy of this instance restricted to a region, as if it had been 
+      created with the region (see constructor). Data that has been read is subset, 
+      lazy data will be read for the region only. Glacier fraction, topography 
+      and interpolation weights are cropped.
+
+      :param region:    region, see constructor
+      :returns:         VectorMecVariable
+      """
+      if (self.region != None):
+         raise ValueError('variable %s has already been restricted to %s' % (self.varname, str(self.region)))
+
+      sub = copy.copy(self)
+      sub.region = getRegion(region)
+      sub.readVectorInfo()
+
+      if (self.var_type == "lon"):
+         sub.nvec = sub.nlat * sub.nlon
+         sub.shape = self.shape[:-2] + (sub.nlat, sub.nlon)
+         if (not self.lazy):
+            sub.data = sub.index.cropField(self.data)
+      else:
+         cols = np.arange(len(sub.index.coltype)) if (sub.cols is None) else sub.cols
+         sel = np.searchsorted(self.getFilePositions(), sub.index.getFilePositions(cols))
+         sub.nvec = len(sel)
+         sub.shape = self.shape[:-1] + (sub.nvec,)
+         if (not self.lazy):
+            sub.data = self.data[..., sel]
+
+      for name in ('mec_topo', 'mec_frac'):
+         if (hasattr(self, name)):
+            setattr(sub, name, sub.index.cropField(getattr(self, name)))
+      if (hasattr(self, 'interp_operator')):
+         sub.setInterpOperator(self.interp_operator)
+      return sub
+
+
    def divideByGriddedField(self,gfield):
       """ 
       To calculate albedo, we need to divide FSR by a regular lat/lon field. 
       This routine implements the division by a gridded field. 
 
-      :param gfield:  numpy array
+      :param gfield:  numpy array, on the grid of this variable or, for a region, on the whole grid
       """
-      print(self.nlat, self.nlon)
-      print(gfield.shape)
+      logger.debug('grid %d x %d, field shape %s', self.nlat, self.nlon, str(gfield.shape))
+      if (self.index.window != None and gfield.shape[-2:] == self.index.grid_shape):
+         gfield = self.index.cropField(gfield) # whole grid, crop to the region
       if(self.nlat != gfield.shape[0] or self.nlon != gfield.shape[1]):
          raise ValueError('grid dimensions do not match!')
       
@@ -431,13 +1176,10 @@ class VectorMecVariable(object):
 
       #coords = list(zip(self.ixy-1 ,self.jxy-1))
       #print(coords)
-      print(gfield[0,0])
-      print(gfield[100,100])
 
       #print(gfield[self.jxy-1,self.ixy-1][1000:1010])
-      fsds = gfield[self.jxy-1,self.ixy-1]
-      print(self.data.shape)
-      print(fsds.shape)
+      fsds = self.griddedToVector(gfield)
+      logger.debug('data shape %s, field shape %s', str(self.data.shape), str(fsds.shape))
       self.data /= fsds
          #print(tskin[:,idx].shape, var_out[:,iy,ix,lev].shape)
          #var_out[:,iy,ix,lev] = self.data[:,idx]
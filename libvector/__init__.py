@@ -1,4 +1,21 @@
 
 from .VectorMecVariable import VectorMecVariable
+from .VectorIndex import VectorIndex, getVectorIndex
 from .vector2gridded2d import vector2gridded2d 
 from .vector2gridded3d import vector2gridded3d 
+from .readVectorMecVariables import readVectorMecVariables
+from .convertFiles import convertFiles, concatenateTime
+from .GatheredField import GatheredField
+from .vector2gathered3d import vector2gathered3d
+from .glcCache import setCacheDir, clearCache
+from .TimeAggregator import TimeAggregator, aggregateFiles
+from .runStats import RunStats, getStats, enableStats
+from .common import enableLogging
+from .batchConvert import batchConvert
+from .vector2xarray import vector2xarray
+from .interpLevels import setInterpWorkers, emptyShared
+from .VectorAggregation import VectorAggregation
+from .Region import Region, getIceSheetRegion
+from .InterpOperator import InterpOperator, readInterpOperator
+from .vector2array import vector2array, openRawArray
+from .conversionWorker import ConversionWorker, submitJob
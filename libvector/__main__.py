@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command line entry point: python -m libvector manifest.json, see batchConvert, 
+and python -m libvector worker ..., see conversionWorker
+
+@author: L.vankampenhout@uu.nl
+"""
+import sys
+
+if (len(sys.argv) > 1 and sys.argv[1] == 'worker'):
+   from .conversionWorker import main
+   sys.exit(main(sys.argv[2:]))
+
+from .batchConvert import main
+
+sys.exit(main())
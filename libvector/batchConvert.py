@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental batch conversion of vector files, driven by a job manifest.
+
+The manifest is a JSON file, e.g.
+
+   {
+      "files"        : "/archive/f.e20.FHIST.f09_001/lnd/hist/*.clm2.h2.*.nc",
+      "variables"    : ["QICE", "TSA"],
+      "output_dir"   : "gridded",
+      "mode"         : "3d",
+      "custom_levs"  : [100.0, 300.0, 550.0, 850.0, 1150.0, 1450.0, 1800.0, 2250.0, 2750.0, 3500.0],
+      "topo_coupler_restart" : "/archive/f.e20.FHIST.f09_001/rest/1994-01-01-00000/f.e20.FHIST.f09_001.cpl.r.1994-01-01-00000.nc"
+   }
+
+Required keys are files (glob pattern or list), variables and output_dir. Optional keys are
+mode ('2d', '3d' or 'gathered', default '3d'), custom_levs, the source of the topography
+(topo_coupler_restart or topo_histfile), the source of the glacier fraction (frac_coupler_history
+or frac_surfdat), interpolation weights written by InterpOperator.save() (interp_weights,
+which replace the topography), and fname_vecinfo, nprocs, chunksize, backend, writer_options, region as in convertFiles()
+(a region is a name such as "greenland_box", a box such as {"lat" : [60, 85], "lon" : [280, 350]}
+or an ice sheet such as {"ice_sheet" : "GrIS", "surfdat" : "surfdata.nc"}, see Region).
+Relative paths are relative to the directory of the manifest.
+
+Every completed output is recorded in a state file in the output directory, together with the
+size and modification time of its input (or a checksum of its content, see checksum) and a hash
+of the settings. On a re-run, only inputs that are new or changed, outputs that are missing and
+outputs written with other settings are converted. The state is saved after every input file,
+so an interrupted campaign resumes where it stopped. Usage:
+
+   python -m libvector manifest.json [--dry-run] [--force] [--checksum sha1]
+
+@author: L.vankampenhout@uu.nl
+"""
+import os
+import glob
+import json
+import hashlib
+import argparse
+import tempfile
+
+from .common import logger, enableLogging
+from .VectorMecVariable import VectorMecVariable
+from .convertFiles import convertFiles
+
+STATE_FILENAME = 'libvector_state.json'
+CHECKSUMS = ('mtime', 'md5', 'sha1')
+_PATH_KEYS = ('files', 'output_dir', 'fname_vecinfo', 'topo_coupler_restart', 'topo_histfile',
+              'frac_coupler_history', 'frac_surfdat', 'interp_weights')
+
+
+def readManifest(fname_manifest):
+   """
+   Read a job manifest (see module documentation), paths are made absolute
+
+   :param fname_manifest:  filename of manifest (JSON)
+   :returns:               dict
+   """
+   with open(fname_manifest, 'r') as f:
+      manifest = json.load(f)
+
+   for key in ('files', 'variables', 'output_dir'):
+      if (key not in manifest):
+         raise ValueError('manifest %s has no entry %s' % (fname_manifest, key))
+
+   root = os.path.dirname(os.path.abspath(fname_manifest))
+   for key in _PATH_KEYS:
+      if (key in manifest):
+         if (isinstance(manifest[key], list)):
+            manifest[key] = [os.path.join(root, path) for path in manifest[key]]
+         else:
+            manifest[key] = os.path.join(root, manifest[key])
+   if (isinstance(manifest.get('region'), dict) and 'surfdat' in manifest['region']):
+      manifest['region']['surfdat'] = os.path.join(root, manifest['region']['surfdat'])
+   return manifest
+
+
+def fileSignature(filename, checksum='mtime'):
+   """
+   Signature of a file that changes when the file changes
+
+   :param filename:  filename
+   :param checksum:  'mtime' (size and modification time) or a hash of the content: 'md5' or 'sha1'
+   :returns:         dict
+   """
+   st = os.stat(filename)
+   signature = dict(size=st.st_size, mtime_ns=st.st_mtime_ns)
+   if (checksum != 'mtime'):
+      h = hashlib.new(checksum)
+      with open(filename, 'rb') as f:
+         for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+      signature = dict(size=st.st_size, checksum='%s:%s' % (checksum, h.hexdigest()))
+   return signature
+
+
+def settingsHash(manifest):
+   """
+   Hash of all settings that determine the content of an output file,
+   including the signatures of the topography, fraction and interpolation weight files
+   """
+   settings = dict((key, manifest.get(key)) for key in ('mode', 'custom_levs', 'backend', 'writer_options', 'fname_vecinfo'))
+   if ('region' in manifest):
+      settings['region'] = manifest['region'] # only if present, so that outputs of earlier manifests remain valid
+      if (isinstance(manifest['region'], dict) and 'surfdat' in manifest['region']):
+         settings['region_surfdat'] = fileSignature(manifest['region']['surfdat']) # ice sheet mask
+   for key in ('topo_coupler_restart', 'topo_histfile', 'frac_coupler_history', 'frac_surfdat', 'interp_weights'):
+      if (key in manifest):
+         settings[key] = [manifest[key], fileSignature(manifest[key])]
+   return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def loadState(fname_state):
+   """
+   Returns recorded outputs: dict output filename -> record
+   """
+   if (not os.path.exists(fname_state)):
+      return {}
+   with open(fname_state, 'r') as f:
+      return json.load(f)
+
+
+def saveState(fname_state, state):
+   """
+   Write recorded outputs, atomically so that an interrupted run leaves a valid state file
+   """
+   fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fname_state), suffix='.tmp')
+   with os.fdopen(fd, 'w') as f:
+      json.dump(state, f, indent=1, sort_keys=True)
+   os.replace(tmp, fname_state)
+
+
+def outputFilename(output_dir, fname_vector, varname):
+   """
+   Output filename of a variable of a vector file, as written by convertFiles()
+   """
+   basename = os.path.splitext(os.path.basename(fname_vector))[0]
+   return os.path.join(output_dir, '%s.%s.nc' % (basename, varname))
+
+
+def pendingFiles(manifest, state, checksum='mtime', force=False):
+   """
+   Returns the input files that have at least one output that is missing or out of date,
+   and the signatures of all input files
+   """
+   files = manifest['files']
+   if (isinstance(files, str)):
+      files = sorted(glob.glob(files))
+
+   config = settingsHash(manifest)
+   pending, signatures = [], {}
+   for fname_vector in files:
+      signatures[fname_vector] = fileSignature(fname_vector, checksum)
+      expected = dict(input=fname_vector, signature=signatures[fname_vector], settings=config)
+      for varname in manifest['variables']:
+         fname_out = outputFilename(manifest['output_dir'], fname_vector, varname)
+         if (force or state.get(fname_out) != expected or not os.path.exists(fname_out)):
+            pending.append(fname_vector)
+            break
+   return pending, signatures, config
+
+
+def setGlcFields(vmv, manifest):
+   """
+   Set MEC topography and glacier fraction of a variable from the sources in a manifest (or job)
+   """
+   if ('topo_coupler_restart' in manifest):
+      vmv.setGlcTopoCouplerFile(manifest['topo_coupler_restart'])
+   elif ('topo_histfile' in manifest):
+      vmv.setGlcTopoHistfile(manifest['topo_histfile'])
+   if ('frac_coupler_history' in manifest):
+      vmv.setGlcFracCouplerFile(manifest['frac_coupler_history'])
+   elif ('frac_surfdat' in manifest):
+      vmv.setGlcFracSurfdat(manifest['frac_surfdat'])
+
+
+def readGlcFields(manifest, fname_vector):
+   """
+   Returns MEC topography and glacier fraction set by the manifest (or None)
+   """
+   if not any(key in manifest for key in ('topo_coupler_restart', 'topo_histfile', 'frac_coupler_history', 'frac_surfdat')):
+      return None, None
+
+   vmv = VectorMecVariable(manifest['variables'][0], fname_vector, fname_vecinfo=manifest.get('fname_vecinfo'), lazy=True)
+   setGlcFields(vmv, manifest)
+   return getattr(vmv, 'mec_topo', None), getattr(vmv, 'mec_frac', None)
+
+
+def batchConvert(manifest, checksum='mtime', force=False, dry_run=False):
+   """
+   Convert all new or changed input files of a job manifest (see module documentation)
+
+   :param manifest:  filename of manifest, or manifest as dict
+   :param checksum:  'mtime' (default, size and modification time) or 'md5' / 'sha1'
+                     (hash of the content, slower but robust against copies that touch files)
+   :param force:     convert all input files
+   :param dry_run:   only report which input files would be converted
+   :type manifest:   string or dict
+   :returns:         list of input files that were (or would be) converted
+   """
+   if (isinstance(manifest, str)):
+      manifest = readManifest(manifest)
+   if (checksum not in CHECKSUMS):
+      raise ValueError('unknown checksum: %s, choose from %s' % (checksum, str(CHECKSUMS)))
+
+   output_dir = manifest['output_dir']
+   fname_state = os.path.join(output_dir, STATE_FILENAME)
+   state = loadState(fname_state)
+
+   pending, signatures, config = pendingFiles(manifest, state, checksum, force)
+   logger.info('%d of %d input files are new or changed', len(pending), len(signatures))
+   if (dry_run or len(pending) == 0):
+      return pending
+
+   if (not os.path.isdir(output_dir)):
+      os.makedirs(output_dir)
+   mec_topo, mec_frac = readGlcFields(manifest, pending[0])
+
+   def record(fname_vector, fnames_out):
+      for fname_out in fnames_out:
+         state[fname_out] = dict(input=fname_vector, signature=signatures[fname_vector], settings=config)
+      saveState(fname_state, state)
+
+   convertFiles(pending, manifest['variables'], output_dir, mode=manifest.get('mode', '3d'),
+                custom_levs=manifest.get('custom_levs'), mec_topo=mec_topo, mec_frac=mec_frac,
+                fname_vecinfo=manifest.get('fname_vecinfo'), nprocs=manifest.get('nprocs'),
+                chunksize=manifest.get('chunksize'), backend=manifest.get('backend', 'masked'),
+                writer_options=manifest.get('writer_options'), callback=record, region=manifest.get('region'),
+                interp_operator=manifest.get('interp_weights'))
+   return pending
+
+
+def main(argv=None):
+   parser = argparse.ArgumentParser(prog='python -m libvector', description='Convert new or changed CLM vector files listed in a job manifest')
+   parser.add_argument('manifest', help='job manifest (JSON)')
+   parser.add_argument('--checksum', default='mtime', choices=CHECKSUMS,
+                       help='detect changed inputs by size and modification time (default) or by a hash of the content')
+   parser.add_argument('--force', action='store_true', help='convert all input files')
+   parser.add_argument('--dry-run', action='store_true', help='only list the input files that would be converted')
+   parser.add_argument('--quiet', action='store_true', help='do not report progress')
+   args = parser.parse_args(argv)
+
+   if (not args.quiet):
+      enableLogging()
+
+   pending = batchConvert(args.manifest, checksum=args.checksum, force=args.force, dry_run=args.dry_run)
+   for fname_vector in pending:
+      print(fname_vector)
+   return 0
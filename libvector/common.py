@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Constants and helpers shared by the modules of this package
+
+@author: L.vankampenhout@uu.nl
+"""
+import sys
+import logging
+import threading
+
+GLC_NEC = 10 # maximum number of elevation classes present in input file
+COLUNIT_GLCMEC = 4 # for landunit types and column types, land ice = 7 (older CLM) land ice = 4 (newer CLM)
+
+
+rtnnam = lambda: sys._getframe(1).f_code.co_name # helper function that queries name of current routine
+
+logger = logging.getLogger('libvector') # progress is reported at level INFO, see enableLogging()
+
+nc_lock = threading.Lock() # the netCDF/HDF5 library is not thread safe, reading from threads is serialized
+
+
+def enableLogging(level=logging.INFO, stream=sys.stdout):
+   """
+   Report progress of this package on a stream, in the format "INFO: routine: message".
+   For more control, configure the 'libvector' logger with the logging module instead.
+
+   :param level:     logging level (optional)
+   :param stream:    output stream (optional)
+   """
+   if (not logger.handlers):
+      handler = logging.StreamHandler(stream)
+      handler.setFormatter(logging.Formatter('%(levelname)s: %(funcName)s: %(message)s'))
+      logger.addHandler(handler)
+   logger.setLevel(level)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent local conversion worker.
+
+Every script that converts a single variable pays for starting Python, importing netCDF4
+and building the vector index, glacier topography and fraction (and interpolation weights)
+of its grid. A worker process keeps these in memory (see getVectorIndex, glcCache and
+InterpOperator) and accepts conversion jobs over a local Unix socket, such that a job only
+costs reading, gridding and writing the variable. Start it with
+
+   python -m libvector worker serve [--socket /tmp/libvector.sock]
+
+and submit jobs with submitJob() or from the command line
+
+   python -m libvector worker submit f.clm2.h2.nc QICE qice.nc --levels 0 500 1000 \\
+      --topo-coupler-restart f.cpl.r.nc
+
+A job is a dict with the keys file, variable and output, and optional keys mode ('2d', '3d'
+or 'gathered', default '3d'), custom_levs, the sources of topography and glacier fraction and
+interp_weights, fname_vecinfo, chunksize, backend, writer_options and region, as in a job
+manifest (see batchConvert). Jobs are run one at a time, in the order they arrive.
+
+Requests and responses are single lines of JSON. A response has status 'ok' or 'error'.
+A job that lacks the glacier fields of its mode (fraction for 2d, topography or weights
+for custom levels) fails before its output file is created.
+
+@author: L.vankampenhout@uu.nl
+"""
+import os
+import sys
+import json
+import time
+import socket
+import getpass
+import argparse
+import tempfile
+import threading
+import socketserver
+
+from .common import logger, enableLogging
+from .VectorMecVariable import VectorMecVariable
+from .vector2gridded2d import vector2gridded2d
+from .vector2gridded3d import vector2gridded3d
+from .vector2gathered3d import vector2gathered3d
+from .batchConvert import setGlcFields, _PATH_KEYS
+
+DEFAULT_SOCKET = os.environ.get('LIBVECTOR_SOCKET', os.path.join(tempfile.gettempdir(), 'libvector-%s.sock' % getpass.getuser()))
+MODES = ('2d', '3d', 'gathered')
+COMMANDS = ('convert', 'ping', 'shutdown')
+
+
+def runJob(job):
+   """
+   Convert a single variable of a vector file, using the glacier fields and grid
+   information kept in memory by earlier jobs
+
+   :param job:    dict, see module documentation
+   :returns:      name of the output file
+   """
+   for key in ('file', 'variable', 'output'):
+      if (key not in job):
+         raise KeyError('job is missing required key: ' + key)
+   mode = job.get('mode', '3d')
+   if (mode not in MODES):
+      raise ValueError('unknown mode: %s, choose from %s' % (mode, str(MODES)))
+
+   vmv = VectorMecVariable(job['variable'], job['file'], fname_vecinfo=job.get('fname_vecinfo'), lazy=True,
+                           backend=job.get('backend', 'masked'), region=job.get('region'))
+   setGlcFields(vmv, job)
+   if ('interp_weights' in job):
+      vmv.setInterpOperator(job['interp_weights'])
+   checkJob(vmv, mode, job.get('custom_levs'))
+
+   options = dict(chunksize=job.get('chunksize'), **job.get('writer_options', {}))
+   if (mode == '2d'):
+      vector2gridded2d(vmv, job['output'], **options)
+   elif (mode == 'gathered'):
+      vector2gathered3d(vmv, job['output'], job.get('custom_levs'), **options)
+   else:
+      vector2gridded3d(vmv, job['output'], job.get('custom_levs'), **options)
+   return job['output']
+
+
+def checkJob(vmv, mode, custom_levs):
+   """
+   Check that the glacier fields needed by a mode are set, before the output file is created
+
+   :param vmv:            VectorMecVariable instance with the glacier fields of the job
+   :param mode:           '2d', '3d' or 'gathered'
+   :param custom_levs:    custom levels of elevation (m) or None
+   """
+   if (mode == '2d' and not hasattr(vmv, 'mec_frac')):
+      raise ValueError('mode 2d requires the glacier fraction: set frac_coupler_history or frac_surfdat')
+   operator = getattr(vmv, 'interp_operator', None)
+   if (mode != '2d' and custom_levs != None and not hasattr(vmv, 'mec_topo') and 
+         not (operator != None and operator.matches(custom_levs, (vmv.nlat, vmv.nlon)))):
+      raise ValueError('custom levels require the topography: set topo_coupler_restart, topo_histfile or interp_weights')
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+   """
+   Handles a single request: one line of JSON in, one line of JSON out
+   """
+
+   def handle(self):
+      t0 = time.time()
+      try:
+         request = json.loads(self.rfile.readline().decode('utf-8'))
+         command = request.pop('command', 'convert')
+         if (command not in COMMANDS):
+            raise ValueError('unknown command: %s, choose from %s' % (command, str(COMMANDS)))
+
+         if (command == 'convert'):
+            output = runJob(request)
+            self.server.njobs += 1
+            response = dict(status='ok', output=output)
+            logger.info('converted %s of %s in %.2f s', request['variable'], request['file'], time.time() - t0)
+         elif (command == 'ping'):
+            response = dict(status='ok', pid=os.getpid(), njobs=self.server.njobs, uptime=time.time() - self.server.start_time)
+         else:
+            response = dict(status='ok')
+            threading.Thread(target=self.server.shutdown).start() # shutdown() waits for serve_forever() to return
+      except Exception as e:
+         logger.exception('request failed')
+         response = dict(status='error', error='%s: %s' % (type(e).__name__, str(e)))
+
+      response['elapsed'] = time.time() - t0
+      self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class ConversionWorker(socketserver.UnixStreamServer):
+   """
+   Conversion worker listening on a Unix socket, see module documentation
+   """
+
+   def __init__(self, socket_path=DEFAULT_SOCKET):
+      """
+      :param socket_path:    filename of the Unix socket (optional)
+      :type socket_path:     string
+      """
+      if (os.path.exists(socket_path)):
+         if (_isListening(socket_path)):
+            raise RuntimeError('a worker is already listening on ' + socket_path)
+         os.remove(socket_path) # left behind by a worker that was killed
+      socketserver.UnixStreamServer.__init__(self, socket_path, _JobHandler)
+      self.socket_path = socket_path
+      self.start_time = time.time()
+      self.njobs = 0
+
+
+   def serve(self):
+      """
+      Run jobs until a shutdown request (or KeyboardInterrupt), then remove the socket
+      """
+      logger.info('worker %d listening on %s', os.getpid(), self.socket_path)
+      try:
+         self.serve_forever()
+      except KeyboardInterrupt:
+         pass
+      finally:
+         self.server_close()
+         if (os.path.exists(self.socket_path)):
+            os.remove(self.socket_path)
+      logger.info('worker %d stopped after %d jobs', os.getpid(), self.njobs)
+
+
+def _isListening(socket_path):
+   """
+   Returns whether a process accepts connections on the socket
+   """
+   s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+   try:
+      s.connect(socket_path)
+      return True
+   except (ConnectionRefusedError, FileNotFoundError):
+      return False
+   finally:
+      s.close()
+
+
+def sendRequest(request, socket_path=DEFAULT_SOCKET, timeout=None):
+   """
+   Send a request to a worker and wait for the response
+
+   :param request:        dict with optional key command: 'convert' (default), 'ping' or 'shutdown'
+   :param socket_path:    filename of the Unix socket of the worker (optional)
+   :param timeout:        seconds to wait for the response (optional, default no limit)
+   :returns:              response dict
+   """
+   with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+      s.settimeout(timeout)
+      s.connect(socket_path)
+      s.sendall((json.dumps(request) + '\n').encode('utf-8'))
+      with s.makefile('rb') as f:
+         line = f.readline()
+   if (not line):
+      raise RuntimeError('worker on %s closed the connection without a response' % socket_path)
+   response = json.loads(line.decode('utf-8'))
+   if (response['status'] != 'ok'):
+      raise RuntimeError('worker on %s: %s' % (socket_path, response['error']))
+   return response
+
+
+def submitJob(job, socket_path=DEFAULT_SOCKET, timeout=None):
+   """
+   Submit a conversion job to a worker and wait until it has been converted.
+   Relative paths are relative to the current directory of the client.
+
+   :param job:            dict, e.g. dict(file='f.clm2.h2.nc', variable='QICE', output='qice.nc',
+                          custom_levs=[0., 500., 1000.], topo_coupler_restart='f.cpl.r.nc')
+   :param socket_path:    filename of the Unix socket of the worker (optional)
+   :param timeout:        seconds to wait for the job (optional, default no limit)
+   :returns:              response dict with the output filename and the elapsed time in the worker
+   """
+   job = dict(job)
+   for key in ('file', 'output') + _PATH_KEYS:
+      if (isinstance(job.get(key), str)):
+         job[key] = os.path.abspath(job[key])
+   if (isinstance(job.get('region'), dict) and 'surfdat' in job['region']):
+      job['region'] = dict(job['region'], surfdat=os.path.abspath(job['region']['surfdat']))
+   job['command'] = 'convert'
+   return sendRequest(job, socket_path, timeout)
+
+
+def main(argv=None):
+   parser = argparse.ArgumentParser(prog='python -m libvector worker', description='Persistent conversion worker and its client')
+   parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket of the worker (default %(default)s)')
+   subparsers = parser.add_subparsers(dest='action')
+   serve = subparsers.add_parser('serve', help='run a worker')
+   serve.add_argument('--quiet', action='store_true', help='do not report progress')
+   submit = subparsers.add_parser('submit', help='convert a variable')
+   submit.add_argument('file', help='vector file')
+   submit.add_argument('variable', help='CLM variable name')
+   submit.add_argument('output', help='output file')
+   submit.add_argument('--mode', default='3d', choices=MODES)
+   submit.add_argument('--levels', type=float, nargs='+', help='custom levels of elevation (m)')
+   for key in ('topo_coupler_restart', 'topo_histfile', 'frac_coupler_history', 'frac_surfdat', 'interp_weights', 'fname_vecinfo', 'region'):
+      submit.add_argument('--' + key.replace('_', '-'), dest=key)
+   subparsers.add_parser('ping', help='report the state of a worker')
+   subparsers.add_parser('stop', help='stop a worker')
+   args = parser.parse_args(argv)
+
+   if (args.action == 'serve'):
+      if (not args.quiet):
+         enableLogging()
+      ConversionWorker(args.socket).serve()
+      return 0
+
+   try:
+      if (args.action == 'submit'):
+         job = dict((key, value) for key, value in vars(args).items() if value != None and key not in ('socket', 'action', 'levels'))
+         if (args.levels != None):
+            job['custom_levs'] = args.levels
+         response = submitJob(job, args.socket)
+      elif (args.action == 'ping'):
+         response = sendRequest(dict(command='ping'), args.socket)
+      elif (args.action == 'stop'):
+         response = sendRequest(dict(command='shutdown'), args.socket)
+      else:
+         parser.print_help()
+         return 1
+   except (OSError, RuntimeError) as e:
+      print(str(e), file=sys.stderr)
+      return 1
+   print(json.dumps(response))
+   return 0
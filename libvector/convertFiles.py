@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: L.vankampenhout@uu.nl
+"""
+
+import os
+import glob
+import multiprocessing
+from netCDF4 import Dataset
+
+from .common import logger
+from .runStats import stats
+from .VectorIndex import getVectorIndex, _indexKey, _index_cache
+from .Region import getRegion
+from .readVectorMecVariables import readVectorMecVariables
+from .vector2gridded2d import vector2gridded2d
+from .vector2gridded3d import vector2gridded3d
+from .vector2gathered3d import vector2gathered3d
+
+_shared = {} # state shared with worker processes, set by _initWorker()
+
+
+def _initWorker(shared, subprocess=False):
+   """
+   Initialize a worker process with the state that is shared by all conversions:
+   the vector indices (seeded into the VectorIndex cache), MEC topography and glacier fraction.
+   Statistics of a worker subprocess start empty, they are returned per file by _convertFile().
+   """
+   _shared.update(shared, subprocess=subprocess)
+   _index_cache.update(shared['indices'])
+   if (subprocess):
+      stats.enabled = shared['stats']
+      stats.reset()
+
+
+def _convertFile(job):
+   """
+   Convert all variables of a single vector file, 
+   returns list of output filenames and statistics report of a worker subprocess (or None)
+   """
+   fname_vector, targets = job
+   variables = readVectorMecVariables(list(targets.keys()), fname_vector, fname_vecinfo=_shared['fname_vecinfo'], 
+                                      backend=_shared['backend'], region=_shared['region'],
+                                      lazy=(_shared['chunksize'] != None)) # bounded memory: read chunk by chunk
+
+   for varname, vmv in variables.items():
+      if (_shared['mec_topo'] is not None):
+         vmv.mec_topo = vmv.index.cropField(_shared['mec_topo'])
+      if (_shared['mec_frac'] is not None):
+         vmv.mec_frac = vmv.index.cropField(_shared['mec_frac'])
+      if (_shared['interp_operator'] is not None):
+         vmv.setInterpOperator(_shared['interp_operator'])
+
+      if (_shared['mode'] == '2d'):
+         vector2gridded2d(vmv, targets[varname], chunksize=_shared['chunksize'], **_shared['writer_options'])
+      elif (_shared['mode'] == 'gathered'):
+         vector2gathered3d(vmv, targets[varname], _shared['custom_levs'], chunksize=_shared['chunksize'], **_shared['writer_options'])
+      else:
+         vector2gridded3d(vmv, targets[varname], _shared['custom_levs'], chunksize=_shared['chunksize'], **_shared['writer_options'])
+
+   report = None
+   if (_shared['subprocess'] and stats.enabled):
+      report = stats.report()
+      stats.reset()
+   return list(targets.values()), report
+
+
+def concatenateTime(fnames_part, fname_target):
+   """
+   Concatenate gridded output files along the (unlimited) time dimension.
+   Dimensions, attributes and time independent variables are copied from the first file.
+
+   :param fnames_part:     filenames of gridded output files, in chronological order
+   :param fname_target:    filename of output file (netCDF)
+   """
+   with Dataset(fname_target, 'w', format='NETCDF4') as ncout:
+      with Dataset(fnames_part[0], 'r') as ncin:
+         ncout.setncatts(ncin.__dict__)
+         for name, dim in ncin.dimensions.items():
+            ncout.createDimension(name, None if dim.isunlimited() else len(dim))
+         for name, var in ncin.variables.items():
+            fill_value = var.getncattr('_FillValue') if '_FillValue' in var.ncattrs() else None
+            filters = var.filters() or {}
+            chunking = var.chunking()
+            out = ncout.createVariable(name, var.datatype, var.dimensions, fill_value=fill_value,
+                     zlib=filters.get('zlib', False), complevel=filters.get('complevel', 4), shuffle=filters.get('shuffle', False),
+                     chunksizes=None if chunking == 'contiguous' else chunking)
+            out.setncatts({k: var.getncattr(k) for k in var.ncattrs() if k != '_FillValue'})
+            if ('time' not in var.dimensions):
+               out[:] = var[:]
+
+      # append time dependent variables, one file at a time
+      t0 = 0
+      for fname in fnames_part:
+         with Dataset(fname, 'r') as ncin:
+            ntime = len(ncin.dimensions['time'])
+            for name, var in ncin.variables.items():
+               if ('time' in var.dimensions):
+                  ncout.variables[name][t0:t0+ntime] = var[:]
+            t0 += ntime
+
+   logger.info('concatenated %d files into %s', len(fnames_part), fname_target)
+
+
+def convertFiles(fnames_vector, varnames, output_dir, mode='3d', custom_levs=None,
+                 mec_topo=None, mec_frac=None, fname_vecinfo=None, nprocs=None,
+                 concatenate=False, chunksize=None, backend='masked', writer_options=None, callback=None, region=None,
+                 interp_operator=None):
+   """
+   Convert variables from many vector files in parallel using a pool of worker processes.
+
+   The vector index (see VectorIndex), MEC topography and glacier fraction are loaded once
+   and handed to each worker when it starts, rather than being reloaded for every file.
+   Topography and fraction can be obtained from any VectorMecVariable of the same case, e.g.
+
+      vmv.setGlcTopoCouplerFile(fname_cpl_restart)
+      convertFiles(fnames, ["QICE"], "out", custom_levs=levs, mec_topo=vmv.mec_topo)
+
+   With statistics enabled (see runStats), those of the worker processes are added to 
+   the statistics of the calling process.
+
+   Output is one gridded file per input file and variable, named
+   <output_dir>/<basename>.<varname>.nc, or with concatenate = True a single time series
+   per variable, named <output_dir>/<varname>.nc.
+
+   :param fnames_vector:   filenames of CLM vector files, or a glob pattern
+   :param varnames:        CLM variable names
+   :param output_dir:      directory of output files
+   :param mode:            '2d' (see vector2gridded2d), '3d' (see vector2gridded3d) 
+                           or 'gathered' (see vector2gathered3d)
+   :param custom_levs:     custom levels of elevation (m), modes '3d' and 'gathered' only (optional)
+   :param mec_topo:        MEC topographic height (GLC_NEC+1, nlat, nlon), required for custom levels
+   :param mec_frac:        glacier fraction (GLC_NEC+1, nlat, nlon), required for mode '2d'
+   :param fname_vecinfo:   filename of CLM vector grid info file (optional, default: first vector file)
+   :param nprocs:          number of worker processes (optional, default: number of CPUs)
+   :param concatenate:     write a single time series per variable (optional)
+   :param chunksize:       number of time steps read and processed at a time, bounds memory per worker (optional)
+   :param backend:         'masked' or 'nan' (optional, see VectorMecVariable)
+   :param writer_options:  keyword arguments of the writers, e.g. dict(complevel=4, chunking='timeseries')
+   :param callback:        function called as callback(fname_vector, fnames_out) as soon as 
+                           an input file has been converted, in the order of the input files (optional)
+   :param region:          convert only a region, e.g. 'greenland_box' (optional, see VectorMecVariable); 
+                           mec_topo and mec_frac are given on the whole grid
+   :param interp_operator: precomputed interpolation weights to custom_levs, replaces mec_topo (optional, 
+                           see VectorMecVariable.setInterpOperator)
+   :type fnames_vector:    python list or string
+   :type varnames:         python list
+   :type output_dir:       string
+   :type mode:             string
+   :type custom_levs:      python list
+   :type nprocs:           int
+   :type concatenate:      bool
+   :type chunksize:        int
+   :type backend:          string
+   :type writer_options:   dict
+   :type callback:         function
+   :type interp_operator:  InterpOperator or string
+   :returns:               list of output filenames
+   """
+   if (isinstance(fnames_vector, str)):
+      fnames_vector = sorted(glob.glob(fnames_vector))
+   if (len(fnames_vector) == 0):
+      raise ValueError('no vector files to convert')
+   if (mode not in ('2d', '3d', 'gathered')):
+      raise ValueError('unknown mode: ' + mode)
+   if (mode == '2d' and mec_frac is None):
+      raise ValueError('glacier fraction (mec_frac) is required for mode 2d')
+   if (custom_levs != None and mec_topo is None and interp_operator is None):
+      raise ValueError('topography (mec_topo) or interpolation weights (interp_operator) are required for custom levels')
+
+   if (fname_vecinfo == None):
+      fname_vecinfo = fnames_vector[0] # assume all files share the same grid
+
+   # build vector indices once
+   with Dataset(fnames_vector[0], 'r') as fid:
+      var_types = set(fid.variables[varname].dimensions[-1] for varname in varnames)
+   indices = dict((_indexKey(fname_vecinfo, var_type), getVectorIndex(fname_vecinfo, var_type)) for var_type in var_types)
+   region = getRegion(region)
+   if (region != None):
+      indices.update((_indexKey(fname_vecinfo, var_type) + (region.getKey(),), getVectorIndex(fname_vecinfo, var_type, region)) for var_type in var_types)
+
+   shared = dict(indices=indices, fname_vecinfo=fname_vecinfo, mode=mode, custom_levs=custom_levs,
+                 mec_topo=mec_topo, mec_frac=mec_frac, chunksize=chunksize, backend=backend,
+                 writer_options=writer_options or {}, stats=stats.enabled, region=region,
+                 interp_operator=interp_operator)
+
+   if (not os.path.isdir(output_dir)):
+      os.makedirs(output_dir)
+
+   jobs = []
+   for fname_vector in fnames_vector:
+      basename = os.path.splitext(os.path.basename(fname_vector))[0]
+      targets = dict((varname, os.path.join(output_dir, '%s.%s.nc' % (basename, varname))) for varname in varnames)
+      jobs.append((fname_vector, targets))
+
+   if (nprocs == None):
+      nprocs = multiprocessing.cpu_count()
+   nprocs = min(nprocs, len(jobs))
+   logger.info('converting %d files using %d processes', len(jobs), nprocs)
+
+   pool = None
+   if (nprocs == 1):
+      _initWorker(shared)
+      outcomes = (_convertFile(job) for job in jobs)
+   else:
+      pool = multiprocessing.Pool(nprocs, initializer=_initWorker, initargs=(shared, True))
+      outcomes = pool.imap(_convertFile, jobs, chunksize=1)
+
+   results = []
+   try:
+      for job, result in zip(jobs, outcomes):
+         results.append(result)
+         if (callback is not None):
+            callback(job[0], result[0])
+   finally:
+      if (pool is not None):
+         pool.close()
+         pool.join()
+
+   for fnames, report in results:
+      if (report is not None):
+         stats.merge(report)
+
+   if (not concatenate):
+      return [fname for fnames, report in results for fname in fnames]
+
+   # single time series per variable, parts are in the order of the input files
+   fnames_out = []
+   for varname in varnames:
+      fnames_part = [targets[varname] for fname_vector, targets in jobs]
+      fname_target = os.path.join(output_dir, '%s.nc' % varname)
+      concatenateTime(fnames_part, fname_target)
+      for fname in fnames_part:
+         os.remove(fname)
+      fnames_out.append(fname_target)
+   return fnames_out
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache for static glacier fields (MEC topography and glacier fraction).
+
+These fields are constant for a run, but reading them requires opening large coupler 
+restart, surfdat or history files. Fields are kept in an in-process LRU cache and, if 
+a cache directory is set, in an on-disk store that is shared between processes. 
+Entries are keyed by the kind of field, the path, modification time and size of the 
+source file and the grid shape, so a modified source file is read again.
+
+The cache directory is set with setCacheDir() or the environment variable LIBVECTOR_CACHE_DIR.
+
+@author: L.vankampenhout@uu.nl
+"""
+import os
+import hashlib
+import tempfile
+from collections import OrderedDict
+import numpy as np
+
+from .common import logger
+
+LRU_MAXSIZE = 16 # maximum number of fields kept in memory
+
+_lru = OrderedDict()
+_cache_dir = os.environ.get('LIBVECTOR_CACHE_DIR')
+
+
+def setCacheDir(dirname):
+   """
+   Set directory of the on-disk cache, None disables it
+
+   :param dirname:   directory name
+   :type dirname:    string
+   """
+   global _cache_dir
+   _cache_dir = dirname
+
+
+def getCacheDir():
+   """
+   Returns directory of the on-disk cache, None if disabled
+   """
+   return _cache_dir
+
+
+def clearCache():
+   """
+   Clear the in-process cache (the on-disk cache is left untouched)
+   """
+   _lru.clear()
+
+
+def _cacheKey(kind, filename, grid):
+   """
+   Key of a field: kind, source file (path, modification time, size) and grid shape
+   """
+   stat = os.stat(filename)
+   return (kind, os.path.abspath(filename), stat.st_mtime_ns, stat.st_size, tuple(grid))
+
+
+def _diskPath(key):
+   return os.path.join(_cache_dir, 'glc_%s_%s.npz' % (key[0], hashlib.sha1(repr(key).encode()).hexdigest()))
+
+
+def _diskLoad(key):
+   fname = _diskPath(key)
+   if (not os.path.exists(fname)):
+      return None
+   with np.load(fname) as npz:
+      if ('mask' in npz):
+         return np.ma.masked_array(npz['data'], mask=npz['mask'])
+      return npz['data']
+
+
+def _diskStore(key, field):
+   if (not os.path.isdir(_cache_dir)):
+      os.makedirs(_cache_dir)
+   # write to a temporary file first, so other processes never see a partial file
+   fd, fname_tmp = tempfile.mkstemp(suffix='.npz', dir=_cache_dir)
+   with os.fdopen(fd, 'wb') as fid:
+      if (np.ma.isMaskedArray(field)):
+         np.savez(fid, data=np.ma.getdata(field), mask=np.ma.getmaskarray(field))
+      else:
+         np.savez(fid, data=field)
+   os.replace(fname_tmp, _diskPath(key))
+
+
+def getCachedField(kind, filename, grid, loader):
+   """
+   Returns a static field read from filename, using the cache when possible.
+   A copy is returned, so the caller may modify it.
+
+   :param kind:      kind of field, e.g. 'topo_cpl'
+   :param filename:  source file of the field
+   :param grid:      grid shape (nlat, nlon)
+   :param loader:    function without arguments that reads the field on a cache miss
+   :type kind:       string
+   :type filename:   string
+   :type grid:       tuple
+   :type loader:     function
+   :returns:         numpy array
+   """
+   key = _cacheKey(kind, filename, grid)
+
+   if (key in _lru):
+      _lru.move_to_end(key)
+      return _lru[key].copy()
+
+   field = None
+   if (_cache_dir != None):
+      field = _diskLoad(key)
+      if (field is not None):
+         logger.info('read %s of %s from disk cache', kind, filename)
+
+   if (field is None):
+      field = loader()
+      if (_cache_dir != None):
+         _diskStore(key, field)
+
+   _lru[key] = field
+   if (len(_lru) > LRU_MAXSIZE):
+      _lru.popitem(last=False)
+   return field.copy()
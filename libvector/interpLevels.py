@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batched piecewise-linear interpolation from MEC columns to custom levels.
+
+The interpolation is split in two steps: first the weights are derived from the
+MEC topography (they do not depend on time or on the variable), then they are
+applied to the field values of all grid cells and time steps at once.
+
+The result is equivalent to fitting a first order InterpolatedUnivariateSpline
+through the existing MEC columns of every grid cell: values in between two columns
+are linearly interpolated, values outside the range of columns are linearly
+extrapolated using the outermost pair. Cells with a single column are constantly
+extrapolated.
+
+The weights can also be applied to values that are not arranged by grid cell and class, 
+e.g. directly to the columns of a vector (see applyFlatWeights and InterpOperator).
+
+Applying the weights can be split over the grid cells and run on a pool of threads
+or processes (see setInterpWorkers). Every value is computed by exactly the same
+operations as in the serial case, so the result is bit-identical. Processes share
+the field values and the result through memory-mapped files in shared memory (/dev/shm):
+the result is allocated there and returned without copying, and field values allocated
+there by the caller (see emptyShared) are not copied either.
+
+@author: L.vankampenhout@uu.nl
+"""
+import os
+import weakref
+import tempfile
+import multiprocessing
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+POOLS = ('thread', 'process')
+
+_nworkers = 1        # see setInterpWorkers()
+_pool = 'thread'
+_executors = {}      # (pool, nworkers) -> executor, created on first use
+
+
+def setInterpWorkers(nworkers=1, pool='thread'):
+   """
+   Set the number of workers that apply interpolation weights in parallel, for all 
+   custom level interpolation that follows (getGridded3dCustomLevels, vector2gridded3d etc.)
+
+   Threads work well since numpy releases the GIL during the computations; processes 
+   avoid the GIL completely, at the cost of copying the field values into shared memory once
+   (unless they were allocated there, see emptyShared). 
+   Worker processes of convertFiles() use threads instead, since they cannot start processes.
+
+   :param nworkers:  number of workers, 1 means serial (default)
+   :param pool:      'thread' or 'process'
+   :type nworkers:   int
+   :type pool:       string
+   """
+   global _nworkers, _pool
+   if (pool not in POOLS):
+      raise ValueError('unknown pool: %s, choose from %s' % (pool, str(POOLS)))
+   _nworkers = max(int(nworkers), 1)
+   _pool = pool
+
+
+def computeInterpWeights(xp, custom_levs):
+   """
+   Compute interpolation weights from MEC elevations to custom levels
+
+   :param xp:           elevations of MEC columns, NaN where a column does not exist
+   :param custom_levs:  custom levels
+   :type xp:            numpy array (ncell, nclass)
+   :type custom_levs:   python list
+   :returns:            tuple (lo, hi, wlo, whi), each numpy array (ncell, nlev)
+                        holding the class indices and weights of the bracketing columns
+   """
+   xp = np.asarray(xp, dtype=np.float64)
+   levs = np.asarray(custom_levs, dtype=np.float64)
+   ncell = xp.shape[0]
+
+   # sort columns by elevation, non-existing columns (NaN) end up last
+   order = np.argsort(xp, axis=1)
+   xs = np.take_along_axis(xp, order, axis=1)
+   nexist = np.sum(~np.isnan(xs), axis=1)
+
+   # index of the segment [j, j+1] that is used for each level
+   # (NaN comparisons are False, so missing columns are never counted)
+   k = np.sum(xs[:,None,:] <= levs[None,:,None], axis=2)
+   jmax = np.maximum(nexist - 2, 0)[:,None]
+   j0 = np.clip(k - 1, 0, jmax)
+   j1 = np.minimum(j0 + 1, np.maximum(nexist - 1, 0)[:,None])
+
+   x0 = np.take_along_axis(xs, j0, axis=1)
+   x1 = np.take_along_axis(xs, j1, axis=1)
+
+   single = (nexist < 2)[:,None]
+   with np.errstate(divide='ignore', invalid='ignore'):
+      wlo = np.where(single, 1.0, (x1 - levs[None,:]) / (x1 - x0))
+      whi = np.where(single, 0.0, (levs[None,:] - x0) / (x1 - x0))
+
+   lo = np.take_along_axis(order, j0, axis=1)
+   hi = np.take_along_axis(order, j1, axis=1)
+
+   # cells without any column get no meaningful weights
+   empty = (nexist == 0)
+   wlo[empty,:] = np.nan
+   whi[empty,:] = np.nan
+
+   assert lo.shape == (ncell, len(levs))
+   return lo, hi, wlo, whi
+
+
+def applyInterpWeights(fp, weights, nworkers=None, pool=None):
+   """
+   Apply interpolation weights to field values of MEC columns
+
+   :param fp:        field values, last two dimensions are (ncell, nclass)
+   :param weights:   tuple (lo, hi, wlo, whi) as returned by computeInterpWeights()
+   :param nworkers:  number of parallel workers (optional, default see setInterpWorkers)
+   :param pool:      'thread' or 'process' (optional, default see setInterpWorkers)
+   :type fp:         numpy array (..., ncell, nclass)
+   :returns:         numpy array (..., ncell, nlev)
+   """
+   lo, hi, wlo, whi = weights
+   ncell, nclass = fp.shape[-2:]
+   offset = np.arange(ncell)[:,None] * nclass # position of the first class of every cell
+   values = fp.reshape(fp.shape[:-2] + (ncell * nclass,))
+   return applyFlatWeights(values, (lo + offset, hi + offset, wlo, whi), nworkers, pool)
+
+
+def applyFlatWeights(values, weights, nworkers=None, pool=None):
+   """
+   Apply interpolation weights to values along the last axis: every (cell, level) is 
+   the weighted sum of two values, i.e. a sparse matrix with two entries per row
+
+   :param values:    field values
+   :param weights:   tuple (lo, hi, wlo, whi), lo and hi are positions in the last axis of values
+   :param nworkers:  number of parallel workers (optional, default see setInterpWorkers)
+   :param pool:      'thread' or 'process' (optional, default see setInterpWorkers)
+   :type values:     numpy array (..., nvalue)
+   :type weights:    tuple of numpy arrays (ncell, nlev)
+   :returns:         numpy array (..., ncell, nlev)
+   """
+   nworkers = _nworkers if (nworkers == None) else nworkers
+   pool = _pool if (pool == None) else pool
+   if (pool == 'process' and multiprocessing.current_process().daemon):
+      pool = 'thread' # e.g. worker of convertFiles(), which cannot start processes
+
+   lo, hi, wlo, whi = weights
+   ncell = lo.shape[0]
+   if (nworkers <= 1 or ncell < 2 * nworkers):
+      f0 = values[..., lo]
+      f1 = values[..., hi]
+      return f0 * wlo + f1 * whi
+
+   # partitions of grid cells, one per worker
+   bounds = np.linspace(0, ncell, nworkers + 1).astype(int)
+   parts = [(c0, c1, tuple(w[c0:c1] for w in weights)) for c0, c1 in zip(bounds[:-1], bounds[1:])]
+   executor = _getExecutor(pool, nworkers)
+   dtype = np.result_type(values.dtype, wlo.dtype)
+   shape = values.shape[:-1] + lo.shape
+
+   if (pool == 'thread'):
+      out = np.empty(shape, dtype=dtype)
+      futures = [executor.submit(_applyPartition, values, out, part, c0, c1) for c0, c1, part in parts]
+      for future in futures:
+         future.result()
+      return out
+
+   # processes: field values and result in shared memory, the result is returned without copying
+   spec_fp = _sharedSpec(values)
+   if (spec_fp == None):
+      shared = _createShared(values.shape, values.dtype)
+      shared[...] = values
+      spec_fp = _sharedSpec(shared)
+   out = _createShared(shape, dtype)
+   spec_out = _sharedSpec(out)
+   futures = [executor.submit(_applySharedPartition, spec_fp, spec_out, part, c0, c1) for c0, c1, part in parts]
+   for future in futures:
+      future.result()
+   return out.view(np.ndarray) # owns the mapping
+
+
+def _applyPartition(fp, out, weights, c0, c1):
+   """
+   Apply the weights of grid cells c0 up to c1, in the same way as the serial case
+   """
+   lo, hi, wlo, whi = weights
+   out[..., c0:c1, :] = fp[..., lo] * wlo + fp[..., hi] * whi
+
+
+def _applySharedPartition(spec_fp, spec_out, weights, c0, c1):
+   """
+   Apply the weights of grid cells c0 up to c1 to arrays in shared memory (worker process)
+   """
+   fp = np.memmap(spec_fp[0], dtype=spec_fp[3], mode='r', offset=spec_fp[1], shape=spec_fp[2])
+   out = np.memmap(spec_out[0], dtype=spec_out[3], mode='r+', offset=spec_out[1], shape=spec_out[2])
+   _applyPartition(fp, out, weights, c0, c1)
+   out.flush()
+   del fp, out
+
+
+def _sharedDir():
+   """
+   Returns the directory of shared memory files: /dev/shm if present, the temporary directory otherwise
+   """
+   return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def _createShared(shape, dtype):
+   """
+   Returns an uninitialized array backed by a file in shared memory, the file is
+   removed when the array (and all views of it) are gone
+   """
+   fd, fname = tempfile.mkstemp(prefix='libvector-', suffix='.shm', dir=_sharedDir())
+   os.close(fd)
+   arr = np.memmap(fname, dtype=dtype, mode='w+', shape=shape)
+   weakref.finalize(arr, os.remove, fname)
+   return arr
+
+
+def _sharedSpec(arr):
+   """
+   Returns (filename, offset, shape, dtype) of a C-contiguous array backed by a shared memory file 
+   (see _createShared), such that a worker process can map it; None for any other array
+   """
+   root = arr
+   while (isinstance(root, np.ndarray) and not (isinstance(root, np.memmap) and not isinstance(root.base, np.ndarray))):
+      root = root.base
+   if (not isinstance(root, np.memmap) or root.filename == None or not arr.flags.c_contiguous or 
+         os.path.realpath(os.path.dirname(root.filename)) != os.path.realpath(_sharedDir())):
+      return None
+   offset = root.offset + arr.__array_interface__['data'][0] - root.__array_interface__['data'][0]
+   return (root.filename, offset, arr.shape, arr.dtype.str)
+
+
+def emptyShared(shape, dtype):
+   """
+   Returns an uninitialized array for field values that weights are applied to. If they are 
+   applied by a pool of processes (see setInterpWorkers), the array is allocated in shared memory, 
+   so that it does not need to be copied for the workers; otherwise this is np.empty.
+
+   :param shape:  shape of the array
+   :param dtype:  data type
+   :returns:      numpy array
+   """
+   if (_pool != 'process' or _nworkers <= 1 or multiprocessing.current_process().daemon or np.prod(shape) == 0):
+      return np.empty(shape, dtype=dtype)
+   return _createShared(shape, dtype)
+
+
+def _getExecutor(pool, nworkers):
+   """
+   Returns a pool of workers, which is kept for later calls
+   """
+   key = (pool, nworkers)
+   if (key not in _executors):
+      if (pool == 'thread'):
+         _executors[key] = ThreadPoolExecutor(nworkers)
+      elif (pool == 'process'):
+         _executors[key] = ProcessPoolExecutor(nworkers)
+      else:
+         raise ValueError('unknown pool: %s, choose from %s' % (pool, str(POOLS)))
+   return _executors[key]
+
+
+def interpLevels(xp, fp, custom_levs):
+   """
+   Interpolate field values of MEC columns to custom levels (see module docstring)
+
+   :param xp:           elevations of MEC columns, NaN where a column does not exist
+   :param fp:           field values, last two dimensions are (ncell, nclass)
+   :param custom_levs:  custom levels
+   :type xp:            numpy array (ncell, nclass)
+   :type fp:            numpy array (..., ncell, nclass)
+   :type custom_levs:   python list
+   :returns:            numpy array (..., ncell, nlev)
+   """
+   return applyInterpWeights(fp, computeInterpWeights(xp, custom_levs))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Helpers for creating the output variables of the NetCDF writers
+
+@author: L.vankampenhout@uu.nl
+"""
+
+import numpy as np
+from netCDF4 import default_fillvals
+
+TIMESERIES_NTIME = 512 # maximum number of time steps in a chunk optimized for time series access
+TIMESERIES_NXY = 16    # number of grid points in lat and lon of a chunk optimized for time series access
+
+
+def getChunkSizes(chunking, shape, nspatial=2):
+   """
+   Returns chunk sizes of an output variable
+
+   The time dimension is first and lat, lon are the last two dimensions (or a single 
+   landpoint dimension for gathered output, nspatial = 1). Chunks optimized for 'map' 
+   access hold a single time step of the whole domain, whereas chunks optimized for 
+   'timeseries' access hold many time steps of a small tile.
+
+   :param chunking:     'map', 'timeseries', explicit chunk sizes or None (library default)
+   :param shape:        shape of the output variable, (ntime, ..., nlat, nlon)
+   :param nspatial:     number of trailing spatial dimensions, 2 or 1
+   :type chunking:      string, tuple or None
+   :type shape:         tuple
+   :type nspatial:      int
+   :returns:            tuple or None
+   """
+   if (chunking == None):
+      return None
+   elif (chunking == 'map'):
+      return (1,) + tuple(shape[1:])
+   elif (chunking == 'timeseries'):
+      ntime = max(1, min(shape[0], TIMESERIES_NTIME))
+      if (nspatial == 1):
+         return (ntime,) + tuple(shape[1:-1]) + (max(1, min(shape[-1], TIMESERIES_NXY**2)),)
+      return (ntime,) + tuple(shape[1:-2]) + (min(shape[-2], TIMESERIES_NXY), min(shape[-1], TIMESERIES_NXY))
+   elif (len(chunking) == len(shape)):
+      return tuple(chunking)
+   else:
+      raise ValueError('unknown chunking: ' + str(chunking))
+
+
+def createOutputVariable(ncfile, varname, dimensions, shape, complevel=None, shuffle=True, chunking=None, dtype='f4', nspatial=2):
+   """
+   Create the gridded output variable in an opened NetCDF file
+
+   :param ncfile:       opened netCDF4 Dataset
+   :param varname:      name of the output variable
+   :param dimensions:   names of the dimensions
+   :param shape:        shape of the output variable (used for chunking)
+   :param complevel:    zlib compression level 1-9, None or 0 means no compression
+   :param shuffle:      apply HDF5 shuffle filter before compressing
+   :param chunking:     chunk sizes, see getChunkSizes()
+   :param dtype:        'f4' for single precision, 'f8' for double precision
+   :param nspatial:     number of trailing spatial dimensions, see getChunkSizes()
+   :returns:            netCDF4 Variable
+   """
+   compress = (complevel != None and complevel > 0)
+   return ncfile.createVariable(varname, dtype, dimensions, fill_value=default_fillvals[dtype], 
+            zlib=compress, complevel=complevel if compress else 4, shuffle=(shuffle and compress),
+            chunksizes=getChunkSizes(chunking, shape, nspatial))
+
+
+def createLayerDimension(ncfile, vmv):
+   """
+   Create the layer dimension and coordinate of a layered variable (see VectorMecVariable) 
+   in an opened NetCDF file. Returns the names and lengths of the dimensions that go 
+   between time and the other dimensions of the output variable: none if not layered.
+
+   :param ncfile:       opened netCDF4 Dataset
+   :param vmv:          VectorMecVariable instance
+   :returns:            tuple (dimensions, shape) of tuples
+   """
+   if (vmv.nlayer == None):
+      return (), ()
+
+   ncfile.createDimension(vmv.layer_dim, vmv.nlayer)
+   layer = ncfile.createVariable(vmv.layer_dim, 'i4', (vmv.layer_dim,))
+   layer.long_name = "layer index"
+   layer[:] = vmv.layers
+   return (vmv.layer_dim,), (vmv.nlayer,)
+
+
+def fillMissing(data, var):
+   """
+   Replace NaN (backend 'nan') by the fill value of the output variable, in place.
+   Masked arrays are returned unchanged, the NetCDF library takes care of these.
+
+   :param data:   gridded data
+   :param var:    netCDF4 Variable that the data is written to
+   :returns:      data
+   """
+   if (not np.ma.isMaskedArray(data)):
+      data[np.isnan(data)] = var.getncattr('_FillValue')
+   return data
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: L.vankampenhout@uu.nl
+"""
+
+from collections import OrderedDict
+from .VectorMecVariable import VectorMecVariable, logger
+from netCDF4 import Dataset
+
+def readVectorMecVariables(varnames, fname_vector, fname_vecinfo=None, mec_only=False, backend='masked', region=None, lazy=False):
+   """
+   Read multiple variables from one CLM vector file in a single pass. 
+   The file is opened only once, and all variables share the time axis 
+   and the grid information (see VectorIndex).
+
+   If TOPO_COL is among the variables, it can be passed to 
+   VectorMecVariable.setGlcTopoVariable() of the other variables.
+
+   :param varnames:        CLM variable names
+   :param fname_vector:    filename of CLM vector file (e.g. XXX.h2.YYY.nc)
+   :param fname_vecinfo:   filename of CLM vector grid info file (optional)
+   :param mec_only:        read only the MEC columns (optional, see VectorMecVariable)
+   :param backend:         'masked' or 'nan' (optional, see VectorMecVariable)
+   :param region:          read only the columns in a region (optional, see VectorMecVariable)
+   :param lazy:            only read metadata, data is read chunk by chunk (optional, see VectorMecVariable)
+   :type varnames:         python list
+   :type fname_vector:     string
+   :type fname_vecinfo:    string
+   :type mec_only:         bool
+   :type backend:          string
+   :type lazy:             bool
+   :returns:               OrderedDict of VectorMecVariable instances, keyed by variable name
+   """
+   variables = OrderedDict()
+
+   with Dataset(fname_vector,'r') as fid:
+      time = fid.variables['time'][:]
+
+      for varname in varnames:
+         vmv = VectorMecVariable(varname, fname_vector, fname_vecinfo=fname_vecinfo, dataset=fid, mec_only=mec_only, backend=backend, region=region, lazy=lazy)
+         vmv.time = time # shared time axis
+         variables[varname] = vmv
+
+   logger.info('read %d variables from %s', len(variables), fname_vector)
+   return variables
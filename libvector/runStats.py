@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-stage timers and counters of a run, to find out where time and memory go.
+
+Stages are:
+
+   index          reading grid information and building the scatter index (VectorIndex)
+   read           reading variable data from disk
+   scatter        placing MEC columns on the grid (or on gathered cells)
+   average        fraction weighted average over MEC levels (getGridded2d)
+   interpolation  interpolation to custom levels
+   write          writing output files
+
+Timers are exclusive: time spent in a nested stage (e.g. scatter during interpolation) 
+is only counted in the nested stage, so the stage times add up to the total.
+Stages are nested per thread; with several threads (e.g. vector2array with nworkers > 1)
+the times of all threads are added, so they can add up to more than the elapsed time.
+Counters hold totals such as bytes_read, bytes_written, columns_scattered and cells_interpolated,
+peaks hold maximum values such as the size (bytes) of the largest array produced.
+
+Statistics are disabled by default, in which case the timers and counters do nothing. 
+Example:
+
+   enableStats()
+   vector2gridded3d(vmv, "out.nc", custom_levs)
+   print(getStats())
+   getStats().saveReport("stats.json")
+
+Statistics are kept per process; convertFiles() merges those of its worker processes.
+
+@author: L.vankampenhout@uu.nl
+"""
+import time
+import json
+import threading
+import contextlib
+
+_NULL_TIMER = contextlib.nullcontext()
+
+
+class _StageTimer(object):
+   """
+   Context manager that adds the time spent in a stage, minus the time of nested stages
+   """
+   def __init__(self, stats, stage):
+      self.stats = stats
+      self.stage = stage
+
+   def __enter__(self):
+      self.nested = 0.0
+      self.stats._stack.append(self)
+      self.t0 = time.perf_counter()
+      return self
+
+   def __exit__(self, *exc):
+      elapsed = time.perf_counter() - self.t0
+      self.stats._stack.pop()
+      if (self.stats._stack):
+         self.stats._stack[-1].nested += elapsed
+      with self.stats._lock:
+         entry = self.stats.stages.setdefault(self.stage, [0.0, 0])
+         entry[0] += elapsed - self.nested
+         entry[1] += 1
+      return False
+
+
+class RunStats(object):
+   """
+   Timers, counters and peaks of a run, see module documentation
+   """
+
+   def __init__(self):
+      self.enabled = False
+      self._lock = threading.Lock()
+      self.reset()
+
+
+   def reset(self):
+      """
+      Clear all statistics
+      """
+      self.stages = {}     # stage -> [seconds, calls]
+      self.counters = {}   # name -> total
+      self.peaks = {}      # name -> maximum
+      self._local = threading.local() # stack of open stage timers, per thread
+
+
+   @property
+   def _stack(self):
+      """
+      Stage timers that are open in the current thread, innermost last
+      """
+      if (not hasattr(self._local, 'stack')):
+         self._local.stack = []
+      return self._local.stack
+
+
+   def timer(self, stage):
+      """
+      Returns a context manager that times a stage, e.g.
+
+         with stats.timer('read'):
+            ...
+      """
+      if (not self.enabled):
+         return _NULL_TIMER
+      return _StageTimer(self, stage)
+
+
+   def count(self, name, value=1):
+      """
+      Add value to a counter
+      """
+      if (self.enabled):
+         with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+   def peak(self, name, value):
+      """
+      Keep the maximum of a value
+      """
+      if (self.enabled):
+         with self._lock:
+            self.peaks[name] = max(self.peaks.get(name, 0), value)
+
+
+   def report(self):
+      """
+      Returns all statistics as a dict that can be serialized to JSON
+
+      :returns:   dict with keys stages ({stage: {seconds, calls}}), counters and peaks
+      """
+      stages = dict((stage, dict(seconds=seconds, calls=calls)) for stage, (seconds, calls) in self.stages.items())
+      return dict(stages=stages, counters=dict(self.counters), peaks=dict(self.peaks))
+
+
+   def merge(self, report):
+      """
+      Add the statistics of another report (e.g. of a worker process)
+
+      :param report:    dict as returned by report()
+      """
+      for stage, entry in report['stages'].items():
+         mine = self.stages.setdefault(stage, [0.0, 0])
+         mine[0] += entry['seconds']
+         mine[1] += entry['calls']
+      for name, value in report['counters'].items():
+         self.counters[name] = self.counters.get(name, 0) + value
+      for name, value in report['peaks'].items():
+         self.peaks[name] = max(self.peaks.get(name, 0), value)
+
+
+   def saveReport(self, filename):
+      """
+      Write all statistics to a JSON file
+
+      :param filename:  filename of report
+      """
+      with open(filename, 'w') as f:
+         json.dump(self.report(), f, indent=1)
+
+
+   def __str__(self):
+      lines = ['%-16s %10s %8s' % ('stage', 'seconds', 'calls')]
+      for stage, (seconds, calls) in sorted(self.stages.items(), key=lambda item: -item[1][0]):
+         lines.append('%-16s %10.3f %8d' % (stage, seconds, calls))
+      for name, value in sorted(self.counters.items()):
+         lines.append('%-27s %14d' % (name, value))
+      for name, value in sorted(self.peaks.items()):
+         lines.append('%-27s %14d (peak)' % (name, value))
+      return '\n'.join(lines)
+
+
+stats = RunStats() # statistics of this process
+
+
+def getStats():
+   """
+   Returns the statistics of this process
+
+   :returns:   RunStats
+   """
+   return stats
+
+
+def enableStats(enabled=True, reset=True):
+   """
+   Enable (or disable) collecting statistics
+
+   :param enabled:   collect statistics (optional)
+   :param reset:     clear statistics collected so far (optional)
+   """
+   stats.enabled = enabled
+   if (reset):
+      stats.reset()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Gridded output as a chunked Zarr store or a memory-mapped raw array, for fast random
+access to single time steps or time series of single points, without NetCDF/HDF5 overhead.
+
+A raw array store is a directory with the array in C order (<varname>.raw) and a JSON
+sidecar (metadata.json) with its dtype, shape, dimensions, coordinates and attributes;
+openRawArray() maps it into memory. A Zarr store (optional dependency zarr) holds the
+variable and its coordinates with the dimension names used by xarray, such that it can be
+opened with xarray.open_zarr(). Missing values are NaN in both.
+
+@author: L.vankampenhout@uu.nl
+"""
+import os
+import json
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from netCDF4 import Dataset
+
+from .VectorMecVariable import GLC_NEC, rtnnam, logger
+from .common import nc_lock
+from .ncOutput import getChunkSizes
+from .runStats import stats
+
+STORES = ('zarr', 'raw')
+MODES = ('2d', '3d')
+METADATA_FILENAME = 'metadata.json'
+
+
+def _describe(vmv, mode, custom_levs, routine):
+   """
+   Returns dimensions, shape, coordinates and attributes of the output, as in the NetCDF writers
+   """
+   with Dataset(vmv.fname_vector, 'r') as fid:
+      calendar = getattr(fid.variables['time'], 'calendar', 'standard')
+
+   # coordinates: name -> (dimension, values, dtype, attributes)
+   coords = dict(time=('time', np.asarray(vmv.time), 'f8', dict(units=vmv.time_units, calendar=calendar)),
+                 latitude=('latitude', np.asarray(vmv.lats), 'f4', dict(units='degrees_north')),
+                 longitude=('longitude', np.asarray(vmv.lons), 'f4', dict(units='degrees_east')))
+   global_attrs = dict(history=routine + ' was applied to ' + vmv.fname_vector + ' on ' + time.strftime('%a %b %d %Y %H:%M:%S'),
+                       softwareURL='https://github.com/lvankampenhout/libvector',
+                       creation_date=time.strftime('%Y-%m-%d %X'))
+
+   dims = ('time',)
+   shape = (vmv.ntime,)
+   if (vmv.nlayer != None):
+      dims += (vmv.layer_dim,)
+      shape += (vmv.nlayer,)
+      coords[vmv.layer_dim] = (vmv.layer_dim, np.asarray(vmv.layers), 'i4', dict(long_name='layer index'))
+
+   if (mode == '2d'):
+      global_attrs['description'] = 'Gridded field from CLM vector output'
+   else:
+      nlev = GLC_NEC if (custom_levs == None) else len(custom_levs)
+      dims += ('lev',)
+      shape += (nlev,)
+      coords['lev'] = ('lev', np.arange(nlev), 'i4', dict(units='MEC level number'))
+      global_attrs['title'] = 'CESM/CLM glacier elevation class output regridded to 3-dimensional mesh'
+      if (custom_levs == None):
+         global_attrs['vertical_levels'] = 'no vertical interpolation was applied; MEC elevation is variable across grid cells'
+      else:
+         global_attrs['vertical_levels'] = 'interpolated to user-specified heights'
+         coords['elevation'] = ('lev', np.asarray(custom_levs), 'f4', dict(units='m'))
+
+   dims += ('latitude', 'longitude')
+   shape += (vmv.nlat, vmv.nlon)
+   attrs = dict(units=vmv.units, long_name=vmv.long_name)
+   return dims, shape, coords, attrs, global_attrs
+
+
+def _createZarrStore(target, varname, dims, shape, chunks, dtype, coords, attrs, global_attrs):
+   """
+   Create a Zarr store (format 2, readable by xarray) with the coordinates and an unwritten variable
+   """
+   try:
+      import zarr
+   except ImportError:
+      raise ImportError("vector2array with store 'zarr' requires the package zarr")
+
+   try:
+      root = zarr.open_group(target, mode='w', zarr_format=2)
+   except TypeError:
+      root = zarr.open_group(target, mode='w') # zarr < 3 only writes format 2
+   create = getattr(root, 'create_array', None) or root.create_dataset
+   root.attrs.update(global_attrs)
+
+   for name, (dim, values, cdtype, cattrs) in coords.items():
+      arr = create(name, shape=values.shape, chunks=values.shape, dtype=cdtype, fill_value=None) # no missing values
+      arr[:] = values
+      arr.attrs.update(cattrs)
+      arr.attrs['_ARRAY_DIMENSIONS'] = [dim]
+
+   var = create(varname, shape=shape, chunks=chunks, dtype=dtype, fill_value=np.nan)
+   var.attrs.update(attrs)
+   var.attrs['_ARRAY_DIMENSIONS'] = list(dims)
+   return var
+
+
+def _saveMetadata(target, metadata):
+   """
+   Write the sidecar of a raw array store, atomically such that it only exists once the array is complete
+   """
+   fd, tmp = tempfile.mkstemp(dir=target, suffix='.tmp')
+   with os.fdopen(fd, 'w') as f:
+      json.dump(metadata, f, indent=1)
+   os.replace(tmp, os.path.join(target, METADATA_FILENAME))
+
+
+def vector2array(vmv, target, mode='3d', custom_levs=None, store='zarr', chunksize=None, chunking='map', dtype='f4', nworkers=1, region=None):
+   """
+   Wrapper function for converting a VectorMecVariable into a 2D or 3D variable
+   and writing the output to a Zarr store or a memory-mapped raw array (see module documentation).
+   The dimensions, coordinates and attributes are those of vector2gridded2d / vector2gridded3d.
+
+   The variable is gridded and written chunksize time steps at a time. With nworkers > 1,
+   these chunks are gridded (and interpolated) and written in parallel threads; for a Zarr store,
+   chunksize must then be a multiple of the number of time steps in a chunk of the store.
+
+   :param vmv:             VectorMecVariable instance
+   :param target:          directory of the output store (created or overwritten)
+   :param mode:            '2d' (see vector2gridded2d) or '3d' (see vector2gridded3d)
+   :param custom_levs:     custom levels of elevation (m), mode '3d' only (optional)
+   :param store:           'zarr' or 'raw'
+   :param chunksize:       number of time steps processed at a time (optional)
+   :param chunking:        chunks of a Zarr store: 'map' (a single time step of the whole grid, default),
+                           'timeseries' or explicit chunk sizes, see ncOutput.getChunkSizes()
+   :param dtype:           'f4' or 'f8' (optional)
+   :param nworkers:        number of threads (optional)
+   :param region:          write only a region on a cropped grid, e.g. 'greenland_box' (optional, see VectorMecVariable)
+   :type vmv:              VectorMecVariable
+   :type target:           string
+   :type mode:             string
+   :type custom_levs:      python list
+   :type store:            string
+   :type chunksize:        int
+   :type chunking:         string or tuple
+   :type dtype:            string
+   :type nworkers:         int
+   :type region:           string, dict, numpy array or Region
+   """
+   if (store not in STORES):
+      raise ValueError('unknown store: %s, choose from %s' % (store, str(STORES)))
+   if (mode not in MODES):
+      raise ValueError('unknown mode: %s, choose from %s' % (mode, str(MODES)))
+   if (mode == '2d' and custom_levs != None):
+      raise ValueError('custom levels can only be used with mode 3d')
+   if (vmv.ndim == 1):
+      raise ValueError('variable %s is not time indexed' % vmv.varname)
+
+   if (region is not None):
+      vmv = vmv.subsetRegion(region) # with lazy = True, only the columns in the region are read
+
+   if (chunksize == None):
+      chunksize = vmv.ntime # all time steps at once
+
+   dims, shape, coords, attrs, global_attrs = _describe(vmv, mode, custom_levs, rtnnam())
+   if (store == 'zarr'):
+      chunks = getChunkSizes(chunking, shape)
+      if (nworkers > 1 and chunksize < vmv.ntime and chunksize % chunks[0] != 0):
+         raise ValueError('chunksize must be a multiple of %d (time steps in a chunk of the store) for parallel writes' % chunks[0])
+      var = _createZarrStore(target, vmv.varname, dims, shape, chunks, dtype, coords, attrs, global_attrs)
+   else:
+      if (not os.path.isdir(target)):
+         os.makedirs(target)
+      elif (os.path.exists(os.path.join(target, METADATA_FILENAME))):
+         os.remove(os.path.join(target, METADATA_FILENAME)) # invalid until the new array is complete
+      fname_raw = vmv.varname + '.raw'
+      var = np.memmap(os.path.join(target, fname_raw), dtype=np.dtype(dtype).newbyteorder('<'), mode='w+', shape=shape)
+
+   def write(t0, t1):
+      with nc_lock:
+         chunk = vmv.getChunk(t0, t1)
+      if (mode == '2d'):
+         data = chunk.getGridded2d()
+      else:
+         if (custom_levs == None):
+            data = chunk.getGridded3d()
+         else:
+            data = chunk.getGridded3dCustomLevels(custom_levs)
+         data = np.moveaxis(data, -1, -3) # lev before lat
+      data = np.ma.filled(data.astype(dtype), np.nan)
+      with stats.timer('write'):
+         var[t0:t1] = data
+      stats.count('bytes_written', data.nbytes)
+
+   bounds = [(t0, min(t0 + chunksize, vmv.ntime)) for t0 in range(0, vmv.ntime, chunksize)]
+   if (nworkers > 1):
+      with ThreadPoolExecutor(nworkers) as executor:
+         list(executor.map(lambda b: write(*b), bounds))
+   else:
+      for t0, t1 in bounds:
+         write(t0, t1)
+
+   if (store == 'zarr'):
+      import zarr
+      zarr.consolidate_metadata(target)
+   else:
+      with stats.timer('write'):
+         var.flush()
+      del var
+      coordinates = dict((name, dict(dimensions=[dim], values=values.astype(cdtype).tolist(), attributes=cattrs))
+                         for name, (dim, values, cdtype, cattrs) in coords.items())
+      _saveMetadata(target, dict(variable=vmv.varname, filename=fname_raw, dtype=np.dtype(dtype).newbyteorder('<').str,
+                                 shape=list(shape), order='C', dimensions=list(dims), missing_value='NaN',
+                                 attributes=attrs, global_attributes=global_attrs, coordinates=coordinates))
+   logger.info('wrote %s store %s', store, target)
+
+
+def openRawArray(target, mode='r'):
+   """
+   Map a raw array store written by vector2array() into memory. Only the parts that are
+   accessed are read from disk, e.g. a time series at a single grid point.
+
+   :param target:    directory of the store
+   :param mode:      'r' (read only) or 'r+' (read and write)
+   :returns:         tuple (numpy memmap, metadata dict of the sidecar)
+   """
+   fname_metadata = os.path.join(target, METADATA_FILENAME)
+   if (not os.path.exists(fname_metadata)):
+      raise IOError('%s is not a complete raw array store (no %s)' % (target, METADATA_FILENAME))
+   with open(fname_metadata, 'r') as f:
+      metadata = json.load(f)
+   data = np.memmap(os.path.join(target, metadata['filename']), dtype=np.dtype(metadata['dtype']),
+                    mode=mode, shape=tuple(metadata['shape']), order=metadata['order'])
+   return data, metadata
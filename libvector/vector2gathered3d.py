@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: L.vankampenhout@uu.nl
+"""
+
+from .VectorMecVariable import VectorMecVariable, GLC_NEC, rtnnam, logger
+from .runStats import stats
+import netCDF4
+import numpy as np
+import time
+from .ncOutput import createOutputVariable, createLayerDimension, fillMissing
+from netCDF4 import Dataset
+
+def vector2gathered3d(vmv, fname_target, custom_levs=None, chunksize=None, complevel=None, shuffle=True, chunking=None, dtype='f4', region=None):
+   """
+   Wrapper function for converting a VectorMecVariable into a 3D variable on 
+   the grid cells that contain ice only, and writing the output to NetCDF using 
+   the CF convention "compression by gathering".
+
+   The output variable has dimensions (time, lev, landpoint), where the variable 
+   landpoint holds the flat index ilat*nlon + ilon of each grid cell and has 
+   attribute compress = "latitude longitude". CF aware tools can expand it to the 
+   full grid; see also GatheredField.expand().
+
+   :param vmv:             VectorMecVariable instance
+   :param fname_target:    filename of output file (netCDF)
+   :param custom_levs:     custom levels of elevation (m)
+   :param chunksize:       number of time steps processed at a time (optional)
+   :param complevel:       zlib compression level 1-9 (optional, default no compression)
+   :param shuffle:         apply shuffle filter when compressing (optional)
+   :param chunking:        'map', 'timeseries' or explicit chunk sizes (optional)
+   :param dtype:           'f4' or 'f8' (optional)
+   :param region:          write only a region on a cropped grid, e.g. 'greenland_box' (optional, see VectorMecVariable)
+   :type vmv:              VectorMecVariable
+   :type fname_target:     string
+   :type custom_levs:      python list
+   :type chunksize:        int
+   :type complevel:        int
+   :type shuffle:          bool
+   :type chunking:         string or tuple
+   :type dtype:            string
+   :type region:           string, dict, numpy array or Region
+   """
+   if (region is not None):
+      vmv = vmv.subsetRegion(region) # with lazy = True, only the columns in the region are read
+
+   logger.info('number of vectors = %d', vmv.nvec)
+
+   if (custom_levs == None):
+      logger.info("custom levels are NOT used")
+      nlev = GLC_NEC
+   else:
+      logger.info("custom levels are used")
+      nlev = len(custom_levs)
+
+   if (chunksize == None):
+      chunksize = vmv.ntime # all time steps at once
+
+   # Open a new NetCDF file to write the data to. For format, you can choose from
+   # 'NETCDF3_CLASSIC', 'NETCDF3_64BIT', 'NETCDF4_CLASSIC', and 'NETCDF4'
+   ncfile = Dataset(fname_target, 'w', format='NETCDF4')
+   try:
+      ncfile.title = 'CESM/CLM glacier elevation class output regridded to 3-dimensional mesh, compressed by gathering'
+      ncfile.model = "CESM / Community Land Model"
+
+      ncfile.institute = "NCAR / Utrecht University"
+      ncfile.contact = "L.vankampenhout@uu.nl"
+
+      ncfile.history = rtnnam() + " was applied to "+ vmv.fname_vector + " on " +time.strftime("%a %b %d %Y %H:%M:%S")
+      ncfile.softwareURL = "https://github.com/lvankampenhout/libvector"
+      ncfile.netcdf = netCDF4.__netcdf4libversion__
+      ncfile.Conventions = "CF-1.7"
+
+      ncfile.creation_date = time.strftime('%Y-%m-%d %X')
+
+      # Create dimensions, the landpoint dimension is created with the first chunk
+      ncfile.createDimension('longitude', vmv.nlon)
+      ncfile.createDimension('latitude', vmv.nlat)
+      ncfile.createDimension('time', None)
+      ncfile.createDimension('lev',nlev)
+
+      # Define the coordinate var
+      lons   = ncfile.createVariable('longitude', 'f4', ('longitude',))
+      lats   = ncfile.createVariable('latitude', 'f4', ('latitude',))
+      times    = ncfile.createVariable('time', 'f8', ('time',))
+      levs   = ncfile.createVariable('lev', 'i4', ('lev',))
+
+      # Assign units attributes to coordinate var data
+      lons.units   = "degrees_east"
+      lons.axis = "Y"
+      lats.units   = "degrees_north"
+      lats.axis = "X"
+      times.units = vmv.time_units
+   
+      levs.units   = "MEC level number"
+
+      # Write data to coordinate var
+      lons[:]    = vmv.lons
+      lats[:]    = vmv.lats
+      levs[:]    = range(0,nlev)
+
+      # Write custom elevations, if any
+      if (custom_levs == None):
+         ncfile.vertical_levels = "no vertical interpolation was applied; MEC elevation is variable across grid cells"
+      else:
+         ncfile.vertical_levels = "interpolated to user-specified heights"
+         elevation  = ncfile.createVariable('elevation', 'f4', ('lev',))
+         elevation.units = "m"
+         elevation[:]    = custom_levs
+
+      # Write data, appending chunks along the time dimension
+      # The gathered grid cells are the same for all chunks
+      var = None
+      t0 = 0
+      for chunk in vmv.iterChunks(chunksize):
+         gathered = chunk.getGathered3d(custom_levs)
+
+         if (var == None):
+            ncfile.createDimension('landpoint', gathered.ncell)
+            landpoint = ncfile.createVariable('landpoint', 'i4', ('landpoint',))
+            landpoint.long_name = "grid cells containing glacier elevation classes"
+            landpoint.compress = "latitude longitude"
+            landpoint[:] = gathered.cells
+
+            # Create output variable of correct dimensions, layered variables get a layer dimension after time
+            layer_dims, layer_shape = createLayerDimension(ncfile, vmv)
+            var            = createOutputVariable(ncfile, vmv.varname, ('time',)+layer_dims+('lev','landpoint',), (vmv.ntime,)+layer_shape+(nlev, gathered.ncell),
+                                 complevel=complevel, shuffle=shuffle, chunking=chunking, dtype=dtype, nspatial=1)
+            var.units      = vmv.units
+            var.long_name  = vmv.long_name
+
+         var3d = np.swapaxes(gathered.data, -1, -2) # time, (layer,) lev, landpoint
+
+         t1 = t0 + chunk.ntime
+         with stats.timer('write'):
+            times[t0:t1] = chunk.time
+            var[t0:t1] = fillMissing(var3d, var)
+         stats.count('bytes_written', var3d.nbytes)
+         t0 = t1
+
+      logger.info('wrote %d grid points out of a total %d', gathered.ncell, vmv.nlat * vmv.nlon)
+      with stats.timer('write'):
+         ncfile.close()
+   finally:
+      if (ncfile.isopen()):
+         ncfile.close() # also after an error, e.g. in a conversion worker
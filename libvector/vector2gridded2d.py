@@ -5,64 +5,103 @@
 """
 
 from .VectorMecVariable import VectorMecVariable, GLC_NEC
-from netCDF4 import Dataset, default_fillvals
+from .ncOutput import createOutputVariable, createLayerDimension, fillMissing
+from .runStats import stats
+from netCDF4 import Dataset
 
-def vector2gridded2d(vmv, fname_target):
+def vector2gridded2d(vmv, fname_target, chunksize=None, complevel=None, shuffle=True, chunking=None, dtype='f4', region=None):
    """
    Wrapper function for converting a VectorMecVariable into a 2D variable
    and writing the output to NetCDF
 
+   With chunksize set, the variable is gridded and written chunksize time steps at 
+   a time along the unlimited time dimension. Combined with a VectorMecVariable 
+   created with lazy = True, peak memory is bounded by the chunk size.
+
    :param vmv:             VectorMecVariable instance
    :param fname_target:    filename of output file (netCDF)
+   :param chunksize:       number of time steps processed at a time (optional)
+   :param complevel:       zlib compression level 1-9 (optional, default no compression)
+   :param shuffle:         apply shuffle filter when compressing (optional)
+   :param chunking:        'map', 'timeseries' or explicit chunk sizes (optional)
+   :param dtype:           'f4' or 'f8' (optional)
+   :param region:          write only a region on a cropped grid, e.g. 'greenland_box' (optional, see VectorMecVariable)
+   :type chunksize:        int
+   :type complevel:        int
+   :type shuffle:          bool
+   :type chunking:         string or tuple
+   :type dtype:            string
+   :type region:           string, dict, numpy array or Region
    """
+   if (region is not None):
+      vmv = vmv.subsetRegion(region) # with lazy = True, only the columns in the region are read
 
-   var2d = vmv.getGridded2d()
+   if (chunksize == None):
+      chunksize = vmv.ntime # all time steps at once
 
    # Open a new NetCDF file to write the data to. For format, you can choose from
    # 'NETCDF3_CLASSIC', 'NETCDF3_64BIT', 'NETCDF4_CLASSIC', and 'NETCDF4'
    ncfile = Dataset(fname_target, 'w', format='NETCDF4')
-   ncfile.description = 'Gridded field from CLM vector output'
-
-   # Create dimensions
-   ncfile.createDimension('longitude', vmv.nlon)
-   ncfile.createDimension('latitude', vmv.nlat)
-   ncfile.createDimension('time', None)
-
-   # Define the coordinate var
-   lons   = ncfile.createVariable('longitude', 'f4', ('longitude',))
-   lats   = ncfile.createVariable('latitude', 'f4', ('latitude',))
-   times    = ncfile.createVariable('time', 'f8', ('time',))
-
-   # Assign units attributes to coordinate var data
-   lons.units   = "degrees_east"
-   lons.axis = "Y"
-   lats.units   = "degrees_north"
-   lats.axis = "X"
-   #times.units    = "days since 1-01-01 00:00:00"
-   times.units = vmv.time_units
-
-   #levs.units   = "MEC level number"
-
-   # Write data to coordinate var
-   lons[:]    = vmv.lons
-   lats[:]    = vmv.lats
-   #times[:]   = times_
-   times[:] = vmv.time
-   #levs[:]    = range(0,GLC_NEC)
-
-   # Write data
-   #print(sno_gs.shape) #(12, 192, 288, 10)
-   #sno_gs = sno_gs.transpose((0,1,2)) # permute columns
-   #print(sno_gs.shape) #(12, 192, 288, 10)
-
-   # Create output variable of correct dimensions
-   # 'f4' stands for floating point 4 bytes, i.e. single precision
-   # change to 'f8' for double precision
-   var = ncfile.createVariable(vmv.varname,'f4',('time','latitude','longitude',),fill_value=default_fillvals['f4'])
-   var.units      = vmv.units
-   var.long_name  = vmv.long_name
-
-   #var[:,:,:] = default_fillvals['f4'] # Initialise with missing value everywhere (will be replaced later)
+   try:
+      ncfile.description = 'Gridded field from CLM vector output'
+
+      # Create dimensions
+      ncfile.createDimension('longitude', vmv.nlon)
+      ncfile.createDimension('latitude', vmv.nlat)
+      ncfile.createDimension('time', None)
+
+      # Define the coordinate var
+      lons   = ncfile.createVariable('longitude', 'f4', ('longitude',))
+      lats   = ncfile.createVariable('latitude', 'f4', ('latitude',))
+      times    = ncfile.createVariable('time', 'f8', ('time',))
+
+      # Assign units attributes to coordinate var data
+      lons.units   = "degrees_east"
+      lons.axis = "Y"
+      lats.units   = "degrees_north"
+      lats.axis = "X"
+      #times.units    = "days since 1-01-01 00:00:00"
+      times.units = vmv.time_units
+
+      #levs.units   = "MEC level number"
+
+      # Write data to coordinate var
+      lons[:]    = vmv.lons
+      lats[:]    = vmv.lats
+      #times[:]   = times_
+      #levs[:]    = range(0,GLC_NEC)
+
+      # Write data
+      #print(sno_gs.shape) #(12, 192, 288, 10)
+      #sno_gs = sno_gs.transpose((0,1,2)) # permute columns
+      #print(sno_gs.shape) #(12, 192, 288, 10)
+
+      # Create output variable of correct dimensions
+      # 'f4' stands for floating point 4 bytes, i.e. single precision
+      # 'f8' for double precision
+      # Layered variables get a layer dimension after time
+      layer_dims, layer_shape = createLayerDimension(ncfile, vmv)
+
+      var = createOutputVariable(ncfile, vmv.varname, ('time',)+layer_dims+('latitude','longitude',), (vmv.ntime,)+layer_shape+(vmv.nlat, vmv.nlon),
+               complevel=complevel, shuffle=shuffle, chunking=chunking, dtype=dtype)
+      var.units      = vmv.units
+      var.long_name  = vmv.long_name
+
+      #var[:,:,:] = default_fillvals['f4'] # Initialise with missing value everywhere (will be replaced later)
 	
-   var[:] = var2d[:]
-   ncfile.close()
+      # Write data, appending chunks along the time dimension
+      t0 = 0
+      for chunk in vmv.iterChunks(chunksize):
+         var2d = chunk.getGridded2d()
+         t1 = t0 + chunk.ntime
+         with stats.timer('write'):
+            times[t0:t1] = chunk.time
+            var[t0:t1] = fillMissing(var2d, var)
+         stats.count('bytes_written', var2d.nbytes)
+         t0 = t1
+
+      with stats.timer('write'):
+         ncfile.close()
+   finally:
+      if (ncfile.isopen()):
+         ncfile.close() # also after an error, e.g. in a conversion worker
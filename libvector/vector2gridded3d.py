@@ -4,105 +4,146 @@
 @author: L.vankampenhout@uu.nl
 """
 
-from .VectorMecVariable import VectorMecVariable, GLC_NEC, rtnnam
+from .VectorMecVariable import VectorMecVariable, GLC_NEC, rtnnam, logger
+from .runStats import stats
 import netCDF4
+import numpy as np
 import time
-from netCDF4 import Dataset, default_fillvals
+from .ncOutput import createOutputVariable, createLayerDimension, fillMissing
+from netCDF4 import Dataset
 
-def vector2gridded3d(vmv, fname_target, custom_levs=None):
+def vector2gridded3d(vmv, fname_target, custom_levs=None, chunksize=None, complevel=None, shuffle=True, chunking=None, dtype='f4', region=None):
    """
    Wrapper function for converting a VectorMecVariable into a 3D variable
    and writing the output to NetCDF.
 
+   With chunksize set, the variable is gridded, interpolated and written chunksize 
+   time steps at a time along the unlimited time dimension. Combined with a 
+   VectorMecVariable created with lazy = True, peak memory is bounded by the chunk size.
+
    :param vmv:             VectorMecVariable instance
    :param fname_target:    filename of output file (netCDF)
    :param custom_levs:     custom levels of elevation (m)
+   :param chunksize:       number of time steps processed at a time (optional)
+   :param complevel:       zlib compression level 1-9 (optional, default no compression)
+   :param shuffle:         apply shuffle filter when compressing (optional)
+   :param chunking:        'map', 'timeseries' or explicit chunk sizes (optional)
+   :param dtype:           'f4' or 'f8' (optional)
+   :param region:          write only a region on a cropped grid, e.g. 'greenland_box' (optional, see VectorMecVariable)
    :type vmv:              VectorMecVariable
    :type fname_target:     string
    :type custom_levs:      python list
+   :type chunksize:        int
+   :type complevel:        int
+   :type shuffle:          bool
+   :type chunking:         string or tuple
+   :type dtype:            string
+   :type region:           string, dict, numpy array or Region
    """
-   print('INFO: %s: number of vectors = %d' % (rtnnam(), vmv.nvec))
+   if (region is not None):
+      vmv = vmv.subsetRegion(region) # with lazy = True, only the columns in the region are read
+
+   logger.info('number of vectors = %d', vmv.nvec)
 
    if (custom_levs == None):
-      print("INFO: custom levels are NOT used")
-      var3d = vmv.getGridded3d()
+      logger.info("custom levels are NOT used")
       nlev = GLC_NEC
    else:
-      print("INFO: custom levels are used")
-      var3d = vmv.getGridded3dCustomLevels(custom_levs)
+      logger.info("custom levels are used")
       nlev = len(custom_levs)
 
+   if (chunksize == None):
+      chunksize = vmv.ntime # all time steps at once
+
    # Open a new NetCDF file to write the data to. For format, you can choose from
    # 'NETCDF3_CLASSIC', 'NETCDF3_64BIT', 'NETCDF4_CLASSIC', and 'NETCDF4'
    ncfile = Dataset(fname_target, 'w', format='NETCDF4')
-   ncfile.title = 'CESM/CLM glacier elevation class output regridded to 3-dimensional mesh'
-   ncfile.model = "CESM / Community Land Model"
-
-   ncfile.institute = "NCAR / Utrecht University"
-   ncfile.contact = "L.vankampenhout@uu.nl"
-
-   ncfile.history = rtnnam() + " was applied to "+ vmv.fname_vector + " on " +time.strftime("%a %b %d %Y %H:%M:%S")
-   ncfile.softwareURL = "https://github.com/lvankampenhout/libvector"
-   ncfile.netcdf = netCDF4.__netcdf4libversion__
-
-   ncfile.creation_date = time.strftime('%Y-%m-%d %X')
-   #ncfile.frequency = "mon" 
-
-   # Create dimensions
-   ncfile.createDimension('longitude', vmv.nlon)
-   ncfile.createDimension('latitude', vmv.nlat)
-   ncfile.createDimension('time', None)
-   ncfile.createDimension('lev',nlev)
-
-   # Define the coordinate var
-   lons   = ncfile.createVariable('longitude', 'f4', ('longitude',))
-   lats   = ncfile.createVariable('latitude', 'f4', ('latitude',))
-   times    = ncfile.createVariable('time', 'f8', ('time',))
-   levs   = ncfile.createVariable('lev', 'i4', ('lev',))
-
-   # Assign units attributes to coordinate var data
-   lons.units   = "degrees_east"
-   lons.axis = "Y"
-   lats.units   = "degrees_north"
-   lats.axis = "X"
-   #times.units    = "days since 1-01-01 00:00:00"
-   times.units = vmv.time_units
-   
-   levs.units   = "MEC level number"
+   try:
+      ncfile.title = 'CESM/CLM glacier elevation class output regridded to 3-dimensional mesh'
+      ncfile.model = "CESM / Community Land Model"
+
+      ncfile.institute = "NCAR / Utrecht University"
+      ncfile.contact = "L.vankampenhout@uu.nl"
+
+      ncfile.history = rtnnam() + " was applied to "+ vmv.fname_vector + " on " +time.strftime("%a %b %d %Y %H:%M:%S")
+      ncfile.softwareURL = "https://github.com/lvankampenhout/libvector"
+      ncfile.netcdf = netCDF4.__netcdf4libversion__
+
+      ncfile.creation_date = time.strftime('%Y-%m-%d %X')
+      #ncfile.frequency = "mon" 
+
+      # Create dimensions
+      ncfile.createDimension('longitude', vmv.nlon)
+      ncfile.createDimension('latitude', vmv.nlat)
+      ncfile.createDimension('time', None)
+      ncfile.createDimension('lev',nlev)
+
+      # Define the coordinate var
+      lons   = ncfile.createVariable('longitude', 'f4', ('longitude',))
+      lats   = ncfile.createVariable('latitude', 'f4', ('latitude',))
+      times    = ncfile.createVariable('time', 'f8', ('time',))
+      levs   = ncfile.createVariable('lev', 'i4', ('lev',))
 
+      # Assign units attributes to coordinate var data
+      lons.units   = "degrees_east"
+      lons.axis = "Y"
+      lats.units   = "degrees_north"
+      lats.axis = "X"
+      #times.units    = "days since 1-01-01 00:00:00"
+      times.units = vmv.time_units
    
-   # Write data to coordinate var
-   lons[:]    = vmv.lons
-   lats[:]    = vmv.lats
-   #times[:]   = times_
-   times[:] = vmv.time
-   levs[:]    = range(0,nlev)
-
-   # Write custom elevations, if any
-   if (custom_levs == None):
-      ncfile.vertical_levels = "no vertical interpolation was applied; MEC elevation is variable across grid cells"
-   else:
-      ncfile.vertical_levels = "interpolated to user-specified heights"
-      elevation  = ncfile.createVariable('elevation', 'f4', ('lev',))
-      elevation.units = "m"
-      elevation[:]    = custom_levs
-      
+      levs.units   = "MEC level number"
+
    
-   # Write data
+      # Write data to coordinate var
+      lons[:]    = vmv.lons
+      lats[:]    = vmv.lats
+      #times[:]   = times_
+      levs[:]    = range(0,nlev)
 
-   #print(var3d.shape) #(12, 192, 288, 10)
-   var3d = var3d.transpose((0,3,1,2)) # permute columns
-   #print(var3d.shape) #(12, 10, 192, 288)
+      # Write custom elevations, if any
+      if (custom_levs == None):
+         ncfile.vertical_levels = "no vertical interpolation was applied; MEC elevation is variable across grid cells"
+      else:
+         ncfile.vertical_levels = "interpolated to user-specified heights"
+         elevation  = ncfile.createVariable('elevation', 'f4', ('lev',))
+         elevation.units = "m"
+         elevation[:]    = custom_levs
+      
    
-   # Create output variable of correct dimensions
-   # 'f4' stands for floating point 4 bytes, i.e. single precision
-   # change to 'f8' for double precision
-   var            = ncfile.createVariable(vmv.varname,'f4',('time','lev','latitude','longitude',), fill_value=default_fillvals['f4'])
-   var.units      = vmv.units
-   var.long_name  = vmv.long_name
-
-   var[:,:,:,:]   = default_fillvals['f4'] # Initialise with missing value everywhere (will be replaced later)
+      # Layered variables get a layer dimension after time
+      layer_dims, layer_shape = createLayerDimension(ncfile, vmv)
    
-   var[:] = var3d[:]
+      # Create output variable of correct dimensions
+      # 'f4' stands for floating point 4 bytes, i.e. single precision
+      # 'f8' for double precision
+      # No need to initialise with missing value everywhere, unwritten values read as fill value
+      var            = createOutputVariable(ncfile, vmv.varname, ('time',)+layer_dims+('lev','latitude','longitude',), (vmv.ntime,)+layer_shape+(nlev, vmv.nlat, vmv.nlon),
+                           complevel=complevel, shuffle=shuffle, chunking=chunking, dtype=dtype)
+      var.units      = vmv.units
+      var.long_name  = vmv.long_name
+
+      # Write data, appending chunks along the time dimension
+      t0 = 0
+      for chunk in vmv.iterChunks(chunksize):
+         if (custom_levs == None):
+            var3d = chunk.getGridded3d()
+         else:
+            var3d = chunk.getGridded3dCustomLevels(custom_levs)
+
+         #print(var3d.shape) #(12, 192, 288, 10)
+         var3d = np.moveaxis(var3d, -1, -3) # permute columns, lev before lat
+         #print(var3d.shape) #(12, 10, 192, 288)
+
+         t1 = t0 + chunk.ntime
+         with stats.timer('write'):
+            times[t0:t1] = chunk.time
+            var[t0:t1] = fillMissing(var3d, var)
+         stats.count('bytes_written', var3d.nbytes)
+         t0 = t1
    
-   ncfile.close()
+      with stats.timer('write'):
+         ncfile.close()
+   finally:
+      if (ncfile.isopen()):
+         ncfile.close() # also after an error, e.g. in a conversion worker
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: L.vankampenhout@uu.nl
+"""
+import numpy as np
+from netCDF4 import Dataset
+
+from .VectorMecVariable import GLC_NEC
+from .common import nc_lock
+
+MODES = ('2d', '3d')
+
+
+def _griddedChunk(vmv, t0, t1, mode, custom_levs, dtype):
+   """
+   Read, grid (and interpolate) time steps t0 up to t1, missing values become NaN
+   """
+   with nc_lock:
+      chunk = vmv.getChunk(t0, t1)
+
+   if (mode == '2d'):
+      var = chunk.getGridded2d() # time, lat, lon
+   else:
+      if (custom_levs == None):
+         var = chunk.getGridded3d()
+      else:
+         var = chunk.getGridded3dCustomLevels(custom_levs)
+      var = np.moveaxis(var, -1, -3) # time, (layer,) lev, lat, lon
+   return np.ma.filled(var.astype(dtype), np.nan)
+
+
+def vector2xarray(vmv, mode='3d', custom_levs=None, chunksize=1):
+   """
+   Returns a VectorMecVariable as a lazily evaluated gridded xarray DataArray, backed by dask.
+
+   Nothing is read or gridded until values are computed, and then only the time chunks that
+   are needed, so a selection such as da.sel(time='1990-07').sel(lat=slice(60,85)) grids a single
+   chunk. Each chunk is read, gridded and interpolated exactly like the chunks of vector2gridded3d.
+   Combined with a VectorMecVariable created with lazy = True, memory use is bounded by the chunk size.
+   Missing values are NaN. Multiple files can be combined with xarray.concat(..., dim='time').
+
+   xarray and dask are optional dependencies of this package, they are only needed here.
+
+   :param vmv:          VectorMecVariable instance
+   :param mode:         '3d' (see getGridded3d and getGridded3dCustomLevels) or '2d' (see getGridded2d)
+   :param custom_levs:  custom levels of elevation (m), mode '3d' only (optional)
+   :param chunksize:    number of time steps per chunk (optional)
+   :type vmv:           VectorMecVariable
+   :type mode:          string
+   :type custom_levs:   python list
+   :type chunksize:     int
+   :returns:            xarray.DataArray (time, lev, lat, lon) or (time, lat, lon), 
+                        with a layer dimension after time for layered variables
+   """
+   try:
+      import dask
+      import dask.array
+      import xarray
+   except ImportError:
+      raise ImportError('vector2xarray requires the packages xarray and dask')
+
+   if (mode not in MODES):
+      raise ValueError('unknown mode: %s, choose from %s' % (mode, str(MODES)))
+   if (mode == '2d' and custom_levs != None):
+      raise ValueError('custom levels can only be used with mode 3d')
+   if (mode == '2d' and not hasattr(vmv, 'mec_frac')):
+      raise AttributeError('Glacier fraction has not been set in class VectorMecVariable! It is required for mode 2d')
+   if (custom_levs != None and not (hasattr(vmv, 'mec_topo') or hasattr(vmv, 'interp_operator'))):
+      raise AttributeError('Glacier topography has not been set in class VectorMecVariable! It is required for custom levels')
+   if (vmv.ndim == 1):
+      raise ValueError('variable %s is not time indexed' % vmv.varname)
+
+   dtype = np.float32 if (vmv.backend == 'nan') else np.float64
+   if (mode == '2d'):
+      dims = ('time', 'lat', 'lon')
+      shape = (vmv.nlat, vmv.nlon)
+   else:
+      nlev = GLC_NEC if (custom_levs == None) else len(custom_levs)
+      dims = ('time', 'lev', 'lat', 'lon')
+      shape = (nlev, vmv.nlat, vmv.nlon)
+   if (vmv.nlayer != None):
+      dims = dims[:1] + (vmv.layer_dim,) + dims[1:]
+      shape = (vmv.nlayer,) + shape
+
+   chunks = []
+   for t0 in range(0, vmv.ntime, chunksize):
+      t1 = min(t0 + chunksize, vmv.ntime)
+      task = dask.delayed(_griddedChunk)(vmv, t0, t1, mode, custom_levs, dtype)
+      chunks.append(dask.array.from_delayed(task, shape=(t1 - t0,) + shape, dtype=dtype))
+   data = dask.array.concatenate(chunks, axis=0)
+
+   with Dataset(vmv.fname_vector, 'r') as fid:
+      calendar = getattr(fid.variables['time'], 'calendar', 'standard')
+
+   coords = dict(time=('time', np.asarray(vmv.time), dict(units=vmv.time_units, calendar=calendar)),
+                 lat=('lat', np.asarray(vmv.lats), dict(units='degrees_north')),
+                 lon=('lon', np.asarray(vmv.lons), dict(units='degrees_east')))
+   if (vmv.nlayer != None):
+      coords[vmv.layer_dim] = (vmv.layer_dim, np.asarray(vmv.layers), dict(long_name='layer index'))
+   if (mode == '3d'):
+      if (custom_levs == None):
+         coords['lev'] = ('lev', np.arange(GLC_NEC), dict(long_name='MEC level number'))
+      else:
+         coords['lev'] = ('lev', np.asarray(custom_levs, dtype=np.float64), dict(long_name='elevation', units='m'))
+
+   var = xarray.DataArray(data, dims=dims, coords=coords, name=vmv.varname,
+                          attrs=dict(units=vmv.units, long_name=vmv.long_name))
+   return xarray.decode_cf(var.to_dataset())[vmv.varname] # time as dates
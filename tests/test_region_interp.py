@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Regression test: interpolation to custom levels in a region with a hole in its window
+leaves no values in the hole, for operators derived from topography and read from a weight file.
+
+@author: L.vankampenhout@uu.nl
+"""
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from syntheticFiles import generateCase
+
+from libvector import VectorMecVariable
+
+LEVELS = [0., 500., 1000., 2000.]
+WINDOW = (slice(0, 15), slice(10, 40))
+HOLE = (slice(5, 12), slice(10, 23)) # within the window
+
+
+@pytest.fixture(scope='module')
+def case(tmp_path_factory):
+   tmpdir = tmp_path_factory.mktemp('case')
+   fnames = generateCase(str(tmpdir), grid='f19', ntime=2)
+   vmv = VectorMecVariable('QICE', fnames['vector'])
+   vmv.setGlcTopoCouplerFile(fnames['cpl_restart'])
+   fnames['weights'] = str(tmpdir / 'weights.nc')
+   vmv.getInterpOperator(LEVELS).save(fnames['weights'])
+   return fnames
+
+
+@pytest.mark.parametrize('backend', ['masked', 'nan'])
+@pytest.mark.parametrize('source', ['topography', 'weights'])
+def test_region_with_hole(case, backend, source):
+   mask = np.zeros((96, 144), dtype=bool)
+   mask[WINDOW] = True
+   hole = np.zeros(mask[WINDOW].shape, dtype=bool)
+   hole[HOLE] = True
+   mask[WINDOW] &= ~hole
+
+   def interpolate(region):
+      vmv = VectorMecVariable('QICE', case['vector'], backend=backend, region=region)
+      if (source == 'topography'):
+         vmv.setGlcTopoCouplerFile(case['cpl_restart'])
+      else:
+         vmv.setInterpOperator(case['weights'])
+      return vmv.getGridded3dCustomLevels(LEVELS)
+
+   var = interpolate(mask)
+   reference = interpolate(None)[:, WINDOW[0], WINDOW[1]]
+   assert var.shape == reference.shape
+
+   # the hole holds glaciated cells with several MEC columns, none of them may have a value
+   assert np.count_nonzero(~np.isnan(np.ma.filled(reference[:, hole], np.nan))) > 0
+   assert np.all(np.isnan(np.ma.filled(var[:, hole], np.nan)))
+   assert np.array_equal(np.ma.filled(var[:, ~hole], np.nan), np.ma.filled(reference[:, ~hole], np.nan), equal_nan=True)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Regression test: a static (not time indexed) column variable in a vector file with 
+several time steps is written as a single time step by all writers.
+
+@author: L.vankampenhout@uu.nl
+"""
+import os
+import sys
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from syntheticFiles import generateCase
+
+from libvector import VectorMecVariable, vector2gridded2d, vector2gridded3d, vector2gathered3d
+
+NTIME = 6
+
+
+@pytest.fixture(scope='module')
+def case(tmp_path_factory):
+   fnames = generateCase(str(tmp_path_factory.mktemp('case')), grid=(24, 36), ntime=NTIME)
+   with Dataset(fnames['vector'], 'a') as fid:
+      var = fid.createVariable('TOPO_STATIC', 'f4', ('column',), fill_value=1e36)
+      var.long_name = 'static column-level topographic height'
+      var.units = 'm'
+      var[:] = fid.variables['TOPO_COL'][0]
+   return fnames
+
+
+def readStatic(case, lazy):
+   vmv = VectorMecVariable('TOPO_STATIC', case['vector'], lazy=lazy)
+   vmv.setGlcTopoCouplerFile(case['cpl_restart'])
+   vmv.setGlcFracCouplerFile(case['cpl_hist'])
+   return vmv
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+@pytest.mark.parametrize('writer', ['2d', '3d', 'gathered'])
+def test_static_variable(case, tmp_path, writer, lazy):
+   fname_target = str(tmp_path / ('%s.nc' % writer))
+   if (writer == '2d'):
+      vector2gridded2d(readStatic(case, lazy), fname_target, chunksize=2)
+      expected = readStatic(case, False).getGridded2d()
+   elif (writer == '3d'):
+      vector2gridded3d(readStatic(case, lazy), fname_target, chunksize=2)
+      expected = np.moveaxis(readStatic(case, False).getGridded3d(), -1, -3)
+   else:
+      vector2gathered3d(readStatic(case, lazy), fname_target, chunksize=2)
+      expected = None
+
+   with Dataset(fname_target, 'r') as fid:
+      with Dataset(case['vector'], 'r') as fid_vector:
+         assert np.array_equal(fid.variables['time'][:], fid_vector.variables['time'][:1])
+      data = fid.variables['TOPO_STATIC'][:]
+   assert data.shape[0] == 1
+   if (expected is not None):
+      assert data.shape == expected.shape
+      assert np.ma.allclose(data, expected)
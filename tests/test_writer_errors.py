@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Regression test: a writer that fails closes its output file, so that the same
+output can be written again by the same process (e.g. a conversion worker).
+
+@author: L.vankampenhout@uu.nl
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from syntheticFiles import generateCase
+
+from libvector import VectorMecVariable, vector2gridded2d
+from libvector.conversionWorker import runJob
+
+
+@pytest.fixture(scope='module')
+def case(tmp_path_factory):
+   return generateCase(str(tmp_path_factory.mktemp('case')), grid=(24, 36), ntime=2)
+
+
+def test_retry_after_writer_error(case, tmp_path):
+   fname_target = str(tmp_path / 'qice2d.nc')
+   vmv = VectorMecVariable('QICE', case['vector'])
+   with pytest.raises(AttributeError):
+      vector2gridded2d(vmv, fname_target) # no glacier fraction
+   vmv.setGlcFracCouplerFile(case['cpl_hist'])
+   vector2gridded2d(vmv, fname_target)
+
+
+def test_job_without_glacier_fields(case, tmp_path):
+   job = dict(file=case['vector'], variable='QICE', output=str(tmp_path / 'qice.nc'))
+   with pytest.raises(ValueError):
+      runJob(dict(job, mode='2d'))
+   with pytest.raises(ValueError):
+      runJob(dict(job, mode='3d', custom_levs=[0., 500.]))
+   assert not os.path.exists(job['output'])
+   runJob(dict(job, mode='2d', frac_coupler_history=case['cpl_hist']))
+   assert os.path.exists(job['output'])